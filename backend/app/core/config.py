@@ -47,6 +47,8 @@ class Settings(BaseSettings):
     # File Upload
     UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", "app/static/images")
     MAX_FILE_SIZE: int = int(os.getenv("MAX_FILE_SIZE", str(10 * 1024 * 1024)))  # 10MB
+    MAX_BATCH_FILES: int = int(os.getenv("MAX_BATCH_FILES", "200"))
+    MAX_ARCHIVE_FILES: int = int(os.getenv("MAX_ARCHIVE_FILES", "2000"))
 
     @property
     def ALLOWED_EXTENSIONS(self) -> List[str]:
@@ -54,6 +56,95 @@ class Settings(BaseSettings):
         extensions_str = os.getenv("ALLOWED_EXTENSIONS", ".jpg,.jpeg,.png,.gif,.webp")
         return [ext.strip() for ext in extensions_str.split(",")]
 
+    # Storage ("local" keeps files under STORAGE_LOCAL_ROOT; "s3" uses an S3-compatible bucket and needs boto3)
+    STORAGE_BACKEND: str = os.getenv("STORAGE_BACKEND", "local")
+    STORAGE_LOCAL_ROOT: str = os.getenv("STORAGE_LOCAL_ROOT", "app")
+    S3_BUCKET: str = os.getenv("S3_BUCKET", "")
+    S3_PREFIX: str = os.getenv("S3_PREFIX", "")
+    S3_ENDPOINT_URL: str = os.getenv("S3_ENDPOINT_URL", "")  # e.g. http://localhost:9000 for MinIO
+    S3_REGION: str = os.getenv("S3_REGION", "")
+    S3_ACCESS_KEY_ID: str = os.getenv("S3_ACCESS_KEY_ID", "")
+    S3_SECRET_ACCESS_KEY: str = os.getenv("S3_SECRET_ACCESS_KEY", "")
+    S3_PART_SIZE: int = int(os.getenv("S3_PART_SIZE", str(8 * 1024 * 1024)))  # 8MB, at least 5MB
+    S3_URL_EXPIRE_SECONDS: int = int(os.getenv("S3_URL_EXPIRE_SECONDS", "3600"))
+    S3_PUBLIC_URL: str = os.getenv("S3_PUBLIC_URL", "")  # CDN in front of the bucket, used instead of presigned URLs
+
+    # Private delivery
+    ACCEL_REDIRECT_PREFIX: str = os.getenv("ACCEL_REDIRECT_PREFIX", "")  # e.g. /_protected/ when nginx fronts the API
+    PRIVATE_URL_EXPIRE_SECONDS: int = int(os.getenv("PRIVATE_URL_EXPIRE_SECONDS", "300"))  # presigned links to private files
+    SIGNED_URL_EXPIRE_SECONDS: int = int(os.getenv("SIGNED_URL_EXPIRE_SECONDS", str(7 * 24 * 3600)))  # default lifetime of shared links
+    SIGNED_URL_MAX_EXPIRE_SECONDS: int = int(os.getenv("SIGNED_URL_MAX_EXPIRE_SECONDS", str(90 * 24 * 3600)))
+
+    # Resumable Uploads
+    UPLOAD_SESSION_DIR: str = os.getenv("UPLOAD_SESSION_DIR", "app/uploads/sessions")
+    UPLOAD_SESSION_EXPIRE_HOURS: int = int(os.getenv("UPLOAD_SESSION_EXPIRE_HOURS", "24"))
+    MAX_RESUMABLE_FILE_SIZE: int = int(os.getenv("MAX_RESUMABLE_FILE_SIZE", str(500 * 1024 * 1024)))  # 500MB
+    MAX_UPLOAD_CHUNK_SIZE: int = int(os.getenv("MAX_UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))  # 8MB
+
+    # Image Processing
+    VARIANT_DIR: str = os.getenv("VARIANT_DIR", "app/static/images/variants")
+    VARIANT_QUALITY: int = int(os.getenv("VARIANT_QUALITY", "82"))
+    IMAGE_WORKERS: int = int(os.getenv("IMAGE_WORKERS", "2"))
+    IMAGE_ENGINE: str = os.getenv("IMAGE_ENGINE", "auto")  # pillow, vips, or auto (vips when pyvips and libvips are installed)
+    IMAGE_WORKER_MAX_MEMORY_BYTES: int = int(os.getenv("IMAGE_WORKER_MAX_MEMORY_BYTES", str(4 * 1024 * 1024 * 1024)))  # 4GB address space per worker, 0 for no limit
+    MAX_IMAGE_PIXELS: int = int(os.getenv("MAX_IMAGE_PIXELS", "150000000"))  # larger images are rejected from their header
+    FFMPEG_BINARY: str = os.getenv("FFMPEG_BINARY", "ffmpeg")  # encodes animations as looping MP4 when installed; empty to turn off
+    PLACEHOLDER_SIZE: int = int(os.getenv("PLACEHOLDER_SIZE", "20"))  # long edge of inline previews (px)
+    PALETTE_SIZE: int = int(os.getenv("PALETTE_SIZE", "5"))
+    COLOR_MATCH_DISTANCE: float = float(os.getenv("COLOR_MATCH_DISTANCE", "20"))  # CIE76 delta E
+    DUPLICATE_HASH_DISTANCE: int = int(os.getenv("DUPLICATE_HASH_DISTANCE", "6"))  # max differing bits of 64 (<= 10)
+
+    @property
+    def VARIANT_WIDTHS(self) -> List[int]:
+        """Get long-edge sizes (in px) of the derivatives generated for each upload"""
+        widths_str = os.getenv("VARIANT_WIDTHS", "320,640,1280,2048")
+        return sorted(int(w.strip()) for w in widths_str.split(",") if w.strip())
+
+    @property
+    def MODERN_FORMATS(self) -> List[str]:
+        """Get the alternate encodings kept for each image (skipped if Pillow cannot encode them)"""
+        formats_str = os.getenv("MODERN_FORMATS", "avif,webp")
+        return [fmt.strip().lower() for fmt in formats_str.split(",") if fmt.strip()]
+
+    # Hero slide crops
+    @property
+    def HERO_CROP_ASPECT_RATIOS(self) -> List[str]:
+        """Get the aspect ratios each hero slide is cropped to (e.g. 16:9 for desktop, 4:5 for phones)"""
+        ratios_str = os.getenv("HERO_CROP_ASPECT_RATIOS", "16:9,4:5")
+        return [ratio.strip() for ratio in ratios_str.split(",") if ratio.strip()]
+
+    @property
+    def HERO_CROP_WIDTHS(self) -> List[int]:
+        """Get the widths (in px) each hero slide crop is saved at"""
+        widths_str = os.getenv("HERO_CROP_WIDTHS", "640,1080,1920")
+        return sorted(int(w.strip()) for w in widths_str.split(",") if w.strip())
+
+    # Watermarking of public images (off while WATERMARK_IMAGE is empty)
+    WATERMARK_IMAGE: str = os.getenv("WATERMARK_IMAGE", "")  # logo file, ideally a PNG with transparency
+    WATERMARK_OPACITY: float = float(os.getenv("WATERMARK_OPACITY", "0.5"))
+    WATERMARK_POSITION: str = os.getenv("WATERMARK_POSITION", "bottom-right")  # top-left, top-right, bottom-left, bottom-right, center or tile
+    WATERMARK_SCALE: float = float(os.getenv("WATERMARK_SCALE", "0.2"))  # logo width as a fraction of the image width
+    WATERMARK_MARGIN: float = float(os.getenv("WATERMARK_MARGIN", "0.03"))  # gap to the edges, as a fraction of the image width
+    WATERMARK_MIN_WIDTH: int = int(os.getenv("WATERMARK_MIN_WIDTH", "400"))  # narrower thumbnails are served as they are
+
+    # On-demand transforms
+    TRANSFORM_CACHE_DIR: str = os.getenv("TRANSFORM_CACHE_DIR", "app/cache/transforms")
+    TRANSFORM_CACHE_MAX_BYTES: int = int(os.getenv("TRANSFORM_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))  # 512MB
+    TRANSFORM_MAX_DIMENSION: int = int(os.getenv("TRANSFORM_MAX_DIMENSION", "4096"))
+
+    # Background Jobs
+    RUN_JOB_WORKER_IN_APP: bool = os.getenv("RUN_JOB_WORKER_IN_APP", "true").lower() == "true"
+    JOB_CONCURRENCY: int = int(os.getenv("JOB_CONCURRENCY", "2"))
+    JOB_POLL_INTERVAL: float = float(os.getenv("JOB_POLL_INTERVAL", "2"))  # seconds between polls when idle
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+    JOB_RETRY_BASE_SECONDS: int = int(os.getenv("JOB_RETRY_BASE_SECONDS", "10"))  # doubled after each failure
+    JOB_TIMEOUT_SECONDS: int = int(os.getenv("JOB_TIMEOUT_SECONDS", "600"))
+    JOB_DRAIN_SECONDS: int = int(os.getenv("JOB_DRAIN_SECONDS", "30"))  # grace period for running jobs on shutdown
+
+    # Storage reconciliation
+    RECONCILE_WORKERS: int = int(os.getenv("RECONCILE_WORKERS", "8"))  # threads for stat/hash/delete calls
+    RECONCILE_ORPHAN_GRACE_SECONDS: int = int(os.getenv("RECONCILE_ORPHAN_GRACE_SECONDS", "86400"))  # newer files are never orphans
+
     # Server
     HOST: str = os.getenv("HOST", "0.0.0.0")
     PORT: int = int(os.getenv("PORT", "8000"))
@@ -6,8 +6,12 @@ from starlette.responses import JSONResponse
 from starlette import status as http_status
 
 from app.core.config import settings
-from app.routers import auth, images, categories, testimonials, hero_slides, social_media, business_hours, contact_details
+from app.routers import auth, images, categories, testimonials, hero_slides, social_media, business_hours, contact_details, media, uploads, jobs
+from app.services.job_worker import start_app_worker, stop_app_worker
 from app.utils.api_response import error_response
+from app.utils.processing import shutdown_process_pool
+from app.utils.engines import get_engine
+from app.utils.watermark import get_watermark
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -23,9 +27,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files
+# Stored images get their own route with conditional and range request
+# support (or a redirect to remote storage); the mount serves anything else
+app.include_router(media.static_router, prefix="/static/images", tags=["media"])
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
+# On-demand image transforms, served next to the static originals
+app.include_router(media.router, prefix="/media", tags=["media"])
+
+@app.on_event("startup")
+async def check_image_settings():
+    # Fail at startup on a missing watermark logo or bad settings, not on the first image
+    get_watermark()
+    get_engine()
+
+@app.on_event("startup")
+async def start_background_jobs():
+    if settings.RUN_JOB_WORKER_IN_APP:
+        start_app_worker()
+
+@app.on_event("shutdown")
+async def shutdown_image_processing():
+    # Let running jobs finish before their processing pool goes away
+    await stop_app_worker()
+    shutdown_process_pool()
+
 # Global exception handlers for unified error envelope
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -62,23 +88,31 @@ async def http_exception_handler(request: Request, exc: HTTPException):
         404: "RESOURCE_NOT_FOUND",
         405: "METHOD_NOT_ALLOWED",
         409: "CONFLICT",
+        413: "PAYLOAD_TOO_LARGE",
         415: "UNSUPPORTED_MEDIA_TYPE",
         422: "INPUT_VALIDATION_FAILED",
         429: "RATE_LIMIT_EXCEEDED",
         500: "INTERNAL_SERVER_ERROR",
+        503: "SERVICE_UNAVAILABLE",
     }
     code = code_map.get(status_code, "HTTP_ERROR")
     description = exc.detail if isinstance(exc.detail, str) else "An HTTP error occurred."
-    return error_response(
+    response = error_response(
         status=status_code,
         code=code,
         description=description,
         message=description,
     )
+    # e.g. Retry-After or WWW-Authenticate
+    if exc.headers:
+        response.headers.update(exc.headers)
+    return response
 
 # Include routers
 app.include_router(auth.router, prefix="/api/auth", tags=["authentication"])
 app.include_router(images.router, prefix="/api/images", tags=["images"])
+app.include_router(uploads.router, prefix="/api/uploads", tags=["uploads"])
+app.include_router(jobs.router, prefix="/api/jobs", tags=["jobs"])
 app.include_router(categories.router, prefix="/api/categories", tags=["categories"])
 app.include_router(testimonials.router, prefix="/api/testimonials", tags=["testimonials"])
 app.include_router(hero_slides.router, prefix="/api/hero-slides", tags=["hero-slides"])
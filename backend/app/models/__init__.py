@@ -7,5 +7,7 @@ from .hero_slide import HeroSlide
 from .social_media import SocialMedia
 from .business_hours import BusinessHours
 from .contact_details import ContactDetails
+from .upload_session import UploadSession
+from .job import Job
 
-__all__ = ["User", "Image", "RefreshToken", "Category", "Testimonial", "HeroSlide", "SocialMedia", "BusinessHours", "ContactDetails"]
\ No newline at end of file
+__all__ = ["User", "Image", "RefreshToken", "Category", "Testimonial", "HeroSlide", "SocialMedia", "BusinessHours", "ContactDetails", "UploadSession", "Job"]
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Float, ForeignKey
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 
@@ -15,6 +15,10 @@ class HeroSlide(Base):
     button_link = Column(String)
     is_active = Column(Boolean, default=True)
     sort_order = Column(Integer, default=0)
+    focal_x = Column(Float)  # admin-set point to keep in frame, as fractions of the image size
+    focal_y = Column(Float)
+    crops = Column(Text)  # JSON: aspect ratio -> crop box and sized variants
+    crops_key = Column(String(64))  # fingerprint of the image and settings the crops were made from
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
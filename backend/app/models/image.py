@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, Float, String, Text, DateTime, ForeignKey, Boolean
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 
@@ -14,6 +14,27 @@ class Image(Base):
     file_path = Column(String, nullable=False)
     file_size = Column(Integer)
     mime_type = Column(String)
+    content_hash = Column(String(64), index=True)  # hex SHA-256 of the file; files are shared by hash
+    perceptual_hash = Column(String(16), index=True)  # hex 64-bit dHash for near-duplicate detection
+    processing_status = Column(String, default="ready", server_default="ready")  # pending, processing, ready, failed
+    variants = Column(Text)  # JSON list of resized derivatives (width, height, path, formats)
+    encodings = Column(Text)  # JSON map of full-size alternate encodings (e.g. webp, avif)
+    animation = Column(Text)  # JSON frames, duration, loop, poster and optional looping video of animated images
+    placeholder = Column(Text)  # tiny base64 JPEG data URI shown while the image loads
+    dominant_color = Column(String(7))  # "#rrggbb"
+    palette = Column(String)  # "#rrggbb:weight" pairs, largest first, e.g. "#e0b090:0.420,#3a2b20:0.310"
+    width = Column(Integer)  # display size in px, after EXIF orientation
+    height = Column(Integer)
+    aspect_ratio = Column(Float)  # width / height
+    captured_at = Column(DateTime, index=True)  # EXIF DateTimeOriginal (camera local time)
+    camera_make = Column(String)
+    camera_model = Column(String)
+    lens_model = Column(String)
+    focal_length = Column(Float)  # mm
+    f_number = Column(Float)
+    exposure_time = Column(String)  # e.g. "1/250"
+    iso = Column(Integer)
+    orientation = Column(Integer)  # EXIF orientation of the original; derivatives are already upright
     category = Column(String)  # Keep for backward compatibility
     tags = Column(String)  # JSON string or comma-separated
     is_featured = Column(Boolean, default=False)
@@ -0,0 +1,36 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index
+from sqlalchemy.sql import func
+from sqlalchemy.orm import relationship
+
+from app.db.base import Base
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    type = Column(String, nullable=False)  # handler name, e.g. "process_image"
+    payload = Column(Text, nullable=False, default="{}")  # JSON arguments for the handler
+    status = Column(String, nullable=False, default="queued")  # queued, running, succeeded, failed
+    priority = Column(Integer, nullable=False, default=0)  # higher runs first
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_at = Column(DateTime, nullable=False)  # UTC; not claimed before this (retry backoff)
+    dedupe_key = Column(String, index=True)  # at most one queued/running job per key
+    locked_by = Column(String)  # worker that claimed the job
+    locked_at = Column(DateTime)
+    result = Column(Text)  # JSON returned by the handler
+    last_error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    finished_at = Column(DateTime)
+
+    # Foreign Keys
+    created_by_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"))
+
+    # Relationships
+    created_by = relationship("User")
+
+    __table_args__ = (
+        # Serves the claim query: next queued job by priority and due time
+        Index("ix_jobs_claim", "status", "priority", "run_at"),
+    )
@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, ForeignKey
+from sqlalchemy.sql import func
+from sqlalchemy.orm import relationship
+
+from app.db.base import Base
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+
+    id = Column(String, primary_key=True, index=True)  # uuid4 hex
+    filename = Column(String, nullable=False)
+    content_type = Column(String)
+    total_size = Column(BigInteger, nullable=False)
+    received_size = Column(BigInteger, default=0, nullable=False)
+    image_data = Column(Text, nullable=False)  # JSON of the ImageCreate fields
+    status = Column(String, default="active", nullable=False)  # active, completed, failed
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    # Foreign Keys
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    image_id = Column(Integer, ForeignKey("images.id", ondelete="SET NULL"))
+
+    # Relationships
+    owner = relationship("User")
+    image = relationship("Image")
@@ -1,3 +1,3 @@
-from . import auth, images, categories, testimonials, hero_slides, social_media, business_hours, contact_details
+from . import auth, images, categories, testimonials, hero_slides, social_media, business_hours, contact_details, media, uploads, jobs
 
-__all__ = ["auth", "images", "categories", "testimonials", "hero_slides", "social_media", "business_hours", "contact_details"]
+__all__ = ["auth", "images", "categories", "testimonials", "hero_slides", "social_media", "business_hours", "contact_details", "media", "uploads", "jobs"]
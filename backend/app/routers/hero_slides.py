@@ -1,12 +1,14 @@
 from typing import List
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 
 from app.db.session import get_db
 from app.models.hero_slide import HeroSlide
 from app.models.image import Image
 from app.schemas.hero_slide import HeroSlide as HeroSlideSchema, HeroSlideCreate, HeroSlideUpdate
 from app.services.auth_service import get_current_admin_user
+from app.services.hero_slide_service import HeroSlideService, crop_paths
+from app.services.job_service import notify_job_workers
 from app.models.user import User
 from app.utils.api_response import ok, created, error_response
 
@@ -19,13 +21,15 @@ def get_hero_slides(
     active_only: bool = True,
     db: Session = Depends(get_db)
 ):
-    """Get all hero slides"""
-    query = db.query(HeroSlide)
+    """Get all hero slides, with crops of their image for each configured aspect ratio"""
+    # Load images in the same query; each slide embeds its image's placeholder
+    query = db.query(HeroSlide).options(joinedload(HeroSlide.image))
     if active_only:
         query = query.filter(HeroSlide.is_active == True)
     
     slides = query.order_by(HeroSlide.sort_order, HeroSlide.created_at.desc()).offset(skip).limit(limit).all()
-    return ok(slides, message="Hero slides retrieved successfully.")
+    slides_out = [HeroSlideSchema.from_orm(slide) for slide in slides]
+    return ok(slides_out, message="Hero slides retrieved successfully.")
 
 @router.get("/{slide_id}")
 def get_hero_slide(
@@ -33,7 +37,7 @@ def get_hero_slide(
     db: Session = Depends(get_db)
 ):
     """Get a specific hero slide"""
-    slide = db.query(HeroSlide).filter(HeroSlide.id == slide_id).first()
+    slide = db.query(HeroSlide).options(joinedload(HeroSlide.image)).filter(HeroSlide.id == slide_id).first()
     if not slide:
         return error_response(
             status=404,
@@ -41,7 +45,7 @@ def get_hero_slide(
             description="Hero slide not found",
             message="The requested hero slide does not exist."
         )
-    return ok(slide, message="Hero slide details retrieved successfully.")
+    return ok(HeroSlideSchema.from_orm(slide), message="Hero slide details retrieved successfully.")
 
 @router.post("/")
 def create_hero_slide(
@@ -62,9 +66,12 @@ def create_hero_slide(
 
     db_slide = HeroSlide(**slide.dict())
     db.add(db_slide)
+    db.flush()
+    HeroSlideService(db).enqueue_crops(db_slide)
     db.commit()
     db.refresh(db_slide)
-    return created(db_slide, message="Hero slide created successfully.")
+    notify_job_workers()
+    return created(HeroSlideSchema.from_orm(db_slide), message="Hero slide created successfully.")
 
 @router.put("/{slide_id}")
 def update_hero_slide(
@@ -99,9 +106,15 @@ def update_hero_slide(
     for field, value in update_data.items():
         setattr(db_slide, field, value)
 
+    # Recropped in the background if the image or focal point changed;
+    # the current crops are served until then
+    db.flush()
+    db.refresh(db_slide)
+    HeroSlideService(db).enqueue_crops(db_slide)
     db.commit()
     db.refresh(db_slide)
-    return ok(db_slide, message="Hero slide updated successfully.")
+    notify_job_workers()
+    return ok(HeroSlideSchema.from_orm(db_slide), message="Hero slide updated successfully.")
 
 @router.delete("/{slide_id}")
 def delete_hero_slide(
@@ -119,6 +132,8 @@ def delete_hero_slide(
             message="The requested hero slide does not exist."
         )
     
+    paths = crop_paths(db_slide.crops)
     db.delete(db_slide)
     db.commit()
+    HeroSlideService(db).delete_unused_crops(paths)
     return ok(message="Hero slide deleted successfully.")
@@ -1,13 +1,21 @@
+from datetime import datetime
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi import APIRouter, Depends, Header, HTTPException, status, UploadFile, File, Form, Path, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from app.db.session import get_db
-from app.schemas.image import Image, ImageOut, ImageCreate, ImageUpdate
+from app.schemas.image import (
+    Image, ImageOut, ImageCreate, ImageUpdate, ImageHashCheck, ImageSort, ImageBatchCreate, BatchUploadResult,
+    SignedUrlRequest, StorageReconcileRequest,
+)
+from app.schemas.job import JobOut
 from app.schemas.user import User
-from app.services.auth_service import AuthService
+from app.services.auth_service import AuthService, get_current_admin_user, get_optional_user
 from app.services.image_service import ImageService
-from app.utils.api_response import ok, created, error_response
+from app.services.reconciliation_service import ReconciliationService
+from app.utils.api_response import ok, created, error_response, build_response
+from app.utils.file_responses import deliver_stored_file
 
 router = APIRouter()
 
@@ -18,9 +26,19 @@ async def get_images(
     category: Optional[str] = None,
     is_featured: Optional[bool] = None,
     is_thumbnail: Optional[bool] = None,
+    captured_after: Optional[datetime] = None,
+    captured_before: Optional[datetime] = None,
+    sort: Optional[ImageSort] = None,
+    color: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    """Get all public images with optional filtering"""
+    """Get all public images with optional filtering.
+
+    ``captured_after``/``captured_before`` filter on the EXIF capture date;
+    ``sort`` orders by ``captured_at`` or ``created_at``, prefixed with "-"
+    for newest first. ``color`` (hex code or name, e.g. ``#d9a066`` or
+    ``orange``) keeps images with a similar palette colour, closest first.
+    """
     image_service = ImageService(db)
     images = await image_service.get_images(
         skip=skip, 
@@ -28,12 +46,53 @@ async def get_images(
         category=category, 
         is_featured=is_featured,
         is_thumbnail=is_thumbnail,
+        captured_after=captured_after,
+        captured_before=captured_before,
+        sort=sort,
+        color=color,
         public_only=True
     )
     images_out = [ImageOut.from_orm(img) for img in images]
 
     return ok(images_out, message="Images retrieved.")
 
+@router.get("/layout")
+async def get_gallery_layout(
+    container_width: int = Query(..., ge=100, le=10000),
+    target_row_height: int = Query(300, ge=50, le=2000),
+    spacing: int = Query(8, ge=0, le=100),
+    skip: int = 0,
+    limit: int = 100,
+    category: Optional[str] = None,
+    is_featured: Optional[bool] = None,
+    captured_after: Optional[datetime] = None,
+    captured_before: Optional[datetime] = None,
+    sort: Optional[ImageSort] = None,
+    color: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Get public images laid out in justified rows for a container width.
+
+    Every box carries its image, so the grid can be rendered before any
+    image bytes arrive.
+    """
+    image_service = ImageService(db)
+    layout = await image_service.get_gallery_layout(
+        container_width,
+        target_row_height=target_row_height,
+        spacing=spacing,
+        skip=skip,
+        limit=limit,
+        category=category,
+        is_featured=is_featured,
+        captured_after=captured_after,
+        captured_before=captured_before,
+        sort=sort,
+        color=color,
+        public_only=True
+    )
+    return ok(layout, message="Gallery layout retrieved.")
+
 @router.get("/my-images")
 async def get_my_images(
     skip: int = 0,
@@ -46,6 +105,108 @@ async def get_my_images(
     images = await image_service.get_user_images(current_user.id, skip=skip, limit=limit)
     return ok(images, message="Your images retrieved.")
 
+@router.get("/download")
+async def download_images(
+    category: Optional[str] = None,
+    ids: Optional[List[int]] = Query(None),
+    current_user: Optional[User] = Depends(get_optional_user),
+    db: Session = Depends(get_db)
+):
+    """Download the originals of a category (``category``) or a selection (``ids=1&ids=2``) as a ZIP.
+
+    The archive is streamed while it is built. Anonymous requests get
+    public images only; logged-in users also get their own private images.
+    """
+    image_service = ImageService(db)
+    archive = await image_service.stream_archive(current_user, category=category, image_ids=ids)
+    filename = "".join(c for c in category or "" if c.isalnum() or c in "-_") or "images"
+    return StreamingResponse(
+        archive,
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}.zip"'},
+    )
+
+@router.get("/duplicates")
+async def get_duplicate_clusters(
+    max_distance: Optional[int] = Query(None, ge=0, le=10),
+    current_user: User = Depends(get_current_admin_user),
+    db: Session = Depends(get_db)
+):
+    """List clusters of near-identical images across the whole library (admin only).
+
+    Images are grouped when their perceptual hashes differ by at most
+    ``max_distance`` bits (``DUPLICATE_HASH_DISTANCE`` by default).
+    """
+    image_service = ImageService(db)
+    clusters = await image_service.get_duplicate_clusters(max_distance)
+    return ok(clusters, message="Duplicate clusters retrieved.", meta={"clusters": len(clusters)})
+
+@router.post("/reconcile")
+async def reconcile_storage(
+    request: StorageReconcileRequest,
+    current_user: User = Depends(get_current_admin_user),
+    db: Session = Depends(get_db)
+):
+    """Check stored files against the images table in the background (admin only).
+
+    The job's result lists orphan files (removed with ``remove_orphans``)
+    and images whose files are missing or whose size or hash changed.
+    """
+    reconciliation_service = ReconciliationService(db)
+    job = reconciliation_service.enqueue(request.remove_orphans, request.verify_hashes, current_user.id)
+    return build_response(
+        http_status=status.HTTP_202_ACCEPTED,
+        success=True,
+        message="Storage reconciliation queued.",
+        data=JobOut.from_orm(job),
+    )
+
+@router.get("/hashes/{content_hash}")
+async def check_image_hash(
+    content_hash: str = Path(..., regex="^[0-9a-fA-F]{64}$"),
+    current_user: User = Depends(AuthService.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Check whether a file with this SHA-256 is already stored, so the upload can be skipped.
+
+    Only images the user may see are considered, and ``image_id`` is only
+    given for the user's own image.
+    """
+    image_service = ImageService(db)
+    existing = await image_service.get_viewable_image_by_hash(content_hash, current_user)
+    result = ImageHashCheck(
+        content_hash=content_hash.lower(),
+        exists=existing is not None,
+        image_id=existing.id if existing and existing.owner_id == current_user.id else None,
+    )
+    return ok(result, message="Hash checked.")
+
+@router.post("/hashes/{content_hash}")
+async def create_image_from_hash(
+    image_data: ImageCreate,
+    content_hash: str = Path(..., regex="^[0-9a-fA-F]{64}$"),
+    current_user: User = Depends(AuthService.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Create an image from a file that is already stored, without uploading it again"""
+    image_service = ImageService(db)
+    image = await image_service.create_image_from_hash(image_data, content_hash, current_user)
+    return created(ImageOut.from_orm(image), message="Image uploaded.")
+
+@router.post("/signed-urls")
+async def create_signed_urls(
+    request: SignedUrlRequest,
+    current_user: User = Depends(AuthService.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Create expiring links to images' files that work without logging in, e.g. for a proofing gallery.
+
+    Private images can only be linked by their owner or an admin.
+    """
+    image_service = ImageService(db)
+    signed = await image_service.create_signed_urls(request, current_user)
+    return ok(signed, message="Signed links created.")
+
 @router.get("/{image_id}")
 async def get_image(
     image_id: int,
@@ -66,6 +227,34 @@ async def get_image(
     from app.schemas.image import ImageOut
     return ok(ImageOut.from_orm(image), message="Image details retrieved.")
 
+@router.get("/{image_id}/file")
+async def get_image_file(
+    image_id: int,
+    width: Optional[int] = Query(None, ge=1),
+    accept: Optional[str] = Header(None),
+    current_user: User = Depends(AuthService.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get an image's original file, or one of its variants with ``width``, including private images.
+
+    Private images are only available to their owner and admins. The API
+    only checks access; behind nginx the bytes are sent by nginx through
+    an X-Accel-Redirect.
+    """
+    image_service = ImageService(db)
+    image = await image_service.get_image(image_id)
+    if not image_service.can_view(image, current_user):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+
+    headers = {"Cache-Control": "private, max-age=3600"}
+    if width is None:
+        return await deliver_stored_file(image.file_path, image.mime_type, headers)
+    key, media_type = await image_service.get_variant_encoding(image, width, accept)
+    return await deliver_stored_file(key, media_type, {**headers, "Vary": "Accept"})
+
 @router.post("/")
 async def upload_image(
     file: UploadFile = File(...),
@@ -97,7 +286,109 @@ async def upload_image(
         is_thumbnail=is_thumbnail
     )
     image = await image_service.create_image(image_data, file, current_user.id)
-    return created(image, message="Image uploaded.")
+
+    # Derivatives are generated in the background; the job's result lists
+    # near-duplicates once the image's perceptual hash is known
+    job = image_service.get_processing_job(image)
+    if job:
+        return created(
+            ImageOut.from_orm(image),
+            message="Image uploaded. Processing continues in the background.",
+            meta={"job_id": job.id},
+        )
+
+    # Warn about near-identical images (e.g. other frames of a burst) without rejecting the upload
+    near_duplicates = await image_service.find_near_duplicates(image)
+    if near_duplicates:
+        return created(
+            ImageOut.from_orm(image),
+            message=f"Image uploaded. It looks nearly identical to {len(near_duplicates)} existing image(s).",
+            meta={"near_duplicates": near_duplicates},
+        )
+    return created(ImageOut.from_orm(image), message="Image uploaded.")
+
+@router.post("/batch")
+async def upload_images(
+    files: List[UploadFile] = File(...),
+    title: Optional[str] = Form(None),
+    description: Optional[str] = Form(None),
+    category: Optional[str] = Form(None),
+    tags: Optional[str] = Form(None),
+    is_featured: bool = Form(False),
+    is_public: bool = Form(True),
+    is_hero_image: bool = Form(False),
+    is_profile_picture: bool = Form(False),
+    is_thumbnail: bool = Form(False),
+    category_id: Optional[int] = Form(None),
+    current_user: User = Depends(AuthService.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Upload many images at once, sharing the given metadata.
+
+    Titles default to the file names. Every file gets its own result, so
+    one bad file doesn't fail the rest of the batch.
+    """
+    image_service = ImageService(db)
+    image_data = ImageBatchCreate(
+        title=title,
+        description=description,
+        category=category,
+        tags=tags,
+        is_featured=is_featured,
+        is_public=is_public,
+        is_hero_image=is_hero_image,
+        is_profile_picture=is_profile_picture,
+        category_id=category_id,
+        is_thumbnail=is_thumbnail
+    )
+    results = await image_service.create_images(image_data, files, current_user.id)
+    return _batch_response(results)
+
+@router.post("/archive")
+async def upload_archive(
+    file: UploadFile = File(...),
+    title: Optional[str] = Form(None),
+    description: Optional[str] = Form(None),
+    category: Optional[str] = Form(None),
+    tags: Optional[str] = Form(None),
+    is_featured: bool = Form(False),
+    is_public: bool = Form(True),
+    is_hero_image: bool = Form(False),
+    is_profile_picture: bool = Form(False),
+    is_thumbnail: bool = Form(False),
+    category_id: Optional[int] = Form(None),
+    current_user: User = Depends(AuthService.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Upload a ZIP archive of images (e.g. an exported shoot), sharing the given metadata.
+
+    Every image file in the archive gets its own result; titles default to
+    the file names.
+    """
+    image_service = ImageService(db)
+    image_data = ImageBatchCreate(
+        title=title,
+        description=description,
+        category=category,
+        tags=tags,
+        is_featured=is_featured,
+        is_public=is_public,
+        is_hero_image=is_hero_image,
+        is_profile_picture=is_profile_picture,
+        category_id=category_id,
+        is_thumbnail=is_thumbnail
+    )
+    results = await image_service.create_images_from_archive(image_data, file, current_user.id)
+    return _batch_response(results)
+
+def _batch_response(results: List[BatchUploadResult]):
+    uploaded = sum(result.success for result in results)
+    meta = {"uploaded": uploaded, "failed": len(results) - uploaded}
+    if not uploaded:
+        return build_response(
+            http_status=400, success=False, message="No images were uploaded.", data=results, meta=meta
+        )
+    return created(results, message=f"{uploaded} of {len(results)} images uploaded.", meta=meta)
 
 @router.put("/{image_id}")
 async def update_image(
@@ -0,0 +1,58 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.orm import Session
+
+from app.db.session import get_db
+from app.schemas.job import JobOut, JobStatus
+from app.schemas.user import User
+from app.services.auth_service import AuthService, get_current_admin_user
+from app.services.job_service import JobService
+from app.utils.api_response import ok
+
+router = APIRouter()
+
+@router.get("/")
+async def get_jobs(
+    skip: int = 0,
+    limit: int = 100,
+    job_status: Optional[JobStatus] = Query(None, alias="status"),
+    job_type: Optional[str] = Query(None, alias="type"),
+    current_user: User = Depends(get_current_admin_user),
+    db: Session = Depends(get_db)
+):
+    """List background jobs, newest first (admin only)"""
+    job_service = JobService(db)
+    jobs = job_service.get_jobs(
+        skip=skip,
+        limit=limit,
+        job_status=job_status.value if job_status else None,
+        job_type=job_type
+    )
+    return ok([JobOut.from_orm(job) for job in jobs], message="Jobs retrieved.")
+
+@router.get("/{job_id}")
+async def get_job(
+    job_id: int,
+    current_user: User = Depends(AuthService.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get a background job's status and result (its creator or an admin)"""
+    job_service = JobService(db)
+    job = job_service.get_job(job_id)
+    if job.created_by_id != current_user.id and not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    return ok(JobOut.from_orm(job), message="Job retrieved.")
+
+@router.post("/{job_id}/retry")
+async def retry_job(
+    job_id: int,
+    current_user: User = Depends(get_current_admin_user),
+    db: Session = Depends(get_db)
+):
+    """Requeue a failed job (admin only)"""
+    job_service = JobService(db)
+    job = job_service.retry(job_id)
+    return ok(JobOut.from_orm(job), message="Job requeued.")
@@ -0,0 +1,184 @@
+import os
+import time
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.responses import RedirectResponse
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.utils.security import verify_file_signature
+from app.db.session import get_db
+from app.models.image import Image
+from app.models.user import User
+from app.schemas.image import ImageFit, ImageFormat
+from app.services.auth_service import get_optional_user
+from app.services.image_service import ImageService
+from app.utils.file_responses import StoredFileResponse, deliver_stored_file, stored_file_response
+from app.utils.storage import IMMUTABLE_CACHE_CONTROL, get_storage
+from app.utils.watermark import get_watermark
+
+router = APIRouter()
+
+async def _image_response(path: str, media_type: str, negotiated: bool) -> StoredFileResponse:
+    # Stored files never change, so clients may cache them indefinitely
+    headers = {"Cache-Control": "public, max-age=31536000"}
+    if negotiated:
+        # The format depends on the Accept header, so shared caches must key on it
+        headers["Vary"] = "Accept"
+    return await stored_file_response(path, media_type, headers)
+
+def _storage_redirect(key: str, headers: Optional[dict] = None) -> RedirectResponse:
+    """Send the client to a file in remote storage"""
+    # Presigned URLs expire, so the redirect itself must not be cached for long
+    headers = {**(headers or {}), "Cache-Control": f"private, max-age={settings.S3_URL_EXPIRE_SECONDS // 2}"}
+    return RedirectResponse(get_storage().url(key), status_code=status.HTTP_307_TEMPORARY_REDIRECT, headers=headers)
+
+async def _stored_image_response(key: str, media_type: str, negotiated: bool):
+    """Serve a file from storage, or send the client to it when it lives in remote storage"""
+    path = get_storage().local_path(key)
+    if path:
+        return await _image_response(path, media_type, negotiated)
+    return _storage_redirect(key, {"Vary": "Accept"} if negotiated else None)
+
+async def _get_public_image(image_service: ImageService, image_id: int) -> Image:
+    image = await image_service.get_image(image_id)
+    if not image.is_public:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Image not found"
+        )
+    return image
+
+@router.get("/images/{image_id}")
+async def get_transformed_image(
+    image_id: int,
+    width: Optional[int] = Query(None, ge=1, le=settings.TRANSFORM_MAX_DIMENSION),
+    height: Optional[int] = Query(None, ge=1, le=settings.TRANSFORM_MAX_DIMENSION),
+    fit: ImageFit = ImageFit.contain,
+    quality: Optional[int] = Query(None, ge=1, le=100),
+    format: Optional[ImageFormat] = None,
+    accept: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """Serve a public image, resized, cropped and/or re-encoded on demand.
+
+    Without any parameters the smallest stored full-size encoding the client
+    accepts is served; without ``format`` the output format is negotiated
+    from the Accept header. Images are watermarked when WATERMARK_IMAGE is
+    set.
+    """
+    image_service = ImageService(db)
+    image = await _get_public_image(image_service, image_id)
+
+    if width is None and height is None and quality is None and format is None:
+        key, media_type = await image_service.get_original_encoding(image, accept)
+        key, media_type = await image_service.get_watermarked_encoding(image, key, media_type, image.width)
+        return await _stored_image_response(key, media_type, negotiated=True)
+
+    path, media_type = await image_service.get_transformed_image(
+        image,
+        width=width,
+        height=height,
+        fit=fit.value,
+        quality=quality or settings.VARIANT_QUALITY,
+        fmt=format.value if format else None,
+        accept=accept,
+        watermarked=True,
+    )
+    return await _image_response(path, media_type, negotiated=format is None)
+
+@router.get("/images/{image_id}/variants/{width}")
+async def get_image_variant(
+    image_id: int,
+    width: int,
+    accept: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """Serve the smallest stored encoding of a pre-generated variant the client accepts, watermarked if enabled"""
+    image_service = ImageService(db)
+    image = await _get_public_image(image_service, image_id)
+    key, media_type = await image_service.get_variant_encoding(image, width, accept)
+    key, media_type = await image_service.get_watermarked_encoding(image, key, media_type, width)
+    return await _stored_image_response(key, media_type, negotiated=True)
+
+@router.get("/images/{image_id}/poster")
+async def get_image_poster(image_id: int, db: Session = Depends(get_db)):
+    """Serve the first frame of a public animated image as a still, watermarked if enabled"""
+    image_service = ImageService(db)
+    image = await _get_public_image(image_service, image_id)
+    key, media_type = await image_service.get_animation_file(image, "poster")
+    key, media_type = await image_service.get_watermarked_encoding(image, key, media_type, image.width)
+    return await _stored_image_response(key, media_type, negotiated=False)
+
+@router.get("/images/{image_id}/video")
+async def get_image_video(image_id: int, db: Session = Depends(get_db)):
+    """Serve a public animated image as a looping MP4, where ffmpeg was available to encode one"""
+    image_service = ImageService(db)
+    image = await _get_public_image(image_service, image_id)
+    key, media_type = await image_service.get_watermarked_video(image)
+    return await _stored_image_response(key, media_type, negotiated=False)
+
+@router.get("/signed/{image_id}/{variant}")
+async def get_signed_file(image_id: int, variant: str, key: str, expires: int, sig: str):
+    """Serve a file through a link from POST /api/images/signed-urls.
+
+    The link is checked by its signature alone, with no database access,
+    so a page of many signed images costs no queries.
+    """
+    if not verify_file_signature(image_id, variant, key, expires, sig):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid or expired link"
+        )
+    max_age = max(expires - int(time.time()), 0)
+    return await deliver_stored_file(key, headers={"Cache-Control": f"private, max-age={max_age}"})
+
+# Stored images under /static/images, registered ahead of the generic /static mount
+static_router = APIRouter()
+
+@static_router.api_route("/{path:path}", methods=["GET", "HEAD"])
+async def get_stored_file(
+    path: str,
+    current_user: Optional[User] = Depends(get_optional_user),
+    db: Session = Depends(get_db)
+):
+    """Serve a stored image or derivative by its path, e.g. /static/images/<hash>.jpg.
+
+    Files of public images (and hero slide images) are content-addressed,
+    so responses are cacheable forever and revalidation is never needed;
+    while watermarking is on, only their watermarked copies are served.
+    Files of private images are only sent to their owner and admins, like
+    /api/images/{image_id}/file.
+    """
+    key = os.path.normpath(f"static/images/{path}")
+    if not key.startswith("static/images/") or os.path.basename(key).startswith("."):
+        # Outside the image directory, or an in-progress upload
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found"
+        )
+
+    image_service = ImageService(db)
+    images = image_service.get_images_by_stored_file(key)
+    if not image_service.is_published(images):
+        if not any(image_service.can_view(image, current_user) for image in images):
+            # Unknown files and other users' private images look the same
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File not found"
+            )
+        return await deliver_stored_file(key, headers={"Cache-Control": "private, max-age=3600"})
+
+    watermark = get_watermark()
+    if watermark is not None and f"_wm{watermark.fingerprint}" not in os.path.basename(key):
+        # Published images are only served watermarked (through /media, or as watermarked hero crops);
+        # their clean files are for logged-in clients through /api/images/{image_id}/file
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found"
+        )
+
+    local_path = get_storage().local_path(key)
+    if not local_path:
+        return _storage_redirect(key)
+    return await stored_file_response(local_path, headers={"Cache-Control": IMMUTABLE_CACHE_CONTROL})
@@ -0,0 +1,91 @@
+import re
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, status
+from sqlalchemy.orm import Session
+
+from app.db.session import get_db
+from app.schemas.image import ImageOut
+from app.schemas.upload import UploadSessionCreate, UploadSessionOut
+from app.schemas.user import User
+from app.services.auth_service import AuthService
+from app.services.upload_service import UploadService
+from app.utils.api_response import ok, created
+
+router = APIRouter()
+
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+|\*)$")
+
+def _session_response(session, message: str, status_code: int = 200):
+    data = UploadSessionOut.from_orm(session)
+    response = created(data, message=message) if status_code == 201 else ok(data, message=message)
+    # Same header tus clients use, so the next chunk's offset is available without parsing the body
+    response.headers["Upload-Offset"] = str(session.received_size)
+    return response
+
+@router.post("/")
+async def create_upload_session(
+    session_data: UploadSessionCreate,
+    current_user: User = Depends(AuthService.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Start a resumable upload for a file of known size"""
+    upload_service = UploadService(db)
+    session = await upload_service.create_session(session_data, current_user.id)
+    return _session_response(session, "Upload session created.", status_code=201)
+
+@router.get("/{session_id}")
+async def get_upload_session(
+    session_id: str,
+    current_user: User = Depends(AuthService.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get an upload session, including the offset to resume from"""
+    upload_service = UploadService(db)
+    session = await upload_service.get_session(session_id, current_user.id)
+    return _session_response(session, "Upload session retrieved.")
+
+@router.put("/{session_id}")
+async def upload_chunk(
+    session_id: str,
+    request: Request,
+    content_range: str = Header(...),
+    current_user: User = Depends(AuthService.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Upload one byte range of the file, e.g. ``Content-Range: bytes 0-5242879/104857600``"""
+    match = CONTENT_RANGE_RE.match(content_range.strip())
+    if not match or int(match.group(1)) > int(match.group(2)):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid Content-Range header"
+        )
+    start, end = int(match.group(1)), int(match.group(2))
+    total = None if match.group(3) == "*" else int(match.group(3))
+
+    upload_service = UploadService(db)
+    session = await upload_service.get_session(session_id, current_user.id)
+    session = await upload_service.write_chunk(session, start, end, total, request.stream())
+    return _session_response(session, "Chunk received.")
+
+@router.post("/{session_id}/complete")
+async def complete_upload_session(
+    session_id: str,
+    current_user: User = Depends(AuthService.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Finish a fully received upload and create the image"""
+    upload_service = UploadService(db)
+    session = await upload_service.get_session(session_id, current_user.id)
+    image = await upload_service.complete_session(session, current_user.id)
+    return created(ImageOut.from_orm(image), message="Image uploaded.")
+
+@router.delete("/{session_id}")
+async def abort_upload_session(
+    session_id: str,
+    current_user: User = Depends(AuthService.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Abandon an upload and discard the bytes received so far"""
+    upload_service = UploadService(db)
+    session = await upload_service.get_session(session_id, current_user.id)
+    await upload_service.abort_session(session)
+    return ok(message="Upload session deleted.")
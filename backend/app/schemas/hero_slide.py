@@ -1,7 +1,15 @@
-from pydantic import BaseModel
-from typing import Optional
+import json
+from pydantic import BaseModel, validator
+from typing import Dict, List, Optional
 from datetime import datetime
 
+from app.schemas.image import ImagePreview
+
+def _check_focal(value):
+    if value is not None and not 0 <= value <= 1:
+        raise ValueError("Must be between 0 and 1")
+    return value
+
 class HeroSlideBase(BaseModel):
     title: str
     subtitle: Optional[str] = None
@@ -11,6 +19,12 @@ class HeroSlideBase(BaseModel):
     is_active: bool = True
     sort_order: int = 0
     image_id: int
+    # Point the crops keep in frame, as fractions of the image's width and
+    # height; without it they are framed automatically
+    focal_x: Optional[float] = None
+    focal_y: Optional[float] = None
+
+    _check_focal = validator("focal_x", "focal_y", allow_reuse=True)(_check_focal)
 
 class HeroSlideCreate(HeroSlideBase):
     pass
@@ -24,11 +38,57 @@ class HeroSlideUpdate(BaseModel):
     is_active: Optional[bool] = None
     sort_order: Optional[int] = None
     image_id: Optional[int] = None
+    focal_x: Optional[float] = None
+    focal_y: Optional[float] = None
+
+    _check_focal = validator("focal_x", "focal_y", allow_reuse=True)(_check_focal)
+
+class HeroCropVariant(BaseModel):
+    width: int
+    height: int
+    url: str
+    sources: Dict[str, str] = {}  # format (webp, avif) -> URL of a smaller encoding, for <picture> sources
+
+class HeroSlideCrop(BaseModel):
+    aspect_ratio: str  # e.g. "16:9"
+    box: List[float]  # left, top, right, bottom as fractions of the upright image
+    variants: List[HeroCropVariant]
+    srcset: str
 
 class HeroSlide(HeroSlideBase):
     id: int
     created_at: datetime
     updated_at: Optional[datetime] = None
+    image: Optional[ImagePreview] = None
+    crops: List[HeroSlideCrop] = []  # empty until they have been generated
+
+    @validator("crops", pre=True)
+    def parse_crops(cls, value):
+        if not value:
+            return []
+        if isinstance(value, str):
+            value = json.loads(value)
+        if isinstance(value, list):
+            return value
+        crops = []
+        for aspect_ratio, crop in value.items():
+            # Stored files are served by their key under /static (watermarked crops while watermarking is on)
+            variants = [
+                {
+                    "width": variant["width"],
+                    "height": variant["height"],
+                    "url": f"/{variant['path']}",
+                    "sources": {fmt: f"/{encoding['path']}" for fmt, encoding in variant.get("formats", {}).items()},
+                }
+                for variant in crop["variants"]
+            ]
+            crops.append({
+                "aspect_ratio": aspect_ratio,
+                "box": crop["box"],
+                "variants": variants,
+                "srcset": ", ".join(f"{v['url']} {v['width']}w" for v in variants),
+            })
+        return crops
 
     class Config:
         orm_mode = True
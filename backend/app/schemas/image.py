@@ -1,7 +1,12 @@
+import json
+from enum import Enum
 from typing import Optional, List
-from pydantic import BaseModel
+from pydantic import BaseModel, validator
 from datetime import datetime
 
+from app.utils.colors import parse_palette
+from app.utils.watermark import get_watermark
+
 class ImageBase(BaseModel):
     title: str
     description: Optional[str] = None
@@ -17,6 +22,10 @@ class ImageBase(BaseModel):
 class ImageCreate(ImageBase):
     pass
 
+class ImageBatchCreate(ImageBase):
+    """Metadata shared by every image of a batch upload; titles default to the file names"""
+    title: Optional[str] = None
+
 class ImageUpdate(BaseModel):
     title: Optional[str] = None
     description: Optional[str] = None
@@ -51,17 +60,218 @@ class ImageWithOwner(ImageInDBBase):
 class ImageWithCategory(ImageInDBBase):
     category_obj: Optional[dict] = None
 
+class ImageHashCheck(BaseModel):
+    content_hash: str
+    exists: bool
+    image_id: Optional[int] = None  # the caller's own image with this file, if any
+
+class SignedUrlRequest(BaseModel):
+    """Images to create shareable links for, such as a client proofing gallery"""
+    image_ids: List[int]
+    width: Optional[int] = None  # link the smallest variant at least this wide instead of the original
+    expires_in: Optional[int] = None  # seconds, defaults to SIGNED_URL_EXPIRE_SECONDS
+
+    @validator("image_ids")
+    def check_image_ids(cls, value):
+        if not value:
+            raise ValueError("At least one image is required")
+        if len(value) > 500:
+            raise ValueError("At most 500 images can be linked at once")
+        return list(dict.fromkeys(value))
+
+    @validator("width", "expires_in")
+    def check_positive(cls, value):
+        if value is not None and value <= 0:
+            raise ValueError("Must be positive")
+        return value
+
+class SignedUrl(BaseModel):
+    image_id: int
+    url: str
+    width: Optional[int] = None  # of the linked variant; None for the original
+    expires_at: datetime
+
+class StorageReconcileRequest(BaseModel):
+    """Options for checking stored files against the images table"""
+    remove_orphans: bool = False  # delete files no image refers to (report only by default)
+    verify_hashes: bool = False  # re-hash every original, not just compare sizes
+
+class ImageFit(str, Enum):
+    contain = "contain"
+    cover = "cover"
+    fill = "fill"
+
+class ImageFormat(str, Enum):
+    jpeg = "jpeg"
+    png = "png"
+    webp = "webp"
+    avif = "avif"
+
+class ImageSort(str, Enum):
+    """Sort orders for image listings; a leading "-" means descending"""
+    captured_at = "captured_at"
+    captured_at_desc = "-captured_at"
+    created_at = "created_at"
+    created_at_desc = "-created_at"
+
+    @property
+    def field(self) -> str:
+        return self.value.lstrip("-")
+
+    @property
+    def ascending(self) -> bool:
+        return not self.value.startswith("-")
+
+class PaletteColor(BaseModel):
+    color: str  # "#rrggbb"
+    weight: float  # fraction of the image covered
+
+class ImageVariant(BaseModel):
+    width: int
+    height: int
+    url: str
+
+class ImageAnimation(BaseModel):
+    """Playback details of an animated image (e.g. an animated GIF)"""
+    frames: int
+    duration: int  # ms for one loop
+    loop: int  # times played, 0 for forever
+    poster_url: str  # still of the first frame
+    video_url: Optional[str] = None  # looping MP4, for a muted autoplaying <video>
+
 class ImageOut(ImageBase):
     id: int
     filename: str
-    file_path: str
+    file_path: Optional[str] = None  # storage key; left out for public images while watermarking is on
+    url: Optional[str] = None  # public images' full-size, format-negotiated (and watermarked) URL
     file_size: Optional[int] = None
     mime_type: Optional[str] = None
+    content_hash: Optional[str] = None
+    perceptual_hash: Optional[str] = None
+    processing_status: Optional[str] = None  # pending, processing, ready or failed
     owner_id: int
     created_at: datetime
     updated_at: Optional[datetime] = None
     is_thumbnail: bool = False
     is_profile_picture: bool = False
+    variants: List[ImageVariant] = []
+    srcset: Optional[str] = None
+    animation: Optional[ImageAnimation] = None
+    placeholder: Optional[str] = None
+    dominant_color: Optional[str] = None
+    palette: List[PaletteColor] = []
+    width: Optional[int] = None
+    height: Optional[int] = None
+    aspect_ratio: Optional[float] = None
+    captured_at: Optional[datetime] = None
+    camera_make: Optional[str] = None
+    camera_model: Optional[str] = None
+    lens_model: Optional[str] = None
+    focal_length: Optional[float] = None
+    f_number: Optional[float] = None
+    exposure_time: Optional[str] = None
+    iso: Optional[int] = None
+
+    @validator("file_path")
+    def hide_unwatermarked_file(cls, value, values):
+        # With watermarking on, public images are only served watermarked, through /media
+        if values.get("is_public") and get_watermark() is not None:
+            return None
+        return value
+
+    @validator("url", always=True)
+    def build_url(cls, value, values):
+        if value or not values.get("is_public"):
+            return value
+        return f"/media/images/{values.get('id')}"
+
+    @validator("variants", pre=True)
+    def parse_variants(cls, value, values):
+        if not value:
+            return []
+        if isinstance(value, str):
+            value = json.loads(value)
+        # Point at the negotiating route so clients get WebP/AVIF when they accept it
+        return [
+            {**v, "url": v.get("url") or f"/media/images/{values.get('id')}/variants/{v['width']}"}
+            if isinstance(v, dict) else v
+            for v in value
+        ]
+
+    @validator("animation", pre=True)
+    def parse_animation(cls, value, values):
+        if not value or not isinstance(value, str):
+            return value
+        animation = json.loads(value)
+        media_url = f"/media/images/{values.get('id')}"
+        return {
+            **animation,
+            "poster_url": f"{media_url}/poster",
+            "video_url": f"{media_url}/video" if animation.get("video") else None,
+        }
+
+    @validator("palette", pre=True)
+    def parse_palette(cls, value):
+        if isinstance(value, str):
+            return [{"color": color, "weight": weight} for color, weight in parse_palette(value)]
+        return value or []
+
+    @validator("srcset", always=True)
+    def build_srcset(cls, value, values):
+        variants = values.get("variants") or []
+        if value or not variants:
+            return value
+        return ", ".join(f"{v.url} {v.width}w" for v in variants)
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class LayoutBox(BaseModel):
+    x: float
+    y: float
+    width: float
+    height: float
+    image: ImageOut
+
+class LayoutRow(BaseModel):
+    y: float
+    height: float
+    items: List[LayoutBox]
+
+class GalleryLayout(BaseModel):
+    container_width: int
+    height: float
+    rows: List[LayoutRow]
+
+class ImagePreview(BaseModel):
+    """The parts of an image needed to paint it, for embedding in other resources"""
+    id: int
+    filename: str
+    file_path: Optional[str] = None  # left out while watermarking is on
+    placeholder: Optional[str] = None
+    dominant_color: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+    @validator("file_path")
+    def hide_unwatermarked_file(cls, value):
+        # Previews are embedded in public resources such as hero slides, which link their own watermarked crops
+        return None if get_watermark() is not None else value
+
+    class Config:
+        orm_mode = True
+
+class NearDuplicate(BaseModel):
+    image_id: int
+    distance: int  # differing bits of the 64-bit perceptual hash
+
+class DuplicateCluster(BaseModel):
+    images: List[ImagePreview]
+
+class BatchUploadResult(BaseModel):
+    filename: str
+    success: bool
+    image: Optional[ImageOut] = None
+    error: Optional[str] = None
+    job_id: Optional[int] = None  # background job generating the image's derivatives
+    near_duplicates: List[NearDuplicate] = []
@@ -0,0 +1,35 @@
+import json
+from enum import Enum
+from typing import Any, Optional
+from pydantic import BaseModel, validator
+from datetime import datetime
+
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    succeeded = "succeeded"
+    failed = "failed"
+
+class JobOut(BaseModel):
+    id: int
+    type: str
+    status: JobStatus
+    priority: int
+    attempts: int
+    max_attempts: int
+    run_at: datetime
+    payload: Any = None
+    result: Any = None
+    last_error: Optional[str] = None
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    @validator("payload", "result", pre=True)
+    def parse_json(cls, value):
+        if isinstance(value, str):
+            return json.loads(value)
+        return value
+
+    class Config:
+        orm_mode = True
@@ -0,0 +1,24 @@
+from typing import Optional
+from pydantic import BaseModel, Field
+from datetime import datetime
+
+from app.schemas.image import ImageBase
+
+class UploadSessionCreate(ImageBase):
+    filename: str
+    size: int = Field(..., gt=0)
+    content_type: Optional[str] = None
+
+class UploadSessionOut(BaseModel):
+    id: str
+    filename: str
+    content_type: Optional[str] = None
+    total_size: int
+    received_size: int
+    status: str
+    image_id: Optional[int] = None
+    expires_at: datetime
+    created_at: datetime
+
+    class Config:
+        orm_mode = True
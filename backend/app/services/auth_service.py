@@ -17,6 +17,7 @@ from app.utils.security import verify_password, get_password_hash
 from app.schemas.user import UserOut
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login", auto_error=False)
 
 class AuthService:
     def __init__(self, db: Session):
@@ -209,4 +210,13 @@ async def get_current_admin_user(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Admin privileges required"
         )
-    return current_user
\ No newline at end of file
+    return current_user
+
+async def get_optional_user(
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    db: Session = Depends(get_db)
+) -> Optional[User]:
+    """Get the current user, or None for anonymous requests (invalid tokens are still rejected)"""
+    if not token:
+        return None
+    return await AuthService.get_current_user(token, db)
@@ -0,0 +1,133 @@
+import json
+import os
+import hashlib
+from typing import List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.hero_slide import HeroSlide
+from app.models.image import Image
+from app.models.job import Job
+from app.services.job_service import JobService, notify_job_workers
+from app.utils.files import delete_file, local_copy, derivative_output_dir, store_derivative
+from app.utils.imaging import generate_crops, supported_formats
+from app.utils.processing import run_in_process
+from app.utils.watermark import get_watermark
+
+# Crops are queued ahead of bulk imports: a slide without them is already live
+PRIORITY_HERO_CROPS = 5
+
+def crop_paths(crops: Optional[str]) -> List[str]:
+    """List the stored files of a slide's crops"""
+    paths = []
+    for crop in json.loads(crops or "{}").values():
+        for variant in crop["variants"]:
+            paths.append(variant["path"])
+            paths.extend(encoding["path"] for encoding in variant.get("formats", {}).values())
+    return paths
+
+class HeroSlideService:
+    """Art-directed crops of hero slide images.
+
+    Each slide gets its image cropped to every HERO_CROP_ASPECT_RATIOS
+    ratio at HERO_CROP_WIDTHS, so phones load a small, properly framed
+    image instead of scaling a full-width original down with CSS. Crops
+    are generated by a background job and cached on the slide with a
+    fingerprint of everything they depend on, so they are only redone
+    when the image, focal point, crop settings or watermark change.
+    Slides are public, so with WATERMARK_IMAGE set every crop is
+    watermarked.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    @staticmethod
+    def crops_key(slide: HeroSlide, image: Image) -> str:
+        """Fingerprint the inputs of a slide's crops"""
+        inputs = [
+            image.content_hash or image.file_path,
+            slide.focal_x,
+            slide.focal_y,
+            settings.HERO_CROP_ASPECT_RATIOS,
+            settings.HERO_CROP_WIDTHS,
+            settings.VARIANT_QUALITY,
+            supported_formats(settings.MODERN_FORMATS),
+        ]
+        watermark = get_watermark()
+        if watermark:
+            inputs.append(watermark.fingerprint)
+        return hashlib.sha256(json.dumps(inputs).encode()).hexdigest()
+
+    def enqueue_crops(self, slide: HeroSlide) -> Optional[Job]:
+        """Queue (re)generating a slide's crops if they are out of date; the caller commits"""
+        image = slide.image
+        if image is None or slide.crops_key == self.crops_key(slide, image):
+            return None
+        return JobService(self.db).enqueue(
+            "crop_hero_slide",
+            {"slide_id": slide.id},
+            priority=PRIORITY_HERO_CROPS,
+            dedupe_key=f"crop_hero_slide:{slide.id}",
+        )
+
+    def enqueue_all(self) -> int:
+        """Queue crops for every slide whose crops are missing or out of date"""
+        jobs = [self.enqueue_crops(slide) for slide in self.db.query(HeroSlide).all()]
+        self.db.commit()
+        notify_job_workers()
+        return sum(job is not None for job in jobs)
+
+    async def generate_crops(self, slide_id: int) -> dict:
+        """Generate a slide's crops, replacing any made from older inputs.
+
+        Runs as the ``crop_hero_slide`` background job.
+        """
+        slide = self.db.query(HeroSlide).filter(HeroSlide.id == slide_id).first()
+        if slide is None or slide.image is None:
+            return {"aspect_ratios": []}
+        image = slide.image
+        key = self.crops_key(slide, image)
+        if slide.crops_key == key:
+            return {"aspect_ratios": list(json.loads(slide.crops or "{}"))}
+
+        focal = None
+        if slide.focal_x is not None and slide.focal_y is not None:
+            focal = (slide.focal_x, slide.focal_y)
+        stem = os.path.splitext(image.filename)[0]
+        async with local_copy(image.file_path) as source_path, derivative_output_dir() as output_dir:
+            crops = await run_in_process(
+                generate_crops,
+                source_path,
+                output_dir,
+                stem,
+                settings.HERO_CROP_ASPECT_RATIOS,
+                settings.HERO_CROP_WIDTHS,
+                settings.VARIANT_QUALITY,
+                supported_formats(settings.MODERN_FORMATS),
+                focal,
+                get_watermark(),
+            )
+            for crop in crops.values():
+                for variant in crop["variants"]:
+                    variant["path"] = await store_derivative(variant["path"])
+                    for encoding in variant["formats"].values():
+                        encoding["path"] = await store_derivative(encoding["path"])
+
+        old_paths = crop_paths(slide.crops)
+        slide.crops = json.dumps(crops)
+        slide.crops_key = key
+        self.db.commit()
+        self.delete_unused_crops(old_paths)
+        return {"aspect_ratios": list(crops)}
+
+    def delete_unused_crops(self, paths: List[str]):
+        """Delete crop files no slide uses any more; slides showing the same image with the same framing share them"""
+        if not paths:
+            return
+        in_use = set()
+        for crops, in self.db.query(HeroSlide.crops).filter(HeroSlide.crops.isnot(None)):
+            in_use.update(crop_paths(crops))
+        for path in set(paths) - in_use:
+            delete_file(path)
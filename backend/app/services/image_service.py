@@ -1,13 +1,83 @@
+import io
 import os
+import re
+import json
 import uuid
-from typing import List, Optional
+import asyncio
+import hashlib
+import logging
+import time
+import zipfile
+import mimetypes
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, Union
 from fastapi import HTTPException, status, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from PIL import UnidentifiedImageError
+from PIL.Image import DecompressionBombError
+from sqlalchemy import func, or_
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
+from app.utils.security import create_signed_file_url
+from app.models.hero_slide import HeroSlide
 from app.models.image import Image
-from app.schemas.image import ImageCreate, ImageUpdate
-from app.utils.files import save_upload_file, delete_file, validate_file
+from app.models.job import Job
+from app.models.user import User
+from app.schemas.image import (
+    ImageBase, ImageCreate, ImageBatchCreate, ImageUpdate, ImageOut, ImageSort, ImagePreview, GalleryLayout,
+    NearDuplicate, DuplicateCluster, BatchUploadResult, SignedUrlRequest, SignedUrl,
+)
+from app.services.job_service import ACTIVE_STATUSES, JobService, PermanentJobError, notify_job_workers
+from app.utils.colors import ColorIndex, format_palette, get_color_index, parse_color
+from app.utils.hash_index import NearDuplicateIndex, get_near_duplicate_index
+from app.utils.files import (
+    StoredFile, save_upload_file, move_into_upload_dir, delete_file, validate_file, validate_filename,
+    local_copy, derivative_output_dir, store_derivative, check_pixel_count,
+)
+from app.utils.engines import generate_variants, encode_formats, transform_image
+from app.utils.imaging import (
+    compute_placeholder, compute_palette, compute_dhash, read_dimensions, read_exif, supported_formats, watermark_file,
+    generate_poster,
+)
+from app.utils.layout import justified_layout
+from app.utils.locks import KeyedLocks
+from app.utils.negotiation import choose_encoding, media_type_for, preferred_format
+from app.utils.processing import run_in_process
+from app.utils.storage import get_storage
+from app.utils.variant_cache import get_variant_cache
+from app.utils.video import encode_loop_video, find_ffmpeg
+from app.utils.watermark import Watermark, get_watermark, watermarked_key
+from app.utils.zipstream import ZipEntry, stream_zip
+
+logger = logging.getLogger(__name__)
+
+# Image columns computed from the file's content; images sharing a file share these
+DERIVED_COLUMNS = (
+    "variants", "encodings", "placeholder", "dominant_color", "width", "height", "aspect_ratio",
+    "captured_at", "camera_make", "camera_model", "lens_model", "focal_length", "f_number",
+    "exposure_time", "iso", "orientation", "perceptual_hash", "palette", "animation",
+)
+
+# Bytes fetched from remote storage to read an upload's header
+HEADER_READ_BYTES = 256 * 1024
+
+# Job priorities: single uploads are processed ahead of bulk imports
+PRIORITY_INTERACTIVE = 10
+PRIORITY_BULK = 0
+
+# Seconds a client is told to wait for a watermarked copy still being made
+WATERMARK_RETRY_AFTER_SECONDS = 5
+
+# Per-variant locks so concurrent requests for the same transform compute it once
+_transform_locks = KeyedLocks()
+
+# Stored files are named after their content hash
+_HASH_NAME = re.compile(r"^[0-9a-f]{64}$")
+
+# Watermarked copies known to be stored, so serving them needs no storage round trip
+_watermarked_keys: set = set()
+_watermark_locks = KeyedLocks()
 
 class ImageService:
     def __init__(self, db: Session):
@@ -20,8 +90,18 @@ class ImageService:
         category: Optional[str] = None,
         is_featured: Optional[bool] = None,
         is_thumbnail: Optional[bool] = None,  # new filter
+        captured_after: Optional[datetime] = None,
+        captured_before: Optional[datetime] = None,
+        sort: Optional[ImageSort] = None,
+        color: Optional[str] = None,
         public_only: bool = True
     ) -> List[Image]:
+        """List images matching the given filters.
+
+        With ``color`` (a hex code or colour name) only images with a
+        similar palette colour are returned, closest match first unless
+        ``sort`` says otherwise.
+        """
         query = self.db.query(Image)
         
         if public_only:
@@ -35,9 +115,74 @@ class ImageService:
 
         if is_thumbnail is not None:  # apply thumbnail filter
             query = query.filter(Image.is_thumbnail == is_thumbnail)
-        
+
+        if captured_after is not None:
+            query = query.filter(Image.captured_at >= captured_after)
+
+        if captured_before is not None:
+            query = query.filter(Image.captured_at < captured_before)
+
+        if sort is not None:
+            column = Image.captured_at if sort.field == "captured_at" else Image.created_at
+            order = column.asc() if sort.ascending else column.desc()
+            # Images without EXIF dates always sort after dated ones
+            query = query.order_by(column.is_(None), order, Image.id)
+
+        if color:
+            return self._filter_by_color(query, color, sort is None, skip, limit)
+
         return query.offset(skip).limit(limit).all()
+
+    def _filter_by_color(self, query, color: str, rank_by_color: bool, skip: int, limit: int) -> List[Image]:
+        """Page through the images of a query whose palettes match a colour.
+
+        Matches come from the in-memory palette index; the database only
+        supplies the ids passing the other filters and then the rows of a
+        single page.
+        """
+        try:
+            rgb = parse_color(color)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unrecognised colour '{color}'; use a hex code such as #e0b090 or a colour name"
+            )
+        matches = [image_id for _, image_id in self._color_index().search(rgb, settings.COLOR_MATCH_DISTANCE)]
+
+        if rank_by_color:
+            allowed = {image_id for image_id, in query.with_entities(Image.id)}
+            ordered = [image_id for image_id in matches if image_id in allowed]
+        else:
+            matched = set(matches)
+            ordered = [image_id for image_id, in query.with_entities(Image.id) if image_id in matched]
+
+        page = ordered[skip:skip + limit]
+        images = {image.id: image for image in self.db.query(Image).filter(Image.id.in_(page))}
+        return [images[image_id] for image_id in page if image_id in images]
     
+    async def get_gallery_layout(
+        self,
+        container_width: int,
+        target_row_height: int = 300,
+        spacing: int = 8,
+        **filters
+    ) -> GalleryLayout:
+        """Lay out public images (as filtered by get_images) in justified rows"""
+        images = await self.get_images(**filters)
+        # Images without stored dimensions are laid out as squares
+        layout = justified_layout(
+            [(image.id, image.aspect_ratio or 1.0) for image in images],
+            container_width,
+            target_row_height,
+            spacing,
+        )
+
+        images_out = {image.id: ImageOut.from_orm(image) for image in images}
+        for row in layout["rows"]:
+            for box in row["items"]:
+                box["image"] = images_out[box.pop("id")]
+        return GalleryLayout(container_width=container_width, **layout)
+
     async def get_user_images(self, user_id: int, skip: int = 0, limit: int = 100) -> List[Image]:
         return self.db.query(Image).filter(
             Image.owner_id == user_id
@@ -52,6 +197,39 @@ class ImageService:
             )
         return image
     
+    @staticmethod
+    def can_view(image: Image, user: Optional[User]) -> bool:
+        """Whether a user may see an image: anyone for public images, otherwise its owner or an admin"""
+        if image.is_public:
+            return True
+        return user is not None and (user.is_admin or image.owner_id == user.id)
+
+    def get_images_by_stored_file(self, key: str) -> List[Image]:
+        """Find the images a stored file belongs to, as their original or one of its derivatives.
+
+        Files are named after the content hash (derivatives, watermarked
+        copies and hero slide crops as <hash>_<...>.<ext>); older uploads
+        may have other names, found through their file name instead.
+        """
+        stem = os.path.basename(key).split(".")[0].split("_")[0]
+        conditions = [Image.file_path == key]
+        if _HASH_NAME.match(stem):
+            conditions.append(Image.content_hash == stem)
+        elif stem:
+            conditions.append(Image.filename.startswith(f"{stem}.", autoescape=True))
+        return self.db.query(Image).filter(or_(*conditions)).all()
+
+    def is_published(self, images: List[Image]) -> bool:
+        """Whether any of the images is shown to anonymous visitors: public, or on a hero slide"""
+        if any(image.is_public for image in images):
+            return True
+        image_ids = [image.id for image in images]
+        return bool(image_ids) and self.db.query(HeroSlide.id).filter(HeroSlide.image_id.in_(image_ids)).first() is not None
+
+    async def get_image_by_hash(self, content_hash: str) -> Optional[Image]:
+        """Find an existing image whose file has the given SHA-256"""
+        return self.db.query(Image).filter(Image.content_hash == content_hash.lower()).first()
+
     async def create_image(
         self, 
         image_data: ImageCreate, 
@@ -61,29 +239,343 @@ class ImageService:
         # Validate file
         validate_file(file)
         
-        # Generate unique filename
+        # Save file under its content hash
         file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        
-        # Save file
-        file_path = await save_upload_file(file, unique_filename)
+        stored = await save_upload_file(file, file_extension)
 
-        # Get category name if category_id is provided
+        return await self._create_image_record(image_data, stored, file.content_type, user_id)
+
+    async def create_image_from_path(
+        self,
+        image_data: ImageCreate,
+        source_path: str,
+        original_filename: str,
+        content_type: Optional[str],
+        user_id: int
+    ) -> Image:
+        """Create an image from a file already on local disk, such as an assembled resumable upload.
+
+        The file is moved into the upload directory.
+        """
+        validate_filename(original_filename)
+
+        file_extension = os.path.splitext(original_filename)[1]
+        stored = await move_into_upload_dir(source_path, file_extension)
+
+        return await self._create_image_record(image_data, stored, content_type, user_id)
+
+    async def get_viewable_image_by_hash(self, content_hash: str, user: User) -> Optional[Image]:
+        """Find an image whose file has the given SHA-256 among those the user may see, their own first.
+
+        Other users' private images are never matched, so a hash can't be
+        used to find out about, or get a copy of, a file the user can't see.
+        """
+        query = self.db.query(Image).filter(Image.content_hash == content_hash.lower())
+        if not user.is_admin:
+            query = query.filter(or_(Image.is_public == True, Image.owner_id == user.id))
+        return query.order_by((Image.owner_id == user.id).desc(), Image.id).first()
+
+    async def create_image_from_hash(self, image_data: ImageCreate, content_hash: str, user: User) -> Image:
+        """Create an image that shares the already stored file with the given hash, without a transfer.
+
+        Only files of images the user may see can be shared this way.
+        """
+        existing = await self.get_viewable_image_by_hash(content_hash, user)
+        if not existing or not await run_in_threadpool(get_storage().exists, existing.file_path):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No stored file with this hash"
+            )
+        stored = StoredFile(existing.file_path, existing.filename, existing.file_size, existing.content_hash)
+        return await self._create_image_record(image_data, stored, existing.mime_type, user.id)
+
+    async def create_images(
+        self,
+        image_data: ImageBatchCreate,
+        files: List[UploadFile],
+        user_id: int
+    ) -> List[BatchUploadResult]:
+        """Create one image per uploaded file, sharing the given metadata.
+
+        Files are written to disk concurrently and all rows are inserted in
+        a single transaction, with one background processing job per
+        distinct file. A file that fails validation is reported in its
+        result without affecting the others.
+        """
+        if len(files) > settings.MAX_BATCH_FILES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"At most {settings.MAX_BATCH_FILES} files can be uploaded in one batch"
+            )
+
+        async def store(file: UploadFile) -> StoredFile:
+            validate_file(file)
+            return await save_upload_file(file, os.path.splitext(file.filename)[1])
+
+        stored_files = await asyncio.gather(*(store(file) for file in files), return_exceptions=True)
+        return await self._create_stored_images(
+            image_data,
+            [file.filename or "" for file in files],
+            [file.content_type for file in files],
+            stored_files,
+            user_id
+        )
+
+    async def create_images_from_archive(
+        self,
+        image_data: ImageBatchCreate,
+        archive: UploadFile,
+        user_id: int
+    ) -> List[BatchUploadResult]:
+        """Create one image per image file in an uploaded ZIP archive.
+
+        Entries are read straight out of the uploaded archive one at a time
+        and streamed into the upload directory, so no entry is ever held in
+        memory or written to disk twice. Entries with disallowed extensions
+        or over MAX_FILE_SIZE (checked while reading, not just against the
+        size the archive claims) are reported as failed; folders, hidden
+        files and macOS resource forks are skipped. Rows are then created as
+        for a batch upload.
+        """
+        if os.path.splitext(archive.filename or "")[1].lower() != ".zip":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Archive must be a .zip file"
+            )
+        try:
+            zip_file = await run_in_threadpool(zipfile.ZipFile, archive.file)
+        except zipfile.BadZipFile:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Uploaded file is not a valid ZIP archive"
+            )
+
+        with zip_file:
+            entries = [
+                info for info in zip_file.infolist()
+                if not info.is_dir()
+                and not info.filename.startswith("__MACOSX/")
+                and not os.path.basename(info.filename).startswith(".")
+            ]
+            if len(entries) > settings.MAX_ARCHIVE_FILES:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Archives may contain at most {settings.MAX_ARCHIVE_FILES} files"
+                )
+
+            filenames = [os.path.basename(info.filename) for info in entries]
+            stored_files = []
+            for info, filename in zip(entries, filenames):
+                try:
+                    validate_filename(filename)
+                    if info.file_size > settings.MAX_FILE_SIZE:
+                        raise HTTPException(
+                            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"File size exceeds maximum allowed size of {settings.MAX_FILE_SIZE} bytes"
+                        )
+                    entry = await run_in_threadpool(zip_file.open, info)
+                    with entry:
+                        stored = await save_upload_file(
+                            UploadFile(file=entry, filename=filename), os.path.splitext(filename)[1]
+                        )
+                    stored_files.append(stored)
+                except (HTTPException, zipfile.BadZipFile, RuntimeError, NotImplementedError) as e:
+                    # RuntimeError: encrypted entry; NotImplementedError: unsupported compression
+                    stored_files.append(e)
+
+        return await self._create_stored_images(
+            image_data,
+            filenames,
+            [mimetypes.guess_type(filename)[0] for filename in filenames],
+            stored_files,
+            user_id
+        )
+
+    async def _create_stored_images(
+        self,
+        image_data: ImageBatchCreate,
+        filenames: List[str],
+        content_types: List[Optional[str]],
+        stored_files: List[Union[StoredFile, BaseException]],
+        user_id: int
+    ) -> List[BatchUploadResult]:
+        """Insert the rows for stored originals in one transaction and queue their processing.
+
+        ``stored_files`` holds, per file, either where it was stored or the
+        error that stopped it being stored.
+        """
+        results = [BatchUploadResult(filename=filename, success=False) for filename in filenames]
+        stored_files = list(stored_files)
+
+        # Identical files share one stored copy, whatever their extensions
+        canonical: Dict[str, StoredFile] = {}
+        for index, stored in enumerate(stored_files):
+            if isinstance(stored, BaseException):
+                results[index].error = self._error_detail(stored)
+                continue
+            first = canonical.setdefault(stored.content_hash, stored)
+            if first.file_path != stored.file_path:
+                self._delete_unreferenced_file(stored.file_path)
+                stored_files[index] = StoredFile(first.file_path, first.filename, stored.size, stored.content_hash)
+
+        # Check each new file once; files already in the library reuse their derivatives
+        processed_hashes = {
+            content_hash for content_hash, in self.db.query(Image.content_hash).filter(
+                Image.content_hash.in_(list(canonical)), Image.processing_status == "ready"
+            )
+        }
+        pending = [stored for content_hash, stored in canonical.items() if content_hash not in processed_hashes]
+        outcomes = await asyncio.gather(
+            *(self._read_header(stored.file_path) for stored in pending),
+            return_exceptions=True
+        )
+        derived_by_hash = {stored.content_hash: outcome for stored, outcome in zip(pending, outcomes)}
+
+        shared = image_data.copy(update={"category": self._category_name(image_data)})
+        rows: List[Tuple[int, Image]] = []
+        for index, stored in enumerate(stored_files):
+            if isinstance(stored, BaseException):
+                continue
+            derived = derived_by_hash.get(stored.content_hash)
+            if isinstance(derived, BaseException):
+                results[index].error = self._error_detail(derived)
+                continue
+            title = os.path.splitext(filenames[index])[0]
+            if shared.title:
+                title = shared.title if len(filenames) == 1 else f"{shared.title} ({index + 1})"
+            record_data = ImageCreate(**shared.dict(exclude={"title"}), title=title)
+            db_image = await self._build_image_record(
+                record_data, stored, content_types[index], user_id, derived
+            )
+            rows.append((index, db_image))
+
+        if rows:
+            self.db.add_all([db_image for _, db_image in rows])
+            jobs = {
+                db_image.content_hash: self._enqueue_processing(db_image, PRIORITY_BULK, user_id)
+                for _, db_image in rows if db_image.processing_status == "pending"
+            }
+            try:
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                for _, db_image in rows:
+                    if not self._is_file_referenced(db_image.file_path):
+                        for path in self._stored_paths(db_image):
+                            delete_file(path)
+                raise
+            notify_job_workers()
+
+            # Load every new row in one query rather than refreshing them one by one
+            image_ids = [db_image.id for _, db_image in rows]
+            self.db.query(Image).filter(Image.id.in_(image_ids)).all()
+            for _, db_image in rows:
+                self._index_image(db_image)
+
+            duplicate_index = self._near_duplicate_index()
+            for index, db_image in rows:
+                result = results[index]
+                result.success = True
+                result.image = ImageOut.from_orm(db_image)
+                if db_image.content_hash in jobs:
+                    result.job_id = jobs[db_image.content_hash].id
+                if db_image.perceptual_hash:
+                    result.near_duplicates = [
+                        NearDuplicate(image_id=image_id, distance=distance)
+                        for distance, image_id in duplicate_index.similar(
+                            db_image.perceptual_hash, settings.DUPLICATE_HASH_DISTANCE, exclude=db_image.id
+                        )
+                    ]
+        return results
+
+    @staticmethod
+    def _error_detail(error: BaseException) -> str:
+        if isinstance(error, HTTPException):
+            return str(error.detail)
+        return "Could not process file"
+
+    def _category_name(self, image_data: ImageBase) -> Optional[str]:
+        """Get the category name to store, looking it up by category_id if not given"""
         category_name = image_data.category
         if image_data.category_id and not category_name:
             from app.models.category import Category
             category = self.db.query(Category).filter(Category.id == image_data.category_id).first()
             if category:
                 category_name = category.name
+        return category_name
+
+    async def _create_image_record(
+        self,
+        image_data: ImageCreate,
+        stored: StoredFile,
+        content_type: Optional[str],
+        user_id: int
+    ) -> Image:
+        """Insert the database record for a stored original and queue its processing.
+
+        If that fails, the stored file is removed again unless another image uses it.
+        """
+        try:
+            db_image = await self._build_image_record(image_data, stored, content_type, user_id)
+
+            self.db.add(db_image)
+            if db_image.processing_status == "pending":
+                self._enqueue_processing(db_image, PRIORITY_INTERACTIVE, user_id)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            try:
+                self._delete_unreferenced_file(stored.file_path)
+            except Exception:
+                logger.exception("Error removing file %s of failed upload", stored.file_path)
+            raise
+        self.db.refresh(db_image)
+        notify_job_workers()
+
+        self._index_image(db_image)
+        return db_image
+
+    async def _build_image_record(
+        self,
+        image_data: ImageCreate,
+        stored: StoredFile,
+        content_type: Optional[str],
+        user_id: int,
+        derived: Optional[dict] = None
+    ) -> Image:
+        """Build (without saving) the database record for a stored original.
+
+        ``derived`` holds already computed column values; without it they
+        are copied from a processed image with the same content, or the
+        file's header is checked and the record marked pending processing.
+        """
+        existing = await self.get_image_by_hash(stored.content_hash)
+        if existing and existing.file_path != stored.file_path:
+            # Same bytes already stored under another extension: keep a single copy
+            self._delete_unreferenced_file(stored.file_path)
+            stored = StoredFile(existing.file_path, existing.filename, stored.size, stored.content_hash)
+
+        if derived is None and existing and existing.processing_status == "ready":
+            # Derivatives are keyed by content hash too, so they can be shared as-is
+            derived = {column: getattr(existing, column) for column in DERIVED_COLUMNS}
+            derived["processing_status"] = "ready"
+        elif derived is None:
+            # Derivatives are generated by a background job; only check the file is an image now
+            derived = await self._read_header(stored.file_path)
+
+        # Get category name if category_id is provided
+        category_name = self._category_name(image_data)
 
         # Create database record
         db_image = Image(
             title=image_data.title,
             description=image_data.description,
-            filename=unique_filename,
-            file_path=file_path,
-            file_size=file.size,
-            mime_type=file.content_type,
+            filename=stored.filename,
+            file_path=stored.file_path,
+            file_size=stored.size,
+            content_hash=stored.content_hash,
+            mime_type=content_type,
+            **derived,
             category=category_name,
             tags=image_data.tags,
             is_featured=image_data.is_featured,
@@ -93,11 +585,133 @@ class ImageService:
             category_id=image_data.category_id,
             owner_id=user_id
         )
-        
-        self.db.add(db_image)
-        self.db.commit()
-        self.db.refresh(db_image)
         return db_image
+
+    async def _read_header(self, file_path: str) -> dict:
+        """Check a stored upload is a readable image and get its dimensions, without decoding it.
+
+        Returns column values for a record awaiting processing. Files that
+        are not images, or have more than MAX_IMAGE_PIXELS pixels, are
+        deleted (unless another record uses them) and rejected.
+        """
+        try:
+            dimensions = await self._read_stored_dimensions(file_path)
+            check_pixel_count(dimensions["width"], dimensions["height"])
+        except (UnidentifiedImageError, OSError, ValueError):
+            self._delete_unreferenced_file(file_path)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Uploaded file is not a valid image"
+            )
+        except (HTTPException, DecompressionBombError) as e:
+            self._delete_unreferenced_file(file_path)
+            if isinstance(e, HTTPException):
+                raise
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Image dimensions exceed the maximum of {settings.MAX_IMAGE_PIXELS} pixels"
+            )
+        return {**dimensions, "processing_status": "pending"}
+
+    @staticmethod
+    async def _read_stored_dimensions(file_path: str) -> dict:
+        storage = get_storage()
+        if not storage.is_local:
+            # The header is almost always near the start, so a ranged read
+            # saves fetching the whole file from remote storage
+            head = await run_in_threadpool(storage.read_bytes, file_path, 0, HEADER_READ_BYTES)
+            try:
+                return await run_in_threadpool(read_dimensions, io.BytesIO(head))
+            except Exception:
+                if len(head) < HEADER_READ_BYTES:
+                    raise
+        async with local_copy(file_path) as source_path:
+            return await run_in_threadpool(read_dimensions, source_path)
+
+    def _enqueue_processing(self, image: Image, priority: int, user_id: Optional[int] = None) -> Job:
+        """Queue derivative generation for an image's content (once per content hash)"""
+        return JobService(self.db).enqueue(
+            "process_image",
+            {"content_hash": image.content_hash},
+            priority=priority,
+            dedupe_key=f"process_image:{image.content_hash}",
+            created_by_id=user_id,
+        )
+
+    def get_processing_job(self, image: Image) -> Optional[Job]:
+        """Get the queued or running job processing an image's content, if any"""
+        return self.db.query(Job).filter(
+            Job.dedupe_key == f"process_image:{image.content_hash}", Job.status.in_(ACTIVE_STATUSES)
+        ).order_by(Job.id.desc()).first()
+
+    async def process_content(self, content_hash: str, final_attempt: bool = True) -> dict:
+        """Generate derivatives for a stored file and fill in every image record that uses it.
+
+        Runs as the ``process_image`` background job. Invalid images are
+        marked failed for good; other errors are raised for the job to be
+        retried, marking the images failed on the final attempt.
+        """
+        images = self.db.query(Image).filter(Image.content_hash == content_hash).all()
+        if not images:
+            # Deleted before processing got to it
+            return {"image_ids": []}
+        if all(image.processing_status == "ready" for image in images):
+            return {"image_ids": [image.id for image in images]}
+
+        source = images[0]
+        for image in images:
+            image.processing_status = "processing"
+        self.db.commit()
+
+        try:
+            derived = await self._generate_derivatives(source.file_path, source.filename)
+        except Exception as e:
+            failed = isinstance(e, HTTPException) or final_attempt
+            for image in self.db.query(Image).filter(Image.content_hash == content_hash):
+                image.processing_status = "failed" if failed else "pending"
+            self.db.commit()
+            if isinstance(e, HTTPException):
+                raise PermanentJobError(e.detail)
+            raise
+
+        # Pick up images added or deleted while processing ran
+        images = self.db.query(Image).filter(Image.content_hash == content_hash).all()
+        if not images:
+            for path in self._stored_paths(Image(file_path=source.file_path, **derived)):
+                delete_file(path)
+            return {"image_ids": []}
+
+        for image in images:
+            for column, value in derived.items():
+                setattr(image, column, value)
+            image.processing_status = "ready"
+        public = next((image for image in images if image.is_public), None)
+        watermark_job = self.enqueue_watermarks(public) if public else None
+        self.db.commit()
+        if watermark_job:
+            notify_job_workers()
+
+        for image in images:
+            self._index_image(image)
+        duplicate_index = self._near_duplicate_index()
+        near_duplicates = {}
+        if derived.get("perceptual_hash"):
+            for image in images:
+                near_duplicates[image.id] = [
+                    {"image_id": image_id, "distance": distance}
+                    for distance, image_id in duplicate_index.similar(
+                        derived["perceptual_hash"], settings.DUPLICATE_HASH_DISTANCE, exclude=image.id
+                    )
+                ]
+        return {"image_ids": [image.id for image in images], "near_duplicates": near_duplicates}
+
+    @staticmethod
+    def _index_image(image: Image):
+        """Add a newly created image to the in-memory search indexes"""
+        if image.perceptual_hash:
+            get_near_duplicate_index().add(image.id, image.perceptual_hash)
+        if image.palette:
+            get_color_index(settings.PALETTE_SIZE).add(image.id, image.palette)
     
     async def update_image(
         self, 
@@ -128,7 +742,10 @@ class ImageService:
         elif 'category_id' in update_data and update_data['category_id'] is None:
             image.category = None
 
+        watermark_job = self.enqueue_watermarks(image) if update_data.get('is_public') else None
         self.db.commit()
+        if watermark_job:
+            notify_job_workers()
         self.db.refresh(image)
         return image
     
@@ -142,13 +759,577 @@ class ImageService:
                 detail="Not enough permissions"
             )
         
-        # Delete file from filesystem
-        try:
-            delete_file(image.file_path)
-        except Exception as e:
-            # Log error but don't fail the deletion
-            print(f"Error deleting file {image.file_path}: {e}")
-        
+        file_path = image.file_path
+        paths = self._stored_paths(image)
+        watermark = get_watermark()
+        if watermark:
+            paths += [watermarked_key(path, watermark)[0] for path in paths]
+
         # Delete from database
         self.db.delete(image)
         self.db.commit()
+        get_near_duplicate_index().remove(image_id)
+        get_color_index(settings.PALETTE_SIZE).remove(image_id)
+
+        # Files are shared by every image with the same content, so only
+        # remove them once the last reference is gone
+        if not self._is_file_referenced(file_path):
+            for path in paths:
+                try:
+                    delete_file(path)
+                except Exception:
+                    # Don't fail the deletion; storage reconciliation finds the leftover file
+                    logger.exception("Error deleting file %s of deleted image %s", path, image_id)
+
+    def _refresh_index(self, index, column):
+        """(Re)build an in-memory index of a column if the images table has changed under it"""
+        rows = self.db.query(Image).filter(column.isnot(None))
+        signature = tuple(rows.with_entities(func.count(Image.id), func.max(Image.id)).one())
+        if signature != index.signature:
+            index.rebuild(rows.with_entities(Image.id, column), signature)
+        return index
+
+    def _near_duplicate_index(self) -> NearDuplicateIndex:
+        return self._refresh_index(get_near_duplicate_index(), Image.perceptual_hash)
+
+    def _color_index(self) -> ColorIndex:
+        return self._refresh_index(get_color_index(settings.PALETTE_SIZE), Image.palette)
+
+    async def find_near_duplicates(self, image: Image, max_distance: Optional[int] = None) -> List[NearDuplicate]:
+        """Find other images that look nearly identical to the given one, closest first"""
+        if not image.perceptual_hash:
+            return []
+        if max_distance is None:
+            max_distance = settings.DUPLICATE_HASH_DISTANCE
+        matches = self._near_duplicate_index().similar(image.perceptual_hash, max_distance, exclude=image.id)
+        return [NearDuplicate(image_id=image_id, distance=distance) for distance, image_id in matches]
+
+    async def get_duplicate_clusters(self, max_distance: Optional[int] = None) -> List[DuplicateCluster]:
+        """Group the whole library into clusters of near-identical images, largest first"""
+        if max_distance is None:
+            max_distance = settings.DUPLICATE_HASH_DISTANCE
+        clusters = self._near_duplicate_index().clusters(max_distance)
+
+        image_ids = [image_id for cluster in clusters for image_id in cluster]
+        images = {}
+        # Stay well under SQLite's bound parameter limit
+        for start in range(0, len(image_ids), 500):
+            batch = image_ids[start:start + 500]
+            for image in self.db.query(Image).filter(Image.id.in_(batch)):
+                images[image.id] = ImagePreview.from_orm(image)
+        return [
+            DuplicateCluster(images=[images[image_id] for image_id in cluster if image_id in images])
+            for cluster in clusters
+        ]
+
+    def _is_file_referenced(self, file_path: str) -> bool:
+        return self.db.query(Image.id).filter(Image.file_path == file_path).first() is not None
+
+    def _delete_unreferenced_file(self, file_path: str):
+        if not self._is_file_referenced(file_path):
+            delete_file(file_path)
+
+    @staticmethod
+    def _stored_paths(image: Image) -> List[str]:
+        """List the original and every derivative file stored for an image"""
+        paths = [image.file_path]
+        for variant in json.loads(image.variants or "[]"):
+            paths.append(variant["path"])
+            paths.extend(encoding["path"] for encoding in variant.get("formats", {}).values())
+        paths.extend(encoding["path"] for encoding in json.loads(image.encodings or "{}").values())
+        animation = json.loads(image.animation or "null")
+        if animation:
+            paths.append(animation["poster"]["path"])
+            if animation.get("video"):
+                paths.append(animation["video"]["path"])
+        return paths
+
+    async def _generate_derivatives(self, file_path: str, filename: str) -> dict:
+        """Process a stored upload, returning values for each of DERIVED_COLUMNS.
+
+        Creates the resized derivatives and full-size alternate encodings,
+        computes the inline placeholder, colour palette, perceptual hash and
+        display dimensions and extracts the EXIF capture details. Derivatives
+        come out upright and stripped of metadata; the original itself is
+        left untouched. Animations get animated alternate encodings, a
+        poster frame and, with ffmpeg installed, a looping MP4; their
+        variants are stills of the first frame.
+        """
+        stem = os.path.splitext(filename)[0]
+        formats = supported_formats(settings.MODERN_FORMATS)
+        async with local_copy(file_path) as source_path, derivative_output_dir() as output_dir:
+            try:
+                variants, encodings, placeholder, palette, perceptual_hash, dimensions, exif, animation = await asyncio.gather(
+                    run_in_process(
+                        generate_variants,
+                        source_path,
+                        output_dir,
+                        stem,
+                        settings.VARIANT_WIDTHS,
+                        settings.VARIANT_QUALITY,
+                        formats,
+                    ),
+                    run_in_process(
+                        encode_formats,
+                        source_path,
+                        output_dir,
+                        stem,
+                        formats,
+                        settings.VARIANT_QUALITY,
+                    ),
+                    run_in_process(compute_placeholder, source_path, settings.PLACEHOLDER_SIZE),
+                    run_in_process(compute_palette, source_path, settings.PALETTE_SIZE),
+                    run_in_process(compute_dhash, source_path),
+                    run_in_process(read_dimensions, source_path),
+                    run_in_process(read_exif, source_path),
+                    run_in_process(generate_poster, source_path, output_dir, stem, settings.VARIANT_QUALITY),
+                )
+            except UnidentifiedImageError:
+                self._delete_unreferenced_file(file_path)
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Uploaded file is not a valid image"
+                )
+            except (DecompressionBombError, MemoryError):
+                # Over the pixel limit, or over the worker's memory limit while decoding
+                self._delete_unreferenced_file(file_path)
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Image is too large to process"
+                )
+
+            for variant in variants:
+                variant["path"] = await store_derivative(variant["path"])
+                for encoding in variant["formats"].values():
+                    encoding["path"] = await store_derivative(encoding["path"])
+            for encoding in encodings.values():
+                encoding["path"] = await store_derivative(encoding["path"])
+            if animation:
+                animation["poster"]["path"] = await store_derivative(animation["poster"]["path"])
+                ffmpeg = find_ffmpeg()
+                if ffmpeg:
+                    video = await run_in_threadpool(
+                        encode_loop_video, source_path, os.path.join(output_dir, f"{stem}_loop.mp4"), ffmpeg
+                    )
+                    if video and video["size"] < os.path.getsize(source_path):
+                        animation["video"] = {**video, "path": await store_derivative(video["path"])}
+                    elif video:
+                        os.remove(video["path"])
+        return {
+            "variants": json.dumps(variants),
+            "encodings": json.dumps(encodings),
+            "animation": json.dumps(animation) if animation else None,
+            "placeholder": placeholder["placeholder"],
+            "dominant_color": placeholder["dominant_color"],
+            "palette": format_palette(palette),
+            "perceptual_hash": perceptual_hash,
+            **dimensions,
+            **exif,
+        }
+
+    async def get_original_encoding(self, image: Image, accept: Optional[str] = None) -> Tuple[str, str]:
+        """Get the smallest stored full-size encoding of an image the client accepts.
+
+        Returns the file's storage key and media type.
+        """
+        base = {"path": image.file_path, "size": image.file_size}
+        path, media_type = choose_encoding(base, json.loads(image.encodings or "{}"), accept)
+        return path, media_type
+
+    async def get_variant_encoding(
+        self,
+        image: Image,
+        width: int,
+        accept: Optional[str] = None
+    ) -> Tuple[str, str]:
+        """Get the smallest stored encoding of one of an image's resized variants"""
+        for variant in json.loads(image.variants or "[]"):
+            if variant["width"] == width:
+                path, media_type = choose_encoding(variant, variant.get("formats", {}), accept)
+                return path, media_type
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Image variant not found"
+        )
+
+    async def get_animation_file(self, image: Image, kind: str) -> Tuple[str, str]:
+        """Get the stored ``poster`` frame or looping ``video`` of an animated image, with its media type"""
+        animation = json.loads(image.animation or "null") or {}
+        if not animation.get(kind):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Image has no {kind}"
+            )
+        key = animation[kind]["path"]
+        return key, media_type_for(key)
+
+    async def get_watermarked_encoding(self, image: Image, key: str, media_type: str, width: Optional[int]) -> Tuple[str, str]:
+        """Get the watermarked copy of one of a public image's stored encodings, to serve in its place.
+
+        Copies are made ahead of time by the ``watermark_image`` job. One
+        that is not stored yet is queued ahead of bulk work and answered
+        with a 503 and Retry-After; the unmarked file is never served
+        instead. The file itself is returned when watermarking is off or
+        it is under WATERMARK_MIN_WIDTH wide.
+        """
+        watermark = self._watermark_for(width)
+        if watermark is None:
+            return key, media_type
+        wm_key, wm_media_type = watermarked_key(key, watermark)
+        if not await self._watermark_stored(wm_key):
+            self._watermarks_pending([image])
+        return wm_key, wm_media_type
+
+    async def get_watermarked_video(self, image: Image) -> Tuple[str, str]:
+        """Get an animated image's looping video to serve publicly, watermarked like its other files"""
+        key, media_type = await self.get_animation_file(image, "video")
+        watermark = self._watermark_for(image.width)
+        if watermark is None:
+            return key, media_type
+        if find_ffmpeg() is None:
+            # Watermarked videos can't be made without ffmpeg; the GIF/WebP is served instead
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Image has no video"
+            )
+        wm_key, wm_media_type = watermarked_key(key, watermark)
+        if not await self._watermark_stored(wm_key):
+            self._watermarks_pending([image])
+        return wm_key, wm_media_type
+
+    @staticmethod
+    def _watermark_for(width: Optional[int]) -> Optional[Watermark]:
+        """Get the watermark for a publicly served file ``width`` pixels wide, or None if it gets none"""
+        watermark = get_watermark()
+        if watermark is None or (width is not None and width < settings.WATERMARK_MIN_WIDTH):
+            return None
+        return watermark
+
+    @staticmethod
+    async def _watermark_stored(key: str) -> bool:
+        """Check whether a watermarked copy has been stored yet"""
+        if key not in _watermarked_keys:
+            if not await run_in_threadpool(get_storage().exists, key):
+                return False
+            _watermarked_keys.add(key)
+        return True
+
+    def _watermarks_pending(self, images: List[Image]):
+        """Make sure the images' watermarked copies are being made, and ask the client to come back for them"""
+        for image in images:
+            self.enqueue_watermarks(image, priority=PRIORITY_INTERACTIVE)
+        self.db.commit()
+        notify_job_workers()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The watermarked image is being prepared, try again shortly",
+            headers={"Retry-After": str(WATERMARK_RETRY_AFTER_SECONDS)},
+        )
+
+    async def make_watermarked_encoding(self, key: str, width: Optional[int]) -> Optional[str]:
+        """Composite and store the watermarked copy of a publicly served file unless it already is.
+
+        Copies are stored next to the derivatives under a name including
+        the watermark's fingerprint, so each is composited once and
+        changing the logo or settings simply moves on to new files (the
+        old ones are left for storage reconciliation). Returns the copy's
+        key, or None when the file needs no watermark.
+        """
+        watermark = self._watermark_for(width)
+        if watermark is None:
+            return None
+        wm_key, _ = watermarked_key(key, watermark)
+
+        async def composite(source_path: str, dest_path: str):
+            await run_in_process(watermark_file, source_path, dest_path, watermark)
+
+        await self._store_once(wm_key, key, composite)
+        return wm_key
+
+    async def make_watermarked_video(self, image: Image) -> Optional[str]:
+        """Encode and store an animated image's watermarked video unless it already is.
+
+        The video is encoded from the watermarked animation rather than
+        composited onto the stored video. Returns its key, or None when
+        the image needs no watermark or ffmpeg is not installed.
+        """
+        key, _ = await self.get_animation_file(image, "video")
+        source = await self.make_watermarked_encoding(image.file_path, image.width)
+        ffmpeg = find_ffmpeg()
+        if source is None or ffmpeg is None:
+            return None
+        wm_key, _ = watermarked_key(key, get_watermark())
+
+        async def encode(source_path: str, dest_path: str):
+            if not await run_in_threadpool(encode_loop_video, source_path, dest_path, ffmpeg):
+                raise RuntimeError(f"Could not encode {source} as video")
+
+        await self._store_once(wm_key, source, encode)
+        return wm_key
+
+    async def _store_once(self, key: str, source_key: str, make: Callable[[str, str], Awaitable]):
+        """Store a file made from another stored file by ``make(source_path, dest_path)``, unless it already is.
+
+        Concurrent requests for the same key wait for the first to make it.
+        """
+        if key in _watermarked_keys:
+            return
+        async with _watermark_locks.hold(key):
+            if key in _watermarked_keys or await run_in_threadpool(get_storage().exists, key):
+                _watermarked_keys.add(key)
+                return
+            name = os.path.basename(key)
+            async with local_copy(source_key) as source_path, derivative_output_dir() as output_dir:
+                # Written under a hidden, unique name first: local output is
+                # already the public location, and other processes may be
+                # making the same file
+                tmp_path = os.path.join(output_dir, f".{uuid.uuid4().hex}-{name}")
+                try:
+                    await make(source_path, tmp_path)
+                    os.replace(tmp_path, os.path.join(output_dir, name))
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                await store_derivative(os.path.join(output_dir, name))
+            _watermarked_keys.add(key)
+
+    @staticmethod
+    def _public_files(image: Image) -> List[Tuple[str, Optional[int]]]:
+        """List the stored files public pages may serve for an image, with their widths"""
+        files = [(image.file_path, image.width)]
+        files.extend((encoding["path"], image.width) for encoding in json.loads(image.encodings or "{}").values())
+        animation = json.loads(image.animation or "null")
+        if animation:
+            files.append((animation["poster"]["path"], animation["poster"]["width"]))
+        for variant in json.loads(image.variants or "[]"):
+            files.append((variant["path"], variant["width"]))
+            files.extend((encoding["path"], variant["width"]) for encoding in variant.get("formats", {}).values())
+        return files
+
+    def enqueue_watermarks(self, image: Image, priority: int = PRIORITY_BULK) -> Optional[Job]:
+        """Queue watermarking a public image's files ahead of their first request; the caller commits"""
+        if get_watermark() is None or not image.is_public or image.processing_status != "ready":
+            return None
+        return JobService(self.db).enqueue(
+            "watermark_image",
+            {"content_hash": image.content_hash},
+            priority=priority,
+            dedupe_key=f"watermark_image:{image.content_hash}",
+        )
+
+    def enqueue_all_watermarks(self) -> int:
+        """Queue watermarking every public image, e.g. after the watermark changed"""
+        images = self.db.query(Image).filter(Image.is_public == True, Image.processing_status == "ready")
+        jobs = {job.id for job in map(self.enqueue_watermarks, images) if job is not None}
+        self.db.commit()
+        notify_job_workers()
+        return len(jobs)
+
+    async def watermark_content(self, content_hash: str) -> dict:
+        """Make the watermarked copies of a stored file's public encodings.
+
+        Runs as the ``watermark_image`` background job; public requests
+        only ever serve the copies it has stored.
+        """
+        image = self.db.query(Image).filter(
+            Image.content_hash == content_hash, Image.is_public == True, Image.processing_status == "ready"
+        ).first()
+        if image is None or get_watermark() is None:
+            return {"watermarked": 0}
+        watermarked = 0
+        for key, width in self._public_files(image):
+            watermarked += await self.make_watermarked_encoding(key, width) is not None
+        if (json.loads(image.animation or "null") or {}).get("video"):
+            watermarked += await self.make_watermarked_video(image) is not None
+        return {"watermarked": watermarked}
+
+    async def stream_archive(
+        self,
+        user: Optional[User],
+        category: Optional[str] = None,
+        image_ids: Optional[List[int]] = None
+    ) -> Iterator[bytes]:
+        """Get a generator streaming a ZIP of the originals of a category or a selection of images.
+
+        Only images the user may see are included. Files are read from
+        storage and written out as stored entries chunk by chunk, so
+        memory use stays flat whatever the archive's size; the database is
+        only queried up front. Anonymous downloads get the watermarked
+        copies when watermarking is on; if some are not made yet, they are
+        queued and the download is answered with a 503 and Retry-After.
+        """
+        if not image_ids and not category:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Choose a category or images to download"
+            )
+        query = self.db.query(Image)
+        if image_ids:
+            query = query.filter(Image.id.in_(image_ids))
+        else:
+            query = query.filter(Image.category == category)
+        if user is None:
+            query = query.filter(Image.is_public == True)
+        elif not user.is_admin:
+            query = query.filter(or_(Image.is_public == True, Image.owner_id == user.id))
+        images = query.order_by(Image.id).all()
+        if not images:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No images to download"
+            )
+
+        storage = get_storage()
+        used_names = set()
+        entries = []
+        pending = []
+        for image in images:
+            key, size = image.file_path, image.file_size
+            watermark = self._watermark_for(image.width) if user is None else None
+            if watermark:
+                key = watermarked_key(key, watermark)[0]
+                if not await self._watermark_stored(key):
+                    pending.append(image)
+                    continue
+                # Its size is not recorded anywhere; the entry gets ZIP64 sizes instead
+                size = None
+            extension = os.path.splitext(key)[1]
+            stem = "".join(c if c.isalnum() or c in " -_.()" else "_" for c in image.title or "").strip(" .") or f"image-{image.id}"
+            name, counter = f"{stem}{extension}", 2
+            while name.lower() in used_names:
+                name, counter = f"{stem} ({counter}){extension}", counter + 1
+            used_names.add(name.lower())
+            taken = image.captured_at or image.created_at
+            entries.append((name, key, size, taken.timestamp() if taken else None))
+        if pending:
+            self._watermarks_pending(pending)
+
+        return stream_zip(
+            ZipEntry(name, storage.read_range(key), size, modified)
+            for name, key, size, modified in entries
+        )
+
+    async def create_signed_urls(self, request: SignedUrlRequest, user: User) -> List[SignedUrl]:
+        """Create links to images' files that work without logging in until they expire.
+
+        Expiry times are rounded up to the hour, so links created again
+        within the hour are identical and stay cached in browsers.
+        """
+        expires_in = request.expires_in or settings.SIGNED_URL_EXPIRE_SECONDS
+        if expires_in > settings.SIGNED_URL_MAX_EXPIRE_SECONDS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Links can be valid for at most {settings.SIGNED_URL_MAX_EXPIRE_SECONDS} seconds"
+            )
+        expires = (int(time.time() + expires_in) // 3600 + 1) * 3600
+
+        images = {image.id: image for image in self.db.query(Image).filter(Image.id.in_(request.image_ids))}
+        missing = [image_id for image_id in request.image_ids if image_id not in images]
+        if missing:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Images not found: {', '.join(map(str, missing))}"
+            )
+        if not all(self.can_view(image, user) for image in images.values()):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Not enough permissions"
+            )
+
+        signed = []
+        for image_id in request.image_ids:
+            image = images[image_id]
+            key, width = image.file_path, None
+            if request.width:
+                variants = sorted(json.loads(image.variants or "[]"), key=lambda v: v["width"])
+                variant = next((v for v in variants if v["width"] >= request.width), None)
+                if variant:
+                    key, width = variant["path"], variant["width"]
+            signed.append(SignedUrl(
+                image_id=image_id,
+                url=create_signed_file_url(image_id, str(width or "original"), key, expires),
+                width=width,
+                expires_at=datetime.utcfromtimestamp(expires),
+            ))
+        return signed
+
+    async def get_transformed_image(
+        self,
+        image: Image,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        fit: str = "contain",
+        quality: int = 82,
+        fmt: Optional[str] = None,
+        accept: Optional[str] = None,
+        watermarked: bool = False,
+    ) -> Tuple[str, str]:
+        """Get a resized/re-encoded copy of an image, computing it on first request.
+
+        Without an explicit ``fmt`` the preferred modern format named in the
+        client's ``accept`` header is used, falling back to the original's
+        format. With ``watermarked`` the configured watermark is composited
+        in while transforming. Returns the cached file's path and its media
+        type.
+        """
+        if fmt is None:
+            fmt = preferred_format(supported_formats(settings.MODERN_FORMATS), accept)
+        if fmt is None:
+            fmt = "png" if image.mime_type in ("image/png", "image/gif") else "jpeg"
+        elif not supported_formats([fmt]):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Image format '{fmt}' is not supported by this server"
+            )
+
+        watermark = get_watermark() if watermarked else None
+        key_source = f"{image.filename}|{width}|{height}|{fit}|{quality}|{fmt}"
+        if watermark:
+            key_source += f"|wm{watermark.fingerprint}"
+        key = f"{hashlib.sha256(key_source.encode()).hexdigest()}.{fmt}"
+        media_type = f"image/{fmt}"
+
+        cache = get_variant_cache()
+        path = cache.get(key)
+        if path:
+            return path, media_type
+
+        async with _transform_locks.hold(key):
+            # Another request may have produced it while we waited
+            path = cache.get(key)
+            if path:
+                return path, media_type
+
+            if not await run_in_threadpool(get_storage().exists, image.file_path):
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Image file not found"
+                )
+
+            tmp_path = cache.temp_path(key)
+            try:
+                async with local_copy(image.file_path) as source_path:
+                    await run_in_process(
+                        transform_image, source_path, tmp_path,
+                        width, height, fit, quality, fmt.upper(), watermark,
+                    )
+            except Exception as e:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                logger.exception("Error transforming image %s", image.id)
+                if isinstance(e, UnidentifiedImageError):
+                    raise HTTPException(
+                        status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                        detail="Image could not be decoded"
+                    )
+                if isinstance(e, (DecompressionBombError, MemoryError)):
+                    # Over the pixel limit, or over the worker's memory limit while decoding
+                    raise HTTPException(
+                        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                        detail="Image is too large to transform"
+                    )
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail="Error transforming image"
+                )
+            return cache.put(key, tmp_path), media_type
@@ -0,0 +1,184 @@
+import json
+import random
+from datetime import datetime, timedelta
+from typing import Any, Callable, List, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.job import Job
+
+ACTIVE_STATUSES = ("queued", "running")
+
+class PermanentJobError(Exception):
+    """Raised by a job handler when retrying cannot help (e.g. the input is invalid)"""
+
+# Callbacks run after jobs are enqueued, so in-process workers can wake up
+# instead of waiting for their next poll
+_wakeup_callbacks: List[Callable[[], None]] = []
+
+def add_wakeup_callback(callback: Callable[[], None]):
+    _wakeup_callbacks.append(callback)
+
+def remove_wakeup_callback(callback: Callable[[], None]):
+    if callback in _wakeup_callbacks:
+        _wakeup_callbacks.remove(callback)
+
+def notify_job_workers():
+    """Tell workers in this process that new jobs are waiting; call after committing them"""
+    for callback in list(_wakeup_callbacks):
+        callback()
+
+class JobService:
+    """Durable job queue stored in the application database.
+
+    Jobs are claimed with a conditional UPDATE, so any number of worker
+    processes can share the table without a broker or row locks. Failed
+    jobs are retried with exponential backoff until max_attempts; jobs
+    whose worker died are requeued once their lock goes stale.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def enqueue(
+        self,
+        job_type: str,
+        payload: Optional[dict] = None,
+        priority: int = 0,
+        dedupe_key: Optional[str] = None,
+        max_attempts: Optional[int] = None,
+        created_by_id: Optional[int] = None,
+    ) -> Job:
+        """Add a job to the session without committing it.
+
+        Committing is left to the caller so a job can be saved in the same
+        transaction as the rows it works on; call notify_job_workers()
+        afterwards. With a ``dedupe_key`` an already queued or running job
+        with the same key is returned instead of adding another.
+        """
+        if dedupe_key:
+            existing = self.db.query(Job).filter(
+                Job.dedupe_key == dedupe_key, Job.status.in_(ACTIVE_STATUSES)
+            ).first()
+            if existing:
+                if priority > existing.priority and existing.status == "queued":
+                    existing.priority = priority
+                return existing
+
+        job = Job(
+            type=job_type,
+            payload=json.dumps(payload or {}),
+            status="queued",
+            priority=priority,
+            attempts=0,
+            max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+            run_at=datetime.utcnow(),
+            dedupe_key=dedupe_key,
+            created_by_id=created_by_id,
+        )
+        self.db.add(job)
+        self.db.flush()
+        return job
+
+    def get_job(self, job_id: int) -> Job:
+        job = self.db.query(Job).filter(Job.id == job_id).first()
+        if not job:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Job not found"
+            )
+        return job
+
+    def get_jobs(
+        self,
+        skip: int = 0,
+        limit: int = 100,
+        job_status: Optional[str] = None,
+        job_type: Optional[str] = None,
+    ) -> List[Job]:
+        query = self.db.query(Job)
+        if job_status:
+            query = query.filter(Job.status == job_status)
+        if job_type:
+            query = query.filter(Job.type == job_type)
+        return query.order_by(Job.id.desc()).offset(skip).limit(limit).all()
+
+    def claim(self, worker_id: str) -> Optional[Job]:
+        """Claim the next due job for a worker, highest priority first"""
+        now = datetime.utcnow()
+        # A few candidates, in case other workers win the race for the first ones
+        candidates = self.db.query(Job.id).filter(
+            Job.status == "queued", Job.run_at <= now
+        ).order_by(Job.priority.desc(), Job.run_at, Job.id).limit(5).all()
+
+        for job_id, in candidates:
+            claimed = self.db.query(Job).filter(Job.id == job_id, Job.status == "queued").update(
+                {
+                    Job.status: "running",
+                    Job.locked_by: worker_id,
+                    Job.locked_at: now,
+                    Job.attempts: Job.attempts + 1,
+                },
+                synchronize_session=False,
+            )
+            self.db.commit()
+            if claimed:
+                return self.db.query(Job).filter(Job.id == job_id).first()
+        return None
+
+    def complete(self, job: Job, result: Any = None):
+        job.status = "succeeded"
+        job.result = json.dumps(result) if result is not None else None
+        job.last_error = None
+        job.finished_at = datetime.utcnow()
+        job.locked_by = None
+        self.db.commit()
+
+    def fail(self, job: Job, error: str, retry: bool = True):
+        """Record a failed attempt, scheduling a retry with backoff while attempts remain"""
+        job.last_error = error
+        job.locked_by = None
+        if retry and job.attempts < job.max_attempts:
+            delay = settings.JOB_RETRY_BASE_SECONDS * 2 ** (job.attempts - 1)
+            # Jitter so jobs that failed together don't all retry together
+            job.run_at = datetime.utcnow() + timedelta(seconds=delay * random.uniform(0.8, 1.2))
+            job.status = "queued"
+        else:
+            job.status = "failed"
+            job.finished_at = datetime.utcnow()
+        self.db.commit()
+
+    def release(self, job: Job):
+        """Put a claimed job back in the queue without counting the attempt (e.g. on shutdown)"""
+        job.status = "queued"
+        job.attempts = max(job.attempts - 1, 0)
+        job.locked_by = None
+        job.locked_at = None
+        self.db.commit()
+
+    def retry(self, job_id: int) -> Job:
+        """Requeue a failed job for another round of attempts"""
+        job = self.get_job(job_id)
+        if job.status != "failed":
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Only failed jobs can be retried"
+            )
+        job.status = "queued"
+        job.attempts = 0
+        job.run_at = datetime.utcnow()
+        job.finished_at = None
+        self.db.commit()
+        self.db.refresh(job)
+        notify_job_workers()
+        return job
+
+    def requeue_stale(self, timeout_seconds: int) -> int:
+        """Requeue running jobs whose worker has held them too long, presumably because it died"""
+        cutoff = datetime.utcnow() - timedelta(seconds=timeout_seconds)
+        stale = self.db.query(Job).filter(Job.status == "running", Job.locked_at < cutoff).all()
+        for job in stale:
+            self.fail(job, f"Worker {job.locked_by} stopped responding")
+        return len(stale)
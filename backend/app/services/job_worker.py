@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.base import SessionLocal
+from app.models.job import Job
+from app.services.job_service import (
+    JobService, PermanentJobError, add_wakeup_callback, remove_wakeup_callback,
+)
+
+logger = logging.getLogger(__name__)
+
+async def _process_image(db: Session, job: Job):
+    from app.services.image_service import ImageService
+    payload = json.loads(job.payload)
+    return await ImageService(db).process_content(
+        payload["content_hash"], final_attempt=job.attempts >= job.max_attempts
+    )
+
+async def _crop_hero_slide(db: Session, job: Job):
+    from app.services.hero_slide_service import HeroSlideService
+    payload = json.loads(job.payload)
+    return await HeroSlideService(db).generate_crops(payload["slide_id"])
+
+async def _watermark_image(db: Session, job: Job):
+    from app.services.image_service import ImageService
+    payload = json.loads(job.payload)
+    return await ImageService(db).watermark_content(payload["content_hash"])
+
+async def _reconcile_storage(db: Session, job: Job):
+    from app.services.reconciliation_service import reconcile_in_slices
+    return await run_in_threadpool(reconcile_in_slices, job.id)
+
+# Job type -> handler; handlers get their own session and the claimed job,
+# and return a JSON-serialisable result
+JOB_HANDLERS: Dict[str, Callable[[Session, Job], Awaitable]] = {
+    "process_image": _process_image,
+    "crop_hero_slide": _crop_hero_slide,
+    "watermark_image": _watermark_image,
+    "reconcile_storage": _reconcile_storage,
+}
+
+# How often running workers look for jobs abandoned by dead workers
+STALE_CHECK_INTERVAL = 60
+
+class JobWorker:
+    """Claims and runs queued jobs, up to ``concurrency`` at a time.
+
+    Handlers are async and hand their CPU-heavy work to the processing
+    pool, so one worker loop can keep several jobs in flight. ``stop()``
+    starts a graceful drain: no new jobs are claimed, running ones get
+    JOB_DRAIN_SECONDS to finish, and any still running after that are put
+    back in the queue for the next worker.
+    """
+
+    def __init__(self, concurrency: Optional[int] = None, poll_interval: Optional[float] = None):
+        self.concurrency = concurrency or settings.JOB_CONCURRENCY
+        self.poll_interval = poll_interval or settings.JOB_POLL_INTERVAL
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._stopping = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self._tasks: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def wake(self):
+        """Stop waiting for the next poll; safe to call from any thread"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def stop(self):
+        """Stop claiming jobs and drain the running ones"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+            self.wake()
+
+    async def run(self):
+        """Run jobs until stop() is called, then drain"""
+        self._loop = asyncio.get_running_loop()
+        add_wakeup_callback(self.wake)
+        logger.info("Job worker %s started (%d concurrent jobs)", self.worker_id, self.concurrency)
+        slots = asyncio.Semaphore(self.concurrency)
+        last_stale_check = 0.0
+        try:
+            while not self._stopping.is_set():
+                if time.monotonic() - last_stale_check > STALE_CHECK_INTERVAL:
+                    last_stale_check = time.monotonic()
+                    self._requeue_stale()
+
+                await slots.acquire()
+                if self._stopping.is_set():
+                    slots.release()
+                    break
+
+                job = self._claim()
+                if job is None:
+                    slots.release()
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                task = asyncio.create_task(self._execute(job.id))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+                task.add_done_callback(lambda _: slots.release())
+        finally:
+            remove_wakeup_callback(self.wake)
+            await self._drain()
+            logger.info("Job worker %s stopped", self.worker_id)
+
+    async def _drain(self):
+        if not self._tasks:
+            return
+        logger.info("Waiting up to %ss for %d running job(s)...", settings.JOB_DRAIN_SECONDS, len(self._tasks))
+        _, pending = await asyncio.wait(set(self._tasks), timeout=settings.JOB_DRAIN_SECONDS)
+        for task in pending:
+            task.cancel()
+        if pending:
+            # Cancelled jobs release themselves back to the queue
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def _claim(self) -> Optional[Job]:
+        db = SessionLocal()
+        try:
+            job = JobService(db).claim(self.worker_id)
+            if job is not None:
+                db.expunge(job)
+            return job
+        except Exception:
+            logger.exception("Error claiming job")
+            return None
+        finally:
+            db.close()
+
+    def _requeue_stale(self):
+        db = SessionLocal()
+        try:
+            requeued = JobService(db).requeue_stale(settings.JOB_TIMEOUT_SECONDS + STALE_CHECK_INTERVAL)
+            if requeued:
+                logger.info("Requeued %d stale job(s)", requeued)
+        except Exception:
+            logger.exception("Error requeueing stale jobs")
+        finally:
+            db.close()
+
+    async def _execute(self, job_id: int):
+        db = SessionLocal()
+        job_service = JobService(db)
+        try:
+            job = job_service.get_job(job_id)
+            handler = JOB_HANDLERS.get(job.type)
+            if handler is None:
+                job_service.fail(job, f"Unknown job type: {job.type}", retry=False)
+                return
+            try:
+                result = await asyncio.wait_for(handler(db, job), timeout=settings.JOB_TIMEOUT_SECONDS)
+            except asyncio.CancelledError:
+                db.rollback()
+                job_service.release(job)
+                raise
+            except PermanentJobError as e:
+                db.rollback()
+                job_service.fail(job, str(e), retry=False)
+            except asyncio.TimeoutError:
+                db.rollback()
+                job_service.fail(job, f"Timed out after {settings.JOB_TIMEOUT_SECONDS}s")
+            except Exception as e:
+                db.rollback()
+                logger.exception("Job %s (%s) failed on attempt %d", job.id, job.type, job.attempts)
+                job_service.fail(job, f"{type(e).__name__}: {e}")
+            else:
+                job_service.complete(job, result)
+        finally:
+            db.close()
+
+_app_worker: Optional[JobWorker] = None
+_app_worker_task: Optional[asyncio.Task] = None
+
+def start_app_worker():
+    """Run a job worker inside the API process (see RUN_JOB_WORKER_IN_APP)"""
+    global _app_worker, _app_worker_task
+    if _app_worker_task is None:
+        _app_worker = JobWorker()
+        _app_worker_task = asyncio.create_task(_app_worker.run())
+
+async def stop_app_worker():
+    """Drain and stop the in-process job worker, if one is running"""
+    global _app_worker, _app_worker_task
+    if _app_worker_task is not None:
+        _app_worker.stop()
+        await _app_worker_task
+        _app_worker, _app_worker_task = None, None
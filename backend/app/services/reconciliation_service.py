@@ -0,0 +1,326 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.base import SessionLocal
+from app.models.hero_slide import HeroSlide
+from app.models.image import Image
+from app.models.job import Job
+from app.services.hero_slide_service import crop_paths
+from app.services.job_service import JobService, notify_job_workers
+from app.utils.files import upload_key, variant_key
+from app.utils.storage import Storage, get_storage
+from app.utils.watermark import get_watermark, watermarked_key
+
+logger = logging.getLogger(__name__)
+
+# Rows and keys checked per round trip to the database (and per checkpoint)
+BATCH_SIZE = 200
+
+# Findings listed in a report per kind; the counts always cover everything
+REPORT_LIMIT = 1000
+
+# Queued below uploads and imports
+PRIORITY_MAINTENANCE = -10
+
+# Only one reconciliation is queued or running at a time
+RECONCILE_DEDUPE_KEY = "reconcile_storage"
+
+_HASH_NAME = re.compile(r"^[0-9a-f]{64}$")
+
+def new_state() -> dict:
+    """A reconciliation that has not started yet; saved between runs to resume"""
+    return {
+        "phase": "images",
+        "last_image_id": 0,
+        "last_key": None,
+        "images_checked": 0,
+        "files_checked": 0,
+        "findings": {kind: {"count": 0, "items": []} for kind in (
+            "missing_files", "size_mismatches", "hash_mismatches", "missing_derivatives", "orphans",
+        )},
+        "orphan_bytes": 0,
+        "removed": 0,
+        "removed_bytes": 0,
+        "complete": False,
+    }
+
+def _batches(items: Iterable, size: int) -> Iterable[list]:
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+class ReconciliationService:
+    """Finds where the images table and stored files disagree.
+
+    Two passes: every image row is checked for its original (size and,
+    optionally, SHA-256) and derivatives, then every stored file under
+    ``UPLOAD_DIR`` and ``VARIANT_DIR`` is checked for a row referencing
+    it. Storage calls run in a thread pool, so hashing and stat calls
+    (or S3 requests) overlap. Both passes walk in a fixed order and record
+    how far they got in a state dict after each batch, so a run on a large
+    library can stop and resume where it left off.
+    """
+
+    def __init__(self, db: Session, storage: Optional[Storage] = None, workers: Optional[int] = None):
+        self.db = db
+        self.storage = storage or get_storage()
+        self.workers = workers or settings.RECONCILE_WORKERS
+
+    def run(
+        self,
+        state: Optional[dict] = None,
+        remove_orphans: bool = False,
+        verify_hashes: bool = False,
+        deadline: Optional[float] = None,
+        checkpoint: Optional[Callable[[dict], None]] = None,
+    ) -> dict:
+        """Continue a reconciliation from ``state`` (a new one by default) and return the updated state.
+
+        Orphan files are only deleted with ``remove_orphans``, and only once
+        older than RECONCILE_ORPHAN_GRACE_SECONDS so uploads still being
+        recorded are left alone. The run stops early, with ``complete``
+        false, when the ``time.monotonic()`` ``deadline`` passes;
+        ``checkpoint`` is called with the state after every batch.
+        """
+        state = state or new_state()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="reconcile") as pool:
+            if state["phase"] == "images":
+                for batch in self._image_batches(state["last_image_id"]):
+                    self._check_images(pool, batch, state, verify_hashes)
+                    state["last_image_id"] = batch[-1].id
+                    if checkpoint:
+                        checkpoint(state)
+                    if deadline is not None and time.monotonic() > deadline:
+                        return state
+                state["phase"] = "files"
+
+            if state["phase"] == "files":
+                for prefix in self._file_prefixes():
+                    if state["last_key"] and not state["last_key"].startswith(prefix) and state["last_key"] > prefix:
+                        continue
+                    keys = self.storage.list_keys(prefix, start_after=state["last_key"])
+                    for batch in _batches(keys, BATCH_SIZE):
+                        self._check_files(pool, batch, state, remove_orphans)
+                        state["last_key"] = batch[-1]
+                        if checkpoint:
+                            checkpoint(state)
+                        if deadline is not None and time.monotonic() > deadline:
+                            return state
+                state["phase"] = "done"
+                state["complete"] = True
+        if checkpoint:
+            checkpoint(state)
+        return state
+
+    def enqueue(self, remove_orphans: bool, verify_hashes: bool, user_id: Optional[int] = None) -> Job:
+        """Queue a reconciliation as a background job, or return the one already queued or running"""
+        job = JobService(self.db).enqueue(
+            "reconcile_storage",
+            {"remove_orphans": remove_orphans, "verify_hashes": verify_hashes},
+            priority=PRIORITY_MAINTENANCE,
+            dedupe_key=RECONCILE_DEDUPE_KEY,
+            created_by_id=user_id,
+        )
+        self.db.commit()
+        self.db.refresh(job)
+        notify_job_workers()
+        return job
+
+    def _image_batches(self, after_id: int) -> Iterable[list]:
+        # Plain rows rather than Image objects, so the session doesn't grow with the library
+        query = self.db.query(
+            Image.id, Image.file_path, Image.file_size, Image.content_hash, Image.variants, Image.encodings,
+            Image.animation,
+        )
+        while True:
+            batch = query.filter(Image.id > after_id).order_by(Image.id).limit(BATCH_SIZE).all()
+            if not batch:
+                return
+            yield batch
+            after_id = batch[-1].id
+
+    @staticmethod
+    def _file_prefixes() -> List[str]:
+        """The directories to scan, leaving out ones nested in another"""
+        prefixes = sorted({upload_key(""), variant_key("")})
+        return [prefix for prefix in prefixes if not any(
+            prefix != other and prefix.startswith(other) for other in prefixes
+        )]
+
+    def _check_images(self, pool: ThreadPoolExecutor, images: list, state: dict, verify_hashes: bool):
+        from app.services.image_service import ImageService
+
+        # Rows sharing content share files; look at each file once
+        originals = {}
+        derivatives: Dict[str, List[int]] = {}
+        for image in images:
+            originals.setdefault(image.file_path, image)
+            stored = Image(
+                file_path=image.file_path, variants=image.variants, encodings=image.encodings, animation=image.animation
+            )
+            for path in ImageService._stored_paths(stored)[1:]:
+                derivatives.setdefault(path, []).append(image.id)
+
+        def check_original(image) -> Optional[dict]:
+            info = self.storage.stat(image.file_path)
+            if info is None:
+                return {"kind": "missing_files"}
+            if image.file_size is not None and info["size"] != image.file_size:
+                return {"kind": "size_mismatches", "expected": image.file_size, "actual": info["size"]}
+            if verify_hashes and image.content_hash:
+                digest = hashlib.sha256()
+                for chunk in self.storage.read_range(image.file_path):
+                    digest.update(chunk)
+                if digest.hexdigest() != image.content_hash:
+                    return {"kind": "hash_mismatches", "expected": image.content_hash, "actual": digest.hexdigest()}
+            return None
+
+        for image, problem in zip(originals.values(), pool.map(check_original, originals.values())):
+            if problem:
+                kind = problem.pop("kind")
+                for row in images:
+                    if row.file_path == image.file_path:
+                        self._record(state, kind, {"image_id": row.id, "key": row.file_path, **problem})
+
+        missing = {}
+        for path, exists in zip(derivatives, pool.map(self.storage.exists, derivatives)):
+            if not exists:
+                for image_id in derivatives[path]:
+                    missing.setdefault(image_id, []).append(path)
+        for image_id, paths in missing.items():
+            self._record(state, "missing_derivatives", {"image_id": image_id, "keys": paths})
+
+        state["images_checked"] += len(images)
+
+    def _check_files(self, pool: ThreadPoolExecutor, keys: List[str], state: dict, remove_orphans: bool):
+        referenced = self._referenced_keys(keys)
+        candidates = [key for key in keys if key not in referenced]
+        state["files_checked"] += len(keys)
+        if not candidates:
+            return
+
+        cutoff = time.time() - settings.RECONCILE_ORPHAN_GRACE_SECONDS
+        stats = list(pool.map(self.storage.stat, candidates))
+        orphans = [
+            (key, info) for key, info in zip(candidates, stats)
+            # Too new files may belong to an upload whose row is not committed yet
+            if info is not None and info["modified"] < cutoff
+        ]
+        for key, info in orphans:
+            state["orphan_bytes"] += info["size"]
+            self._record(state, "orphans", {"key": key, "size": info["size"]})
+
+        if remove_orphans and orphans:
+            # Check again just before deleting, in case a row was added meanwhile
+            still_orphaned = set(key for key, _ in orphans) - self._referenced_keys([key for key, _ in orphans])
+            to_remove = [(key, info) for key, info in orphans if key in still_orphaned]
+
+            def remove(key: str) -> bool:
+                try:
+                    return self.storage.delete(key)
+                except Exception as e:
+                    logger.warning("Could not remove orphan file %s: %s", key, e)
+                    return False
+
+            for (key, info), removed in zip(to_remove, pool.map(remove, [key for key, _ in to_remove])):
+                if removed:
+                    logger.info("Removed orphan file %s (%d bytes)", key, info["size"])
+                    state["removed"] += 1
+                    state["removed_bytes"] += info["size"]
+
+    def _referenced_keys(self, keys: List[str]) -> set:
+        """Get which of the given stored keys an image row refers to"""
+        from app.services.image_service import ImageService
+
+        # Files are named after the content hash (derivatives as <hash>_<width>.<ext>);
+        # older uploads may have other names, found through their file name instead
+        stems = {os.path.basename(key).split(".")[0].split("_")[0] for key in keys}
+        hashes = [stem for stem in stems if _HASH_NAME.match(stem)]
+        conditions = [Image.file_path.in_(keys)]
+        if hashes:
+            conditions.append(Image.content_hash.in_(hashes))
+        conditions.extend(Image.filename.like(f"{stem}.%") for stem in stems if stem and stem not in hashes)
+
+        query = self.db.query(Image.file_path, Image.variants, Image.encodings, Image.animation).filter(or_(*conditions))
+        referenced = set()
+        for file_path, variants, encodings, animation in query:
+            referenced.update(ImageService._stored_paths(
+                Image(file_path=file_path, variants=variants, encodings=encodings, animation=animation)
+            ))
+        # Watermarked copies count while the watermark they were made with is current
+        watermark = get_watermark()
+        if watermark:
+            referenced.update([watermarked_key(path, watermark)[0] for path in referenced])
+        # Hero slide crops are named after their image too
+        slides = self.db.query(HeroSlide.crops).join(Image, HeroSlide.image_id == Image.id).filter(
+            HeroSlide.crops.isnot(None), or_(*conditions)
+        )
+        for crops, in slides:
+            referenced.update(crop_paths(crops))
+        return referenced & set(keys)
+
+    @staticmethod
+    def _record(state: dict, kind: str, item: dict):
+        finding = state["findings"][kind]
+        finding["count"] += 1
+        if len(finding["items"]) < REPORT_LIMIT:
+            finding["items"].append(item)
+
+def reconcile_in_slices(job_id: int) -> dict:
+    """Run a ``reconcile_storage`` job, stopping well within the job timeout.
+
+    Progress is saved in the job's payload after every batch, so a retry
+    picks up where the failed attempt stopped. A library too large to
+    finish in one job continues in a new job, queued with the state
+    reached so far; its id is in the result.
+
+    Runs in a thread with a session of its own: the job worker rolls back
+    and closes its session when the job times out, which may happen while
+    this is still in the middle of a batch.
+    """
+    db = SessionLocal()
+    try:
+        job_service = JobService(db)
+        job = job_service.get_job(job_id)
+        payload = json.loads(job.payload)
+
+        def checkpoint(state: dict):
+            job.payload = json.dumps({**payload, "state": state})
+            db.commit()
+
+        deadline = time.monotonic() + settings.JOB_TIMEOUT_SECONDS * 0.8
+        state = ReconciliationService(db).run(
+            state=payload.get("state"),
+            remove_orphans=payload.get("remove_orphans", False),
+            verify_hashes=payload.get("verify_hashes", False),
+            deadline=deadline,
+            checkpoint=checkpoint,
+        )
+        if state["complete"]:
+            return state
+
+        continuation = job_service.enqueue(
+            "reconcile_storage", {**payload, "state": state},
+            priority=PRIORITY_MAINTENANCE, created_by_id=job.created_by_id,
+        )
+        # Set afterwards: enqueue() would otherwise dedupe against this still running job
+        continuation.dedupe_key = RECONCILE_DEDUPE_KEY
+        db.commit()
+        notify_job_workers()
+        return {**state, "continued_in_job": continuation.id}
+    finally:
+        db.close()
@@ -0,0 +1,243 @@
+import os
+import json
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+
+import aiofiles
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+from starlette.requests import ClientDisconnect
+
+from app.core.config import settings
+from app.models.image import Image
+from app.models.upload_session import UploadSession
+from app.schemas.image import ImageCreate
+from app.schemas.upload import UploadSessionCreate
+from app.services.image_service import ImageService
+from app.utils.files import HEADER_CHECK_BYTES, check_image_header, validate_filename
+
+class UploadService:
+    """Resumable uploads: a session is created up front, the file arrives as
+    a series of byte ranges appended to a part file, and the finished file is
+    handed to ImageService once every byte has been received.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    @staticmethod
+    def part_path(session_id: str) -> str:
+        return os.path.join(settings.UPLOAD_SESSION_DIR, f"{session_id}.part")
+
+    async def create_session(self, session_data: UploadSessionCreate, user_id: int) -> UploadSession:
+        validate_filename(session_data.filename)
+        if session_data.size > settings.MAX_RESUMABLE_FILE_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"File size exceeds maximum allowed size of {settings.MAX_RESUMABLE_FILE_SIZE} bytes"
+            )
+
+        self.cleanup_expired_sessions()
+
+        session_id = uuid.uuid4().hex
+        os.makedirs(settings.UPLOAD_SESSION_DIR, exist_ok=True)
+        open(self.part_path(session_id), "wb").close()
+
+        image_data = session_data.dict(exclude={"filename", "size", "content_type"})
+        session = UploadSession(
+            id=session_id,
+            filename=session_data.filename,
+            content_type=session_data.content_type,
+            total_size=session_data.size,
+            received_size=0,
+            image_data=json.dumps(image_data),
+            status="active",
+            expires_at=datetime.utcnow() + timedelta(hours=settings.UPLOAD_SESSION_EXPIRE_HOURS),
+            owner_id=user_id,
+        )
+        self.db.add(session)
+        self.db.commit()
+        self.db.refresh(session)
+        return session
+
+    async def get_session(self, session_id: str, user_id: int) -> UploadSession:
+        session = self.db.query(UploadSession).filter(
+            UploadSession.id == session_id,
+            UploadSession.owner_id == user_id
+        ).first()
+        if not session:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Upload session not found"
+            )
+        if session.status == "active" and session.expires_at < datetime.utcnow():
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Upload session has expired"
+            )
+        return session
+
+    async def write_chunk(
+        self,
+        session: UploadSession,
+        start: int,
+        end: int,
+        total: Optional[int],
+        chunks: AsyncIterator[bytes]
+    ) -> UploadSession:
+        """Write the byte range start-end (inclusive) of the upload.
+
+        The range must start at the session's current offset. If the client
+        disconnects part-way through, the bytes that did arrive are kept and
+        the offset advanced, so the retry only sends what is missing.
+        """
+        self._check_active(session)
+        if start != session.received_size:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Chunk must start at offset {session.received_size}"
+            )
+        if total is not None and total != session.total_size:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Content-Range total does not match the declared size of {session.total_size} bytes"
+            )
+        length = end - start + 1
+        if end >= session.total_size:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Chunk extends past the end of the file"
+            )
+        if length > settings.MAX_UPLOAD_CHUNK_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"Chunk size exceeds maximum allowed size of {settings.MAX_UPLOAD_CHUNK_SIZE} bytes"
+            )
+
+        if start == 0:
+            chunks = self._check_header(chunks, os.path.splitext(session.filename)[1], length)
+
+        written = 0
+        disconnected = False
+        async with aiofiles.open(self.part_path(session.id), "r+b") as f:
+            await f.seek(start)
+            try:
+                async for chunk in chunks:
+                    if written + len(chunk) > length:
+                        raise HTTPException(
+                            status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Chunk body is longer than its Content-Range"
+                        )
+                    await f.write(chunk)
+                    written += len(chunk)
+            except ClientDisconnect:
+                disconnected = True
+            await f.truncate(start + written)
+
+        session.received_size = start + written
+        self.db.commit()
+        self.db.refresh(session)
+
+        if written < length and not disconnected:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Chunk body is shorter than its Content-Range; upload resumes at offset {session.received_size}"
+            )
+        return session
+
+    @staticmethod
+    async def _check_header(chunks: AsyncIterator[bytes], file_extension: str, length: int) -> AsyncIterator[bytes]:
+        """Pass through the range at the start of the file, holding back its
+        first bytes until check_image_header has accepted them"""
+        head = b""
+        async for chunk in chunks:
+            if head is None:
+                yield chunk
+                continue
+            head += chunk
+            if len(head) >= min(HEADER_CHECK_BYTES, length):
+                check_image_header(head, file_extension)
+                yield head
+                head = None
+        if head:
+            check_image_header(head, file_extension)
+            yield head
+
+    async def complete_session(self, session: UploadSession, user_id: int) -> Image:
+        """Hand a fully received upload to the regular image creation flow.
+
+        The received file is moved into storage before the image record is
+        created. If creating the record then fails, the session is marked
+        failed, since its bytes are gone (the stored copy is removed again
+        unless another image uses it), and the client has to start over.
+        """
+        self._check_active(session)
+        if session.received_size != session.total_size:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Upload is incomplete: {session.received_size} of {session.total_size} bytes received"
+            )
+        part_path = self.part_path(session.id)
+        if not os.path.exists(part_path):
+            raise HTTPException(
+                status_code=status.HTTP_410_GONE,
+                detail="The uploaded data is no longer available; start a new upload"
+            )
+
+        image_data = ImageCreate(**json.loads(session.image_data))
+        image_service = ImageService(self.db)
+        try:
+            image = await image_service.create_image_from_path(
+                image_data,
+                part_path,
+                session.filename,
+                session.content_type,
+                user_id,
+            )
+        except Exception:
+            if not os.path.exists(part_path):
+                session.status = "failed"
+                self.db.commit()
+            raise
+
+        session.status = "completed"
+        session.image_id = image.id
+        self.db.commit()
+        return image
+
+    @staticmethod
+    def _check_active(session: UploadSession):
+        if session.status == "failed":
+            raise HTTPException(
+                status_code=status.HTTP_410_GONE,
+                detail="Upload session failed; start a new upload"
+            )
+        if session.status != "active":
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Upload session is already completed"
+            )
+
+    async def abort_session(self, session: UploadSession):
+        self._remove_part(session.id)
+        self.db.delete(session)
+        self.db.commit()
+
+    def cleanup_expired_sessions(self):
+        """Drop active and failed sessions past their expiry along with their part files"""
+        expired = self.db.query(UploadSession).filter(
+            UploadSession.status.in_(("active", "failed")),
+            UploadSession.expires_at < datetime.utcnow()
+        ).all()
+        for session in expired:
+            self._remove_part(session.id)
+            self.db.delete(session)
+        if expired:
+            self.db.commit()
+
+    def _remove_part(self, session_id: str):
+        try:
+            os.remove(self.part_path(session_id))
+        except OSError:
+            pass
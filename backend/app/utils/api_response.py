@@ -30,8 +30,8 @@ def ok(data: Any = None, message: str = "Request successful.", meta: Optional[Di
     return build_response(http_status=200, success=True, message=message, data=data, meta=meta)
 
 
-def created(data: Any = None, message: str = "Resource created successfully."):
-    return build_response(http_status=201, success=True, message=message, data=data)
+def created(data: Any = None, message: str = "Resource created successfully.", meta: Optional[Dict[str, Any]] = None):
+    return build_response(http_status=201, success=True, message=message, data=data, meta=meta)
 
 
 def no_content():
@@ -0,0 +1,171 @@
+import re
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Colour names accepted by the gallery's colour search, besides hex codes
+NAMED_COLORS = {
+    "red": "#c62828",
+    "orange": "#ef6c00",
+    "yellow": "#fdd835",
+    "gold": "#c9a227",
+    "green": "#2e7d32",
+    "teal": "#00897b",
+    "blue": "#1565c0",
+    "navy": "#1a237e",
+    "purple": "#6a1b9a",
+    "pink": "#ec407a",
+    "brown": "#6d4c41",
+    "beige": "#e8d9b5",
+    "black": "#111111",
+    "white": "#f5f5f5",
+    "gray": "#808080",
+    "grey": "#808080",
+}
+
+_HEX_COLOR = re.compile(r"^#?([0-9a-fA-F]{3}|[0-9a-fA-F]{6})$")
+
+def parse_color(value: str) -> Tuple[int, int, int]:
+    """Parse a ``#rrggbb``/``#rgb`` hex code (``#`` optional) or a colour name into RGB.
+
+    Raises ValueError for anything else.
+    """
+    value = NAMED_COLORS.get(value.strip().lower(), value.strip())
+    match = _HEX_COLOR.match(value)
+    if not match:
+        raise ValueError(f"Unrecognised colour: {value}")
+    digits = match.group(1)
+    if len(digits) == 3:
+        digits = "".join(digit * 2 for digit in digits)
+    return int(digits[0:2], 16), int(digits[2:4], 16), int(digits[4:6], 16)
+
+def srgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """Convert an (..., 3) array of 0-255 sRGB values to CIE L*a*b* (D65).
+
+    Euclidean distance in Lab approximates perceived colour difference.
+    """
+    rgb = np.asarray(rgb, dtype=np.float64) / 255.0
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ np.array([
+        [0.4124, 0.2126, 0.0193],
+        [0.3576, 0.7152, 0.1192],
+        [0.1805, 0.0722, 0.9505],
+    ])
+    xyz /= np.array([0.95047, 1.0, 1.08883])
+    f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    return np.stack([
+        116 * f[..., 1] - 16,
+        500 * (f[..., 0] - f[..., 1]),
+        200 * (f[..., 1] - f[..., 2]),
+    ], axis=-1)
+
+def format_palette(palette: List[Tuple[str, float]]) -> str:
+    """Serialise a palette as ``#rrggbb:weight`` pairs, e.g. ``#e0b090:0.42,#3a2b20:0.31``"""
+    return ",".join(f"{color}:{weight:.3f}" for color, weight in palette)
+
+def parse_palette(value: Optional[str]) -> List[Tuple[str, float]]:
+    """Parse a palette stored by format_palette"""
+    palette = []
+    for entry in (value or "").split(","):
+        if ":" in entry:
+            color, weight = entry.split(":", 1)
+            palette.append((color, float(weight)))
+    return palette
+
+class ColorIndex:
+    """In-memory index of image palettes for nearest-colour searches.
+
+    Palettes are held as dense NumPy arrays (one row of Lab colours and
+    weights per image), so a search is a single vectorised distance
+    computation over the whole library. Like the near-duplicate index it is
+    built from the database on first use, updated as images are added and
+    removed, and ``signature`` lets callers detect changes made elsewhere.
+    """
+
+    def __init__(self, colors: int = 5):
+        self.colors = colors
+        self.ids = np.empty(0, dtype=np.int64)
+        self.lab = np.empty((0, colors, 3))
+        self.weights = np.empty((0, colors))
+        self.signature: Optional[Tuple[int, Optional[int]]] = None
+        self.lock = threading.Lock()
+
+    def _encode(self, palette: str) -> Tuple[np.ndarray, np.ndarray]:
+        entries = parse_palette(palette)[:self.colors]
+        lab = np.zeros((self.colors, 3))
+        weights = np.zeros(self.colors)
+        if entries:
+            lab[:len(entries)] = srgb_to_lab(np.array([parse_color(color) for color, _ in entries]))
+            weights[:len(entries)] = [weight for _, weight in entries]
+        return lab, weights
+
+    def rebuild(self, rows: Iterable[Tuple[int, str]], signature: Tuple[int, Optional[int]]):
+        ids, labs, weights = [], [], []
+        for image_id, palette in rows:
+            lab, weight = self._encode(palette)
+            ids.append(image_id)
+            labs.append(lab)
+            weights.append(weight)
+        with self.lock:
+            self.ids = np.array(ids, dtype=np.int64)
+            self.lab = np.array(labs).reshape(-1, self.colors, 3)
+            self.weights = np.array(weights).reshape(-1, self.colors)
+            self.signature = signature
+
+    def add(self, image_id: int, palette: str):
+        lab, weights = self._encode(palette)
+        with self.lock:
+            self.ids = np.append(self.ids, image_id)
+            self.lab = np.concatenate([self.lab, lab[None]])
+            self.weights = np.concatenate([self.weights, weights[None]])
+            if self.signature is not None:
+                count, max_id = self.signature
+                self.signature = (count + 1, max(max_id or 0, image_id))
+
+    def remove(self, image_id: int):
+        with self.lock:
+            keep = self.ids != image_id
+            if keep.all():
+                return
+            self.ids, self.lab, self.weights = self.ids[keep], self.lab[keep], self.weights[keep]
+            if self.signature is not None:
+                count, max_id = self.signature
+                self.signature = (count - 1, max_id)
+
+    def search(
+        self,
+        rgb: Tuple[int, int, int],
+        max_distance: float,
+        min_weight: float = 0.1,
+    ) -> List[Tuple[float, int]]:
+        """Find images with a palette colour close to the given one.
+
+        Only palette colours covering at least ``min_weight`` of an image
+        count. Returns (distance, image id) pairs, closest first; ties go
+        to the image where the matching colour covers more of the frame.
+        """
+        target = srgb_to_lab(np.array(rgb))
+        with self.lock:
+            ids, lab, weights = self.ids, self.lab, self.weights
+        if not len(ids):
+            return []
+
+        distances = np.linalg.norm(lab - target, axis=-1)
+        distances[weights < min_weight] = np.inf
+        closest = distances.argmin(axis=1)
+        best = distances[np.arange(len(ids)), closest]
+        coverage = weights[np.arange(len(ids)), closest]
+
+        matches = np.nonzero(best <= max_distance)[0]
+        order = matches[np.lexsort((-coverage[matches], np.round(best[matches], 1)))]
+        return [(round(float(best[i]), 2), int(ids[i])) for i in order]
+
+_index: Optional[ColorIndex] = None
+
+def get_color_index(colors: int = 5) -> ColorIndex:
+    """Get the process-wide palette index"""
+    global _index
+    if _index is None:
+        _index = ColorIndex(colors)
+    return _index
@@ -0,0 +1,299 @@
+"""
+Image engines: the library that decodes, resizes and encodes derivatives.
+
+``pillow`` runs the helpers in app.utils.imaging. ``vips`` uses libvips
+(``pip install pyvips`` plus the libvips library), which streams images
+through in strips and shrinks JPEGs while decoding, so a thumbnail job
+needs a fraction of the memory of a full decode. IMAGE_ENGINE picks one;
+``auto`` uses libvips when it is installed. Animations, watermarked
+transforms and everything other than derivative generation (crops,
+palettes, hashes) always go through Pillow.
+
+Like app.utils.imaging, everything here is CPU-bound; the module-level
+functions are what to hand to app.utils.processing.run_in_process.
+"""
+
+import os
+import logging
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import List, Optional
+
+from PIL import UnidentifiedImageError
+
+from app.core.config import settings
+from app.utils import imaging
+
+try:
+    import pyvips
+except (ImportError, OSError):
+    # OSError: the Python package is there but the libvips library is not
+    pyvips = None
+
+logger = logging.getLogger(__name__)
+
+ENGINE_NAMES = ("auto", "pillow", "vips")
+
+class ImageEngine(ABC):
+    """Generates the resized variants, full-size alternate encodings and on-demand transforms of an image.
+
+    Engines take and return the same values as the functions of the same
+    names in app.utils.imaging.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def generate_variants(
+        self,
+        source_path: str,
+        output_dir: str,
+        stem: str,
+        widths: List[int],
+        quality: int = 82,
+        formats: Optional[List[str]] = None,
+    ) -> List[dict]:
+        pass
+
+    @abstractmethod
+    def encode_formats(self, source_path: str, output_dir: str, stem: str, formats: List[str], quality: int = 82) -> dict:
+        pass
+
+    @abstractmethod
+    def transform_image(
+        self,
+        source_path: str,
+        dest_path: str,
+        width: Optional[int],
+        height: Optional[int],
+        fit: str = "contain",
+        quality: int = 82,
+        fmt: str = "JPEG",
+        watermark=None,
+    ):
+        pass
+
+class PillowEngine(ImageEngine):
+    name = "pillow"
+
+    def generate_variants(self, *args, **kwargs) -> List[dict]:
+        return imaging.generate_variants(*args, **kwargs)
+
+    def encode_formats(self, *args, **kwargs) -> dict:
+        return imaging.encode_formats(*args, **kwargs)
+
+    def transform_image(self, *args, **kwargs):
+        return imaging.transform_image(*args, **kwargs)
+
+# libvips savers by the format names used throughout (as in imaging.EXTENSIONS)
+_VIPS_SAVERS = {"JPEG": "jpegsave", "PNG": "pngsave", "WEBP": "webpsave", "AVIF": "heifsave"}
+
+@contextmanager
+def _vips_errors():
+    """Raise libvips failures as the errors Pillow raises, which callers already handle"""
+    try:
+        yield
+    except pyvips.Error as e:
+        message = str(e)
+        if "not a known file format" in message:
+            raise UnidentifiedImageError(message)
+        if "out of memory" in message:
+            raise MemoryError(message)
+        raise
+
+class VipsEngine(ImageEngine):
+    """Derivatives made with libvips, falling back to Pillow for animations and watermarks.
+
+    Every output is decoded afresh from the file with ``thumbnail``, which
+    picks the cheapest decode for the target size and applies the EXIF
+    orientation, instead of holding a full-size decode in memory and
+    resizing copies of it.
+    """
+
+    name = "vips"
+
+    def __init__(self):
+        # The operation cache would keep decoded images alive between jobs
+        pyvips.cache_set_max(0)
+        self._pillow = PillowEngine()
+
+    @staticmethod
+    def _is_animated(image) -> bool:
+        return image.get_typeof("n-pages") != 0 and image.get("n-pages") > 1
+
+    @staticmethod
+    def _orientation(image) -> int:
+        return image.get("orientation") if image.get_typeof("orientation") != 0 else 1
+
+    @staticmethod
+    def _to_srgb(image):
+        # CMYK, 16-bit and other colourspaces, as Pillow's convert("RGB") does
+        if image.interpretation not in ("srgb", "b-w"):
+            image = image.colourspace("srgb")
+        return image
+
+    def _save(self, image, path: str, fmt: str, quality: int):
+        """Save like imaging._save_variant: stripped of metadata except the ICC profile"""
+        image = self._to_srgb(image)
+        if fmt == "JPEG" and image.hasalpha():
+            image = image.flatten(background=[255] * (image.bands - 1))
+
+        options = {}
+        keep = getattr(getattr(pyvips, "enums", None), "ForeignKeep", None)
+        if keep is not None and pyvips.at_least_libvips(8, 15):
+            options["keep"] = keep.ICC
+        else:
+            # Older libvips can only strip everything; bake the profile into sRGB first
+            if image.get_typeof("icc-profile-data") != 0:
+                image = image.icc_transform("srgb")
+            options["strip"] = True
+
+        if fmt == "JPEG":
+            options.update(Q=quality, optimize_coding=True, interlace=True)
+        elif fmt == "WEBP":
+            options.update(Q=quality, effort=4)
+        elif fmt == "AVIF":
+            options.update(Q=quality, compression="av1")
+        else:
+            options.update(compression=9)
+        getattr(image, _VIPS_SAVERS[fmt])(path, **options)
+
+    def _encode_alternates(self, load, path_prefix: str, formats: List[str], quality: int, max_size: int) -> dict:
+        """Like imaging._encode_alternates, reloading the source for each format so it can stream"""
+        encodings = {}
+        for fmt in formats:
+            path = path_prefix + imaging.EXTENSIONS[fmt.upper()]
+            try:
+                self._save(load(), path, fmt.upper(), quality)
+            except pyvips.Error as e:
+                # e.g. libvips built without an AVIF encoder
+                logger.warning("libvips could not encode %s: %s", path, e)
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            size = os.path.getsize(path)
+            if size >= max_size:
+                os.remove(path)
+                continue
+            encodings[fmt] = {"path": path, "size": size}
+        return encodings
+
+    def generate_variants(
+        self,
+        source_path: str,
+        output_dir: str,
+        stem: str,
+        widths: List[int],
+        quality: int = 82,
+        formats: Optional[List[str]] = None,
+    ) -> List[dict]:
+        with _vips_errors():
+            header = pyvips.Image.new_from_file(source_path)
+            if self._is_animated(header):
+                return self._pillow.generate_variants(source_path, output_dir, stem, widths, quality, formats)
+            os.makedirs(output_dir, exist_ok=True)
+
+            targets = sorted(w for w in widths if w < max(header.width, header.height))
+            fmt = "PNG" if header.hasalpha() else "JPEG"
+            ext = imaging.EXTENSIONS[fmt]
+
+            variants = []
+            for width in targets:
+                def load(width=width):
+                    return pyvips.Image.thumbnail(source_path, width, height=width, size="down")
+
+                resized = load()
+                path = os.path.join(output_dir, f"{stem}_{width}{ext}")
+                self._save(resized, path, fmt, quality)
+                size = os.path.getsize(path)
+                variants.append({
+                    "width": resized.width,
+                    "height": resized.height,
+                    "path": path,
+                    "size": size,
+                    "formats": self._encode_alternates(
+                        load, os.path.join(output_dir, f"{stem}_{width}"), formats or [], quality, size
+                    ),
+                })
+        return variants
+
+    def encode_formats(self, source_path: str, output_dir: str, stem: str, formats: List[str], quality: int = 82) -> dict:
+        if not formats:
+            return {}
+        with _vips_errors():
+            header = pyvips.Image.new_from_file(source_path)
+            if self._is_animated(header):
+                return self._pillow.encode_formats(source_path, output_dir, stem, formats, quality)
+            os.makedirs(output_dir, exist_ok=True)
+
+            # Rotating or flipping needs the whole image; upright ones stream top to bottom
+            access = "sequential" if self._orientation(header) == 1 else "random"
+
+            def load():
+                return pyvips.Image.new_from_file(source_path, access=access).autorot()
+
+            return self._encode_alternates(
+                load, os.path.join(output_dir, stem), formats, quality, os.path.getsize(source_path)
+            )
+
+    def transform_image(
+        self,
+        source_path: str,
+        dest_path: str,
+        width: Optional[int],
+        height: Optional[int],
+        fit: str = "contain",
+        quality: int = 82,
+        fmt: str = "JPEG",
+        watermark=None,
+    ):
+        with _vips_errors():
+            header = pyvips.Image.new_from_file(source_path)
+            if watermark or self._is_animated(header):
+                return self._pillow.transform_image(
+                    source_path, dest_path, width, height, fit, quality, fmt, watermark
+                )
+            # EXIF orientations 5-8 are rotated by 90 degrees
+            rotated = self._orientation(header) in (5, 6, 7, 8)
+            src_width, src_height = (header.height, header.width) if rotated else (header.width, header.height)
+            width, height = imaging.transform_box(src_width, src_height, width, height, fit)
+
+            if fit == "cover":
+                result = pyvips.Image.thumbnail(source_path, width, height=height, size="down", crop="centre")
+            elif fit == "fill":
+                result = pyvips.Image.thumbnail(source_path, width, height=height, size="force")
+            else:
+                result = pyvips.Image.thumbnail(source_path, width, height=height, size="down")
+            self._save(result, dest_path, fmt, quality)
+
+def create_engine(name: str) -> ImageEngine:
+    """Create the engine called ``name`` (see ENGINE_NAMES), falling back to Pillow if libvips is missing"""
+    name = name.lower()
+    if name not in ENGINE_NAMES:
+        raise ValueError(f"IMAGE_ENGINE must be one of {', '.join(ENGINE_NAMES)}, not '{name}'")
+    if name in ("auto", "vips") and pyvips is not None:
+        return VipsEngine()
+    if name == "vips":
+        logger.warning("IMAGE_ENGINE is vips but pyvips or libvips is not installed; using Pillow")
+    return PillowEngine()
+
+_engine: Optional[ImageEngine] = None
+
+def get_engine() -> ImageEngine:
+    """Get the process-wide engine chosen by IMAGE_ENGINE"""
+    global _engine
+    if _engine is None:
+        _engine = create_engine(settings.IMAGE_ENGINE)
+    return _engine
+
+def generate_variants(*args, **kwargs) -> List[dict]:
+    """imaging.generate_variants on the configured engine"""
+    return get_engine().generate_variants(*args, **kwargs)
+
+def encode_formats(*args, **kwargs) -> dict:
+    """imaging.encode_formats on the configured engine"""
+    return get_engine().encode_formats(*args, **kwargs)
+
+def transform_image(*args, **kwargs):
+    """imaging.transform_image on the configured engine"""
+    return get_engine().transform_image(*args, **kwargs)
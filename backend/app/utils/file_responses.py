@@ -0,0 +1,201 @@
+import os
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from mimetypes import guess_type
+from typing import Mapping, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import RedirectResponse, Response
+from starlette.types import Receive, Scope, Send
+
+from app.core.config import settings
+from app.utils.storage import get_storage
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+def parse_range(value: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single ``bytes=`` range into inclusive (start, end) offsets.
+
+    Returns None for headers the response should ignore (other units or
+    several ranges, which are served as a full 200) and raises
+    RangeNotSatisfiable for ranges outside the file.
+    """
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            # bytes=-500: the last 500 bytes
+            suffix = int(last)
+            if suffix <= 0 or size == 0:
+                raise RangeNotSatisfiable()
+            return max(size - suffix, 0), size - 1
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+class StoredFileResponse(Response):
+    """Serve a stored file with conditional and byte-range request support.
+
+    Stored files are content-addressed and never rewritten, so the strong
+    ETag is simply the file name - identical on every server, unlike
+    mtime-based ETags. ``If-None-Match``/``If-Modified-Since`` get a 304,
+    and a single ``Range`` (honouring ``If-Range``) gets a 206 so large
+    downloads can resume. The body is handed to the server with the ASGI
+    zero-copy or path-send extensions when it offers them, and read in
+    chunks otherwise.
+    """
+
+    chunk_size = 256 * 1024
+
+    def __init__(
+        self,
+        path: str,
+        stat_result: os.stat_result,
+        media_type: Optional[str] = None,
+        headers: Optional[Mapping[str, str]] = None,
+    ):
+        self.path = path
+        self.stat_result = stat_result
+        self.status_code = status.HTTP_200_OK
+        self.media_type = media_type or guess_type(path)[0] or "application/octet-stream"
+        self.background = None
+        self.init_headers(headers)
+        self.etag = f'"{os.path.basename(path)}"'
+        self.last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+        self.headers["etag"] = self.etag
+        self.headers["last-modified"] = self.last_modified
+        self.headers["accept-ranges"] = "bytes"
+
+    def _not_modified(self, request_headers: Headers) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return "*" in tags or self.etag in tags
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return int(self.stat_result.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _range_applies(self, request_headers: Headers) -> bool:
+        # A resumed download only continues if the file is still the one it started on
+        if_range = request_headers.get("if-range")
+        return if_range is None or if_range.strip() in (self.etag, self.last_modified)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        request_headers = Headers(scope=scope)
+        size = self.stat_result.st_size
+        start, end = 0, size - 1
+
+        if self._not_modified(request_headers):
+            self.status_code = status.HTTP_304_NOT_MODIFIED
+            del self.headers["content-type"]
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        range_header = request_headers.get("range")
+        if range_header and self._range_applies(request_headers):
+            try:
+                byte_range = parse_range(range_header, size)
+            except RangeNotSatisfiable:
+                self.status_code = status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+                self.headers["content-range"] = f"bytes */{size}"
+                self.headers["content-length"] = "0"
+                await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+                await send({"type": "http.response.body", "body": b""})
+                return
+            if byte_range:
+                start, end = byte_range
+                self.status_code = status.HTTP_206_PARTIAL_CONTENT
+                self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+
+        length = end - start + 1
+        self.headers["content-length"] = str(length)
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope.get("method", "GET").upper() == "HEAD" or length == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        extensions = scope.get("extensions") or {}
+        if "http.response.zerocopysend" in extensions:
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file.fileno(),
+                    "offset": start,
+                    "count": length,
+                })
+        elif "http.response.pathsend" in extensions and length == size:
+            await send({"type": "http.response.pathsend", "path": os.path.abspath(self.path)})
+        else:
+            async with await anyio.open_file(self.path, mode="rb") as file:
+                await file.seek(start)
+                remaining = length
+                while remaining > 0:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+                if remaining > 0:
+                    # The file shrank under us; end the response rather than hang
+                    await send({"type": "http.response.body", "body": b""})
+
+async def stored_file_response(
+    path: str,
+    media_type: Optional[str] = None,
+    headers: Optional[Mapping[str, str]] = None,
+) -> StoredFileResponse:
+    """Build a StoredFileResponse for a local file, raising 404 if it is missing"""
+    try:
+        stat_result = await run_in_threadpool(os.stat, path)
+    except OSError:
+        stat_result = None
+    if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found"
+        )
+    return StoredFileResponse(path, stat_result, media_type=media_type, headers=headers)
+
+async def deliver_stored_file(
+    key: str,
+    media_type: Optional[str] = None,
+    headers: Optional[Mapping[str, str]] = None,
+) -> Response:
+    """Send a stored file to a client that has already been authorised to see it.
+
+    Behind nginx (ACCEL_REDIRECT_PREFIX set) the response is just an
+    ``X-Accel-Redirect`` header pointing at an internal location, and nginx
+    streams the file itself with sendfile, ranges and conditional requests.
+    Without nginx the file is served directly; files in remote storage are
+    handed out as short-lived presigned URLs.
+    """
+    storage = get_storage()
+    local_path = storage.local_path(key)
+    if local_path is None:
+        return RedirectResponse(
+            storage.url(key, settings.PRIVATE_URL_EXPIRE_SECONDS),
+            status_code=status.HTTP_307_TEMPORARY_REDIRECT,
+            headers={**(headers or {}), "Cache-Control": "private, no-store"},
+        )
+    if settings.ACCEL_REDIRECT_PREFIX:
+        return Response(
+            media_type=media_type or guess_type(key)[0],
+            headers={**(headers or {}), "X-Accel-Redirect": settings.ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + quote(key)},
+        )
+    return await stored_file_response(local_path, media_type, headers)
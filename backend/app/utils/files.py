@@ -1,48 +1,203 @@
 import os
+import shutil
+import logging
+import hashlib
+import tempfile
 import aiofiles
-from typing import Optional
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, NamedTuple, Optional
 from fastapi import HTTPException, status, UploadFile
+from fastapi.concurrency import run_in_threadpool
 
 from app.core.config import settings
+from app.utils.image_headers import FORMAT_EXTENSIONS, read_image_header
+from app.utils.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+# Size of the pieces uploads are copied to storage in
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+
+# Bytes of an upload gathered before its header is checked, when it arrives in smaller pieces
+HEADER_CHECK_BYTES = 256 * 1024
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+class StoredFile(NamedTuple):
+    """A file saved into the upload directory under its content hash"""
+    file_path: str  # storage key, also the path stored on the record, e.g. static/images/<hash>.jpg
+    filename: str
+    size: int
+    content_hash: str  # hex SHA-256 of the file's bytes
+
+def content_addressed_filename(content_hash: str, file_extension: str) -> str:
+    return f"{content_hash}{file_extension.lower()}"
+
+def upload_key(filename: str) -> str:
+    """Get the storage key of a file in the upload directory"""
+    return get_relative_path(os.path.join(settings.UPLOAD_DIR, filename))
+
+def variant_key(filename: str) -> str:
+    """Get the storage key of a derivative in the variant directory"""
+    return get_relative_path(os.path.join(settings.VARIANT_DIR, filename))
+
+async def save_upload_file(file: UploadFile, file_extension: str) -> StoredFile:
+    """Stream an uploaded file into storage, named by its content hash.
+
+    The upload is copied in fixed-size chunks to a temporary location in
+    the storage backend, hashed on the way, and published under its
+    content-addressed key once complete, so memory use stays flat and
+    readers never see a partial file. Identical uploads end up as a single
+    file. The size limit is checked during the copy since ``file.size`` is
+    not always known. By then the multipart parser has already received
+    (and spooled) the whole request body, so this keeps oversized files
+    out of storage but does not stop them being sent; resumable upload
+    sessions refuse them by their declared size before any bytes arrive.
+    """
+    storage = get_storage()
+    writer = await run_in_threadpool(storage.writer, upload_key(""))
 
-async def save_upload_file(file: UploadFile, filename: str) -> str:
-    """Save uploaded file to the upload directory"""
-    # Ensure upload directory exists
-    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
-    
-    file_path = os.path.join(settings.UPLOAD_DIR, filename)
-    
     try:
-        async with aiofiles.open(file_path, 'wb') as f:
-            content = await file.read()
-            await f.write(content)
+        size = 0
+        digest = hashlib.sha256()
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if size == 0:
+                # Reject renamed images and decompression bombs before anything is stored or decoded
+                check_image_header(chunk, file_extension)
+            size += len(chunk)
+            if size > settings.MAX_FILE_SIZE:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"File size exceeds maximum allowed size of {settings.MAX_FILE_SIZE} bytes"
+                )
+            digest.update(chunk)
+            await run_in_threadpool(writer.write, chunk)
+        content_hash = digest.hexdigest()
+        filename = content_addressed_filename(content_hash, file_extension)
+        key = upload_key(filename)
+        # An existing file with that name already holds the same bytes
+        if await run_in_threadpool(storage.exists, key):
+            await run_in_threadpool(writer.abort)
+        else:
+            await run_in_threadpool(writer.commit, key)
+    except HTTPException:
+        await run_in_threadpool(writer.abort)
+        raise
     except Exception as e:
+        await run_in_threadpool(writer.abort)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error saving file: {str(e)}"
         )
     
-    # Return path without 'app/' prefix for serving
-    # Remove 'app/' from the beginning of the path if it exists
-    relative_path = file_path
+    return StoredFile(key, filename, size, content_hash)
+
+async def hash_file(path: str) -> str:
+    """Get the hex SHA-256 of a file on disk without loading it into memory"""
+    digest = hashlib.sha256()
+    async with aiofiles.open(path, 'rb') as f:
+        while True:
+            chunk = await f.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_relative_path(file_path: str) -> str:
+    """Get the path a stored file is served under (without the 'app/' prefix)"""
     if file_path.startswith('app/'):
-        relative_path = file_path[4:]  # Remove 'app/' prefix
-    
+        return file_path[4:]  # Remove 'app/' prefix
+    return file_path
+
+def get_storage_path(relative_path: str) -> str:
+    """Get the on-disk path of a file from the path stored on its record (local storage only)"""
+    if relative_path.startswith('static/'):
+        return os.path.join('app', relative_path)
     return relative_path
 
-def delete_file(file_path: str) -> bool:
-    """Delete a file from the filesystem"""
+def delete_file(key: str) -> bool:
+    """Delete a stored file"""
     try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            return True
-        return False
+        return get_storage().delete(key)
     except Exception as e:
         raise Exception(f"Error deleting file: {str(e)}")
 
+async def move_into_upload_dir(source_path: str, file_extension: str) -> StoredFile:
+    """Move a file already on local disk into the upload directory under its content hash"""
+    storage = get_storage()
+
+    async with aiofiles.open(source_path, 'rb') as f:
+        check_image_header(await f.read(UPLOAD_CHUNK_SIZE), file_extension)
+
+    try:
+        content_hash = await hash_file(source_path)
+        size = os.path.getsize(source_path)
+        filename = content_addressed_filename(content_hash, file_extension)
+        key = upload_key(filename)
+        if await run_in_threadpool(storage.exists, key):
+            _remove_quietly(source_path)
+        else:
+            await run_in_threadpool(storage.put_file, source_path, key)
+    except Exception:
+        logger.exception("Error moving %s into the upload directory", source_path)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error saving file"
+        )
+
+    return StoredFile(key, filename, size, content_hash)
+
+@asynccontextmanager
+async def local_copy(key: str) -> AsyncIterator[str]:
+    """Get a local path to a stored file for the duration of the block.
+
+    Files kept on local disk are used in place; others are downloaded to a
+    temporary file that is removed afterwards.
+    """
+    storage = get_storage()
+    path = storage.local_path(key)
+    if path:
+        yield path
+        return
+    path = await run_in_threadpool(storage.download, key)
+    try:
+        yield path
+    finally:
+        _remove_quietly(path)
+
+@asynccontextmanager
+async def derivative_output_dir() -> AsyncIterator[str]:
+    """Get a local directory to write derivatives into before store_derivative publishes them"""
+    storage = get_storage()
+    if storage.is_local:
+        # Written straight to their final location
+        directory = storage.local_path(variant_key(""))
+        os.makedirs(directory, exist_ok=True)
+        yield directory
+        return
+    directory = tempfile.mkdtemp(prefix="derivatives-")
+    try:
+        yield directory
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+async def store_derivative(path: str) -> str:
+    """Move a derivative written under derivative_output_dir into storage, returning its key"""
+    key = variant_key(os.path.basename(path))
+    await run_in_threadpool(get_storage().put_file, path, key)
+    return key
+
 def validate_file(file: UploadFile) -> bool:
     """Validate uploaded file"""
-    # Check file size
+    # Reject early when the size is declared; save_upload_file enforces the
+    # limit on the actual bytes either way
     if file.size and file.size > settings.MAX_FILE_SIZE:
         raise HTTPException(
             status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
@@ -51,23 +206,48 @@ def validate_file(file: UploadFile) -> bool:
     
     # Check file extension
     if file.filename:
-        file_extension = os.path.splitext(file.filename)[1].lower()
-        if file_extension not in settings.ALLOWED_EXTENSIONS:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"File type not allowed. Allowed types: {', '.join(settings.ALLOWED_EXTENSIONS)}"
-            )
+        validate_filename(file.filename)
     
     return True
 
-def get_file_info(file_path: str) -> Optional[dict]:
+def validate_filename(filename: str) -> bool:
+    """Validate an uploaded file's extension"""
+    file_extension = os.path.splitext(filename)[1].lower()
+    if file_extension not in settings.ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"File type not allowed. Allowed types: {', '.join(settings.ALLOWED_EXTENSIONS)}"
+        )
+    return True
+
+def check_image_header(head: bytes, file_extension: str):
+    """Check the first bytes of an upload are an image of the type its extension names, small enough to decode.
+
+    The format is sniffed from the magic bytes and the pixel size read from
+    the header without decoding, so renamed files and decompression bombs
+    (small files declaring huge dimensions) are rejected before they are
+    stored or reach an image decoder. Images whose size is not within
+    ``head`` are checked again once stored.
+    """
+    extension = file_extension.lower()
+    header = read_image_header(head)
+    expected = [image_format for image_format, extensions in FORMAT_EXTENSIONS.items() if extension in extensions]
+    if expected and (header is None or header.format not in expected):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"File content is not a valid {extension} image"
+        )
+    if header and header.width is not None:
+        check_pixel_count(header.width, header.height)
+
+def check_pixel_count(width: int, height: int):
+    """Reject images whose pixel count exceeds MAX_IMAGE_PIXELS"""
+    if width <= 0 or height <= 0 or width * height > settings.MAX_IMAGE_PIXELS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Image dimensions {width}x{height} exceed the maximum of {settings.MAX_IMAGE_PIXELS} pixels"
+        )
+
+def get_file_info(key: str) -> Optional[dict]:
     """Get file information"""
-    if not os.path.exists(file_path):
-        return None
-    
-    stat = os.stat(file_path)
-    return {
-        "size": stat.st_size,
-        "created": stat.st_ctime,
-        "modified": stat.st_mtime
-    }
+    return get_storage().stat(key)
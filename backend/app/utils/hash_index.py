@@ -0,0 +1,174 @@
+import threading
+from itertools import combinations
+from math import comb
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+def hamming_distance(a: int, b: int) -> int:
+    """Count the bits that differ between two hashes"""
+    return (a ^ b).bit_count()
+
+class MultiIndexHashTable:
+    """Index of 64-bit hashes for Hamming-radius searches (multi-index hashing).
+
+    Each hash is split into four 16-bit chunks and filed under every chunk
+    in a separate table. Two hashes within r bits of each other must agree
+    to within r // 4 bits on at least one chunk (pigeonhole), so a search
+    only has to look at the handful of hashes filed under chunks near the
+    query's, instead of comparing against the whole library.
+    """
+
+    CHUNKS = 4
+    CHUNK_BITS = 16
+
+    def __init__(self):
+        self._items: Dict[int, Set[int]] = {}
+        self._tables: List[Dict[int, Set[int]]] = [{} for _ in range(self.CHUNKS)]
+
+    def __len__(self) -> int:
+        return sum(len(items) for items in self._items.values())
+
+    def _chunks(self, value: int) -> List[int]:
+        mask = (1 << self.CHUNK_BITS) - 1
+        return [(value >> (i * self.CHUNK_BITS)) & mask for i in range(self.CHUNKS)]
+
+    def add(self, value: int, item: int):
+        items = self._items.get(value)
+        if items is None:
+            items = self._items[value] = set()
+            for table, chunk in zip(self._tables, self._chunks(value)):
+                table.setdefault(chunk, set()).add(value)
+        items.add(item)
+
+    def remove(self, value: int, item: int):
+        items = self._items.get(value)
+        if items is None:
+            return
+        items.discard(item)
+        if not items:
+            del self._items[value]
+            for table, chunk in zip(self._tables, self._chunks(value)):
+                table[chunk].discard(value)
+                if not table[chunk]:
+                    del table[chunk]
+
+    def _nearby_chunks(self, table: Dict[int, Set[int]], chunk: int, radius: int) -> Iterable[int]:
+        if radius == 0:
+            return [chunk] if chunk in table else []
+        neighbours = sum(comb(self.CHUNK_BITS, k) for k in range(radius + 1))
+        if neighbours >= len(table):
+            # Cheaper to check every occupied bucket than to enumerate neighbours
+            return [key for key in table if hamming_distance(key, chunk) <= radius]
+        keys = []
+        for k in range(radius + 1):
+            for bits in combinations(range(self.CHUNK_BITS), k):
+                key = chunk
+                for bit in bits:
+                    key ^= 1 << bit
+                if key in table:
+                    keys.append(key)
+        return keys
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, int]]:
+        """Find items whose hash is within max_distance bits, as (distance, item) pairs, closest first"""
+        radius = max_distance // self.CHUNKS
+        candidates = set()
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            for key in self._nearby_chunks(table, chunk, radius):
+                candidates.update(table[key])
+
+        results = []
+        for candidate in candidates:
+            distance = hamming_distance(value, candidate)
+            if distance <= max_distance:
+                results.extend((distance, item) for item in self._items[candidate])
+        results.sort()
+        return results
+
+class NearDuplicateIndex:
+    """In-memory index of image perceptual hashes for near-duplicate lookups.
+
+    The index is built from the database on first use and kept up to date
+    as images are added and removed in this process. ``signature`` records
+    the (count, max id) of the rows it was built from, so callers can
+    detect changes made by other worker processes and rebuild.
+    """
+
+    def __init__(self):
+        self.table = MultiIndexHashTable()
+        self.hashes: Dict[int, int] = {}
+        self.signature: Optional[Tuple[int, Optional[int]]] = None
+        self.lock = threading.Lock()
+
+    def rebuild(self, rows: Iterable[Tuple[int, str]], signature: Tuple[int, Optional[int]]):
+        table = MultiIndexHashTable()
+        hashes = {}
+        for image_id, hex_hash in rows:
+            value = int(hex_hash, 16)
+            table.add(value, image_id)
+            hashes[image_id] = value
+        with self.lock:
+            self.table, self.hashes, self.signature = table, hashes, signature
+
+    def add(self, image_id: int, hex_hash: str):
+        value = int(hex_hash, 16)
+        with self.lock:
+            self.table.add(value, image_id)
+            self.hashes[image_id] = value
+            if self.signature is not None:
+                count, max_id = self.signature
+                self.signature = (count + 1, max(max_id or 0, image_id))
+
+    def remove(self, image_id: int):
+        with self.lock:
+            value = self.hashes.pop(image_id, None)
+            if value is None:
+                return
+            self.table.remove(value, image_id)
+            if self.signature is not None:
+                count, max_id = self.signature
+                self.signature = (count - 1, max_id)
+
+    def similar(self, hex_hash: str, max_distance: int, exclude: Optional[int] = None) -> List[Tuple[int, int]]:
+        """Find images within max_distance bits of a hash, as (distance, image id) pairs"""
+        with self.lock:
+            matches = self.table.search(int(hex_hash, 16), max_distance)
+        return [(distance, image_id) for distance, image_id in matches if image_id != exclude]
+
+    def clusters(self, max_distance: int) -> List[List[int]]:
+        """Group images into clusters of near-duplicates, largest first.
+
+        Images are linked when their hashes are within max_distance bits;
+        clusters are the connected groups of two or more images.
+        """
+        parent: Dict[int, int] = {}
+
+        def find(item: int) -> int:
+            while parent.setdefault(item, item) != item:
+                parent[item] = parent[parent[item]]
+                item = parent[item]
+            return item
+
+        with self.lock:
+            # Images sharing a hash give identical searches, so search each hash once
+            for value in set(self.hashes.values()):
+                matches = self.table.search(value, max_distance)
+                if len(matches) < 2:
+                    continue
+                root = find(matches[0][1])
+                for _, other in matches[1:]:
+                    other_root = find(other)
+                    if other_root != root:
+                        parent[other_root] = root
+
+        groups: Dict[int, List[int]] = {}
+        for item in parent:
+            groups.setdefault(find(item), []).append(item)
+        clusters = [sorted(group) for group in groups.values() if len(group) > 1]
+        clusters.sort(key=lambda group: (-len(group), group[0]))
+        return clusters
+
+_index = NearDuplicateIndex()
+
+def get_near_duplicate_index() -> NearDuplicateIndex:
+    """Get the process-wide perceptual hash index"""
+    return _index
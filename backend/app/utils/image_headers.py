@@ -0,0 +1,94 @@
+import struct
+from typing import NamedTuple, Optional, Tuple
+
+# Extensions each sniffed format may be uploaded under
+FORMAT_EXTENSIONS = {
+    "jpeg": (".jpg", ".jpeg"),
+    "png": (".png",),
+    "gif": (".gif",),
+    "webp": (".webp",),
+}
+
+# JPEG start-of-frame markers (the ones holding the frame size): C0-CF except DHT, JPG and DAC
+_JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+class ImageHeader(NamedTuple):
+    format: str
+    width: Optional[int] = None  # None when the size is not within the bytes given
+    height: Optional[int] = None
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """Identify an image format from its magic bytes (the first 12 are enough)"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+def _jpeg_size(head: bytes) -> Optional[Tuple[int, int]]:
+    offset = 2
+    while offset + 4 <= len(head):
+        if head[offset] != 0xFF:
+            return None
+        marker = head[offset + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            offset += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            # Markers without a length
+            offset += 2
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            if offset + 9 > len(head):
+                return None
+            height, width = struct.unpack(">HH", head[offset + 5:offset + 9])
+            return width, height
+        (length,) = struct.unpack(">H", head[offset + 2:offset + 4])
+        offset += 2 + length
+    return None
+
+def _png_size(head: bytes) -> Optional[Tuple[int, int]]:
+    if len(head) < 24 or head[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", head[16:24])
+
+def _gif_size(head: bytes) -> Optional[Tuple[int, int]]:
+    if len(head) < 10:
+        return None
+    return struct.unpack("<HH", head[6:10])
+
+def _webp_size(head: bytes) -> Optional[Tuple[int, int]]:
+    chunk = head[12:16]
+    if chunk == b"VP8 " and len(head) >= 30:
+        width, height = struct.unpack("<HH", head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and len(head) >= 25:
+        b0, b1, b2, b3 = head[21:25]
+        return 1 + (b0 | (b1 & 0x3F) << 8), 1 + (b1 >> 6 | b2 << 2 | (b3 & 0x0F) << 10)
+    if chunk == b"VP8X" and len(head) >= 30:
+        width = int.from_bytes(head[24:27], "little") + 1
+        height = int.from_bytes(head[27:30], "little") + 1
+        return width, height
+    return None
+
+_SIZE_READERS = {"jpeg": _jpeg_size, "png": _png_size, "gif": _gif_size, "webp": _webp_size}
+
+def read_image_header(head: bytes) -> Optional[ImageHeader]:
+    """Get the format and pixel size of an image from its first bytes, without decoding anything.
+
+    Returns None if the bytes are not a supported image; the size is left
+    out if it lies beyond the bytes given (e.g. a JPEG with a very large
+    metadata block before its frame header).
+    """
+    image_format = sniff_format(head)
+    if image_format is None:
+        return None
+    size = _SIZE_READERS[image_format](head)
+    if size is None:
+        return ImageHeader(image_format)
+    return ImageHeader(image_format, *size)
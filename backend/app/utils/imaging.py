@@ -0,0 +1,701 @@
+"""
+Image processing helpers.
+
+Everything in this module is synchronous and CPU-bound; call it through
+app.utils.processing.run_in_process rather than from the event loop.
+
+Originals are stored byte-for-byte as uploaded. Everything derived from
+them here is rotated upright according to the EXIF orientation and saved
+without EXIF/XMP metadata, so clients never need to rotate what we serve.
+"""
+
+import io
+import os
+import base64
+import hashlib
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image as PILImage, ImageOps
+
+from app.core.config import settings
+from app.utils.colors import srgb_to_lab
+
+try:
+    # Registers an AVIF encoder on Pillow versions without built-in support
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+# Pillow warns about images over this many pixels and refuses to open ones
+# over twice as many; uploads are already held to it from their header
+PILImage.MAX_IMAGE_PIXELS = settings.MAX_IMAGE_PIXELS
+
+EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp", "AVIF": ".avif"}
+
+# Formats animations are re-encoded in; animated AVIF is too unevenly supported by encoders and browsers
+ANIMATED_FORMATS = ("webp",)
+
+# Long edge of the thumbnail smart crops are chosen on
+SALIENCY_SIZE = 160
+
+# EXIF tags (IFD0 and Exif sub-IFD) extracted into image columns
+EXIF_IFD = 0x8769
+TAG_ORIENTATION = 0x0112
+TAG_DATETIME = 0x0132
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_EXPOSURE_TIME = 0x829A
+TAG_F_NUMBER = 0x829D
+TAG_ISO = 0x8827
+TAG_FOCAL_LENGTH = 0x920A
+TAG_LENS_MODEL = 0xA434
+
+def supported_formats(formats: List[str]) -> List[str]:
+    """Filter format names (e.g. "webp", "avif") down to those Pillow can encode"""
+    PILImage.init()
+    return [fmt for fmt in formats if fmt.upper() in PILImage.SAVE]
+
+def _has_alpha(img: PILImage.Image) -> bool:
+    return img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+
+# Metadata kept on derivatives: colours render wrongly without the ICC
+# profile, and palette images need their transparency. Everything else
+# (EXIF, XMP, embedded thumbnails, comments) is dropped.
+KEPT_METADATA = ("icc_profile", "transparency")
+
+def _save_variant(img: PILImage.Image, path: str, fmt: str, quality: int):
+    img.info = {key: value for key, value in img.info.items() if key in KEPT_METADATA}
+    params = {}
+    if img.info.get("icc_profile"):
+        params["icc_profile"] = img.info["icc_profile"]
+
+    if fmt == "JPEG":
+        img.convert("RGB").save(path, "JPEG", quality=quality, optimize=True, progressive=True, **params)
+    elif fmt == "WEBP":
+        img.save(path, "WEBP", quality=quality, method=4, **params)
+    elif fmt == "AVIF":
+        img.save(path, "AVIF", quality=quality, **params)
+    else:
+        img.save(path, fmt, optimize=True, **params)
+
+def generate_variants(
+    source_path: str,
+    output_dir: str,
+    stem: str,
+    widths: List[int],
+    quality: int = 82,
+    formats: Optional[List[str]] = None,
+) -> List[dict]:
+    """Generate resized copies of an image, one per requested long-edge size.
+
+    Sizes at or above the original's long edge are skipped, so small uploads
+    produce fewer (or no) variants. Each variant is also encoded in the
+    given modern ``formats`` where that turns out smaller. Returns a list of
+    dicts with the variant's width, height, file path, size and alternate
+    encodings, smallest first.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    with PILImage.open(source_path) as img:
+        long_edge = max(img.size)
+        targets = sorted(w for w in widths if w < long_edge)
+        if not targets:
+            return []
+
+        # Let the JPEG decoder downscale by a power of two while decoding,
+        # which is far cheaper than decoding at full size and resizing
+        scale = targets[-1] / long_edge
+        img.draft("RGB", (int(img.width * scale) + 1, int(img.height * scale) + 1))
+        current = ImageOps.exif_transpose(img)
+
+        fmt = "PNG" if _has_alpha(current) else "JPEG"
+        ext = ".png" if fmt == "PNG" else ".jpg"
+        if current.mode not in ("RGB", "RGBA", "L", "LA"):
+            current = current.convert("RGBA" if fmt == "PNG" else "RGB")
+
+        variants = []
+        # Work from the largest size down, resizing each variant from the
+        # previous one instead of from the full-size original
+        for width in reversed(targets):
+            resized = current.copy()
+            resized.thumbnail((width, width), PILImage.LANCZOS)
+            path = os.path.join(output_dir, f"{stem}_{width}{ext}")
+            _save_variant(resized, path, fmt, quality)
+            size = os.path.getsize(path)
+            variants.append({
+                "width": resized.width,
+                "height": resized.height,
+                "path": path,
+                "size": size,
+                "formats": _encode_alternates(
+                    resized, os.path.join(output_dir, f"{stem}_{width}"), formats or [], quality, size
+                ),
+            })
+            current = resized
+
+    variants.reverse()
+    return variants
+
+def _encode_alternates(
+    img: PILImage.Image,
+    path_prefix: str,
+    formats: List[str],
+    quality: int,
+    max_size: int,
+) -> dict:
+    """Encode an image in each format, keeping only encodings under max_size bytes"""
+    encodings = {}
+    for fmt in formats:
+        path = path_prefix + EXTENSIONS[fmt.upper()]
+        _save_variant(img, path, fmt.upper(), quality)
+        size = os.path.getsize(path)
+        if size >= max_size:
+            os.remove(path)
+            continue
+        encodings[fmt] = {"path": path, "size": size}
+    return encodings
+
+def is_animated(img: PILImage.Image) -> bool:
+    return getattr(img, "is_animated", False)
+
+def _frame_timing(img: PILImage.Image) -> Tuple[List[int], int]:
+    """Get an animation's frame durations (ms) and loop count (0 for forever)"""
+    durations = []
+    for frame in range(img.n_frames):
+        img.seek(frame)
+        durations.append(img.info.get("duration") or 100)
+    img.seek(0)
+    # GIFs without a loop count play once
+    return durations, img.info.get("loop", 1)
+
+def _save_animation(
+    frames,
+    path: str,
+    fmt: str,
+    quality: int,
+    durations: List[int],
+    loop: int,
+    append_images: Optional[list] = None,
+):
+    """Save every frame of an animation; ``frames`` is a multi-frame image or the first of ``append_images``"""
+    params = {"save_all": True, "duration": durations, "loop": loop}
+    if append_images:
+        params["append_images"] = append_images
+    if fmt == "WEBP":
+        frames.save(path, "WEBP", quality=quality, method=4, **params)
+    else:
+        frames.save(path, fmt, optimize=True, disposal=2, **params)
+
+def encode_formats(
+    source_path: str,
+    output_dir: str,
+    stem: str,
+    formats: List[str],
+    quality: int = 82,
+) -> dict:
+    """Encode a full-size copy of an image in each of the given formats.
+
+    Encodings that are not smaller than the original file are discarded.
+    Animations (e.g. animated GIFs) are re-encoded with every frame, in
+    those of the formats that can animate. Returns a dict mapping format
+    name to the encoding's path and size.
+    """
+    if not formats:
+        return {}
+    os.makedirs(output_dir, exist_ok=True)
+
+    with PILImage.open(source_path) as img:
+        if is_animated(img):
+            return _encode_animated_alternates(img, os.path.join(output_dir, stem), formats, quality, os.path.getsize(source_path))
+        result = ImageOps.exif_transpose(img)
+        if result.mode not in ("RGB", "RGBA", "L", "LA"):
+            result = result.convert("RGBA" if _has_alpha(result) else "RGB")
+        return _encode_alternates(
+            result, os.path.join(output_dir, stem), formats, quality, os.path.getsize(source_path)
+        )
+
+def _encode_animated_alternates(
+    img: PILImage.Image,
+    path_prefix: str,
+    formats: List[str],
+    quality: int,
+    max_size: int,
+) -> dict:
+    """Re-encode an animation in each format that can animate, keeping only encodings under max_size bytes.
+
+    Named ``<stem>_anim.<ext>`` so they never reuse the name of a still
+    encoding that browsers may have cached.
+    """
+    durations, loop = _frame_timing(img)
+    encodings = {}
+    for fmt in formats:
+        if fmt not in ANIMATED_FORMATS:
+            continue
+        path = f"{path_prefix}_anim{EXTENSIONS[fmt.upper()]}"
+        _save_animation(img, path, fmt.upper(), quality, durations, loop)
+        size = os.path.getsize(path)
+        if size >= max_size:
+            os.remove(path)
+            continue
+        encodings[fmt] = {"path": path, "size": size}
+    return encodings
+
+def generate_poster(source_path: str, output_dir: str, stem: str, quality: int = 82) -> Optional[dict]:
+    """Save the first frame of an animation as a full-size still, for ``<video poster>`` and static previews.
+
+    Returns the animation's frame count, duration of one loop (ms), loop
+    count and poster file, or None if the image is not animated.
+    """
+    with PILImage.open(source_path) as img:
+        if not is_animated(img):
+            return None
+        durations, loop = _frame_timing(img)
+        poster = img.convert("RGBA" if _has_alpha(img) else "RGB")
+
+    os.makedirs(output_dir, exist_ok=True)
+    fmt = "PNG" if poster.mode == "RGBA" else "JPEG"
+    path = os.path.join(output_dir, f"{stem}_poster{EXTENSIONS[fmt]}")
+    _save_variant(poster, path, fmt, quality)
+    return {
+        "frames": len(durations),
+        "duration": sum(durations),
+        "loop": loop,
+        "poster": {"path": path, "size": os.path.getsize(path), "width": poster.width, "height": poster.height},
+    }
+
+def read_dimensions(source_path: str) -> dict:
+    """Get an image's display width, height and aspect ratio from its header.
+
+    Only the header is parsed; pixel data is never decoded. Dimensions
+    account for the EXIF orientation, i.e. they are what viewers show.
+    """
+    with PILImage.open(source_path) as img:
+        width, height = img.size
+        if img.getexif().get(TAG_ORIENTATION, 1) in (5, 6, 7, 8):
+            width, height = height, width
+    return {"width": width, "height": height, "aspect_ratio": round(width / height, 4)}
+
+def _exif_text(value) -> Optional[str]:
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", "ignore")
+    if value is None:
+        return None
+    value = str(value).strip("\x00 ").strip()
+    return value or None
+
+def _exif_float(value) -> Optional[float]:
+    try:
+        number = float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return round(number, 4) if number == number else None  # drop NaN from 0/0 rationals
+
+def _exif_datetime(value) -> Optional[datetime]:
+    text = _exif_text(value)
+    if not text:
+        return None
+    try:
+        return datetime.strptime(text[:19], "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+
+def read_exif(source_path: str) -> dict:
+    """Extract capture details from an image's EXIF metadata.
+
+    Only the metadata segment is parsed; pixel data is never decoded.
+    Missing or malformed tags come back as None.
+    """
+    with PILImage.open(source_path) as img:
+        exif = img.getexif()
+        details = exif.get_ifd(EXIF_IFD)
+
+    exposure = _exif_float(details.get(TAG_EXPOSURE_TIME))
+    if exposure is not None and 0 < exposure < 1:
+        exposure_time = f"1/{round(1 / exposure)}"
+    elif exposure is not None:
+        exposure_time = f"{exposure:g}"
+    else:
+        exposure_time = None
+
+    iso = details.get(TAG_ISO)
+    if isinstance(iso, tuple):
+        iso = iso[0] if iso else None
+
+    return {
+        "captured_at": _exif_datetime(details.get(TAG_DATETIME_ORIGINAL)) or _exif_datetime(exif.get(TAG_DATETIME)),
+        "camera_make": _exif_text(exif.get(TAG_MAKE)),
+        "camera_model": _exif_text(exif.get(TAG_MODEL)),
+        "lens_model": _exif_text(details.get(TAG_LENS_MODEL)),
+        "focal_length": _exif_float(details.get(TAG_FOCAL_LENGTH)),
+        "f_number": _exif_float(details.get(TAG_F_NUMBER)),
+        "exposure_time": exposure_time,
+        "iso": int(iso) if isinstance(iso, (int, float)) else None,
+        "orientation": exif.get(TAG_ORIENTATION, 1),
+    }
+
+def compute_dhash(source_path: str, hash_size: int = 8) -> str:
+    """Compute a difference hash of an image as a hex string.
+
+    The image is shrunk to (hash_size + 1) x hash_size greyscale pixels and
+    each bit records whether a pixel is brighter than its right neighbour,
+    so re-encodes, resizes and small edits change only a few bits. Compare
+    hashes by Hamming distance.
+    """
+    with PILImage.open(source_path) as img:
+        img.draft("L", (hash_size * 8, hash_size * 8))
+        small = ImageOps.exif_transpose(img)
+        if _has_alpha(small):
+            # Flatten onto white so transparent areas hash like the background
+            background = PILImage.new("RGB", small.size, (255, 255, 255))
+            background.paste(small.convert("RGBA"), mask=small.convert("RGBA").split()[-1])
+            small = background
+        small = small.convert("L").resize((hash_size + 1, hash_size), PILImage.LANCZOS)
+        pixels = list(small.getdata())
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
+def compute_palette(source_path: str, colors: int = 5, iterations: int = 12) -> List[tuple]:
+    """Extract an image's main colours with k-means clustering.
+
+    Pixels of a 64px copy are clustered in CIE Lab space so the groups
+    match perceived colour. Returns up to ``colors`` ("#rrggbb", weight)
+    pairs, where weight is the fraction of the image each colour covers,
+    largest first.
+    """
+    with PILImage.open(source_path) as img:
+        img.draft("RGB", (128, 128))
+        small = ImageOps.exif_transpose(img)
+        small.thumbnail((64, 64), PILImage.BILINEAR)
+        if _has_alpha(small):
+            # Only count pixels that are at least half opaque
+            rgba = np.asarray(small.convert("RGBA"), dtype=np.float64).reshape(-1, 4)
+            pixels = rgba[rgba[:, 3] >= 128, :3]
+        else:
+            pixels = np.asarray(small.convert("RGB"), dtype=np.float64).reshape(-1, 3)
+    if not len(pixels):
+        return []
+
+    lab = srgb_to_lab(pixels)
+    k = min(colors, len(np.unique(pixels, axis=0)))
+
+    # Deterministic farthest-point seeding, starting from the mean colour
+    centers = [lab.mean(axis=0)]
+    for _ in range(1, k):
+        nearest = np.min([((lab - center) ** 2).sum(axis=1) for center in centers], axis=0)
+        centers.append(lab[nearest.argmax()])
+    centers = np.array(centers)
+
+    for _ in range(iterations):
+        labels = ((lab[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.stack([np.bincount(labels, weights=lab[:, c], minlength=k) for c in range(3)], axis=1)
+        updated = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centers)
+        if np.allclose(updated, centers, atol=0.5):
+            break
+        centers = updated
+
+    # Report each cluster as the mean sRGB of its pixels
+    counts = np.bincount(labels, minlength=k)
+    rgb = np.stack([np.bincount(labels, weights=pixels[:, c], minlength=k) for c in range(3)], axis=1)
+    palette = []
+    for index in np.argsort(-counts):
+        if counts[index] == 0:
+            continue
+        red, green, blue = np.round(rgb[index] / counts[index]).astype(int)
+        palette.append((f"#{red:02x}{green:02x}{blue:02x}", round(float(counts[index] / len(pixels)), 3)))
+    return palette
+
+def compute_placeholder(source_path: str, size: int = 20, quality: int = 40) -> dict:
+    """Build an inline preview of an image for painting before it loads.
+
+    Returns a tiny JPEG (``size`` px on the long edge) as a base64 data URI,
+    for clients to stretch and blur, plus the image's dominant colour as a
+    ``#rrggbb`` string.
+    """
+    with PILImage.open(source_path) as img:
+        img.draft("RGB", (64, 64))
+        small = ImageOps.exif_transpose(img)
+        small.thumbnail((64, 64), PILImage.BILINEAR)
+
+        if _has_alpha(small):
+            # Flatten onto white so transparent areas don't come out black
+            background = PILImage.new("RGB", small.size, (255, 255, 255))
+            background.paste(small.convert("RGBA"), mask=small.convert("RGBA").split()[-1])
+            small = background
+        else:
+            small = small.convert("RGB")
+
+        # Most common colour of a small median-cut palette
+        quantized = small.quantize(colors=5, method=PILImage.Quantize.MEDIANCUT)
+        palette = quantized.getpalette()
+        _, index = max(quantized.getcolors())
+        red, green, blue = palette[index * 3:index * 3 + 3]
+
+        small.thumbnail((size, size), PILImage.BILINEAR)
+        buffer = io.BytesIO()
+        small.save(buffer, "JPEG", quality=quality, optimize=True)
+
+    return {
+        "placeholder": "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode("ascii"),
+        "dominant_color": f"#{red:02x}{green:02x}{blue:02x}",
+    }
+
+def transform_box(
+    src_width: int,
+    src_height: int,
+    width: Optional[int],
+    height: Optional[int],
+    fit: str,
+) -> Tuple[int, int]:
+    """Work out the box a transform fits an upright image into, filling in a missing side and never upscaling"""
+    if width and not height:
+        height = max(1, round(width * src_height / src_width))
+    elif height and not width:
+        width = max(1, round(height * src_width / src_height))
+    elif not width and not height:
+        width, height = src_width, src_height
+
+    if fit == "cover":
+        scale = min(1.0, src_width / width, src_height / height)
+        width, height = max(1, int(width * scale)), max(1, int(height * scale))
+    elif fit == "fill":
+        width, height = min(width, src_width), min(height, src_height)
+    return width, height
+
+def transform_image(
+    source_path: str,
+    dest_path: str,
+    width: Optional[int],
+    height: Optional[int],
+    fit: str = "contain",
+    quality: int = 82,
+    fmt: str = "JPEG",
+    watermark=None,
+):
+    """Resize or crop an image to the requested box and encode it.
+
+    ``fit`` is one of ``contain`` (fit inside the box), ``cover`` (fill the
+    box, cropping the overflow from the centre) or ``fill`` (stretch to the
+    box). Images are never upscaled; a box larger than the original is
+    shrunk to fit it while keeping the requested aspect ratio. A
+    ``watermark`` (app.utils.watermark.Watermark) is applied to results at
+    least WATERMARK_MIN_WIDTH wide.
+    """
+    with PILImage.open(source_path) as img:
+        # EXIF orientations 5-8 are rotated by 90 degrees
+        rotated = img.getexif().get(TAG_ORIENTATION, 1) in (5, 6, 7, 8)
+        src_width, src_height = (img.height, img.width) if rotated else img.size
+        width, height = transform_box(src_width, src_height, width, height, fit)
+
+        img.draft("RGB", (height, width) if rotated else (width, height))
+        result = ImageOps.exif_transpose(img)
+
+        if fmt == "JPEG" or not _has_alpha(result):
+            if result.mode not in ("RGB", "L"):
+                result = result.convert("RGB")
+        elif result.mode not in ("RGBA", "LA"):
+            result = result.convert("RGBA")
+
+        if fit == "cover":
+            result = ImageOps.fit(result, (width, height), PILImage.LANCZOS)
+        elif fit == "fill":
+            result = result.resize((width, height), PILImage.LANCZOS)
+        else:
+            result.thumbnail((width, height), PILImage.LANCZOS)
+
+        if watermark and result.width >= settings.WATERMARK_MIN_WIDTH:
+            result = apply_watermark(result, watermark)
+
+        _save_variant(result, dest_path, fmt, quality)
+
+def _watermark_logo(watermark, width: int) -> PILImage.Image:
+    """Load the logo scaled to WATERMARK_SCALE of ``width``, with WATERMARK_OPACITY applied"""
+    with PILImage.open(watermark.logo_path) as logo:
+        logo = ImageOps.exif_transpose(logo).convert("RGBA")
+    logo_width = max(1, round(width * watermark.scale))
+    logo = logo.resize((logo_width, max(1, round(logo.height * logo_width / logo.width))), PILImage.LANCZOS)
+    if watermark.opacity < 1:
+        logo.putalpha(logo.getchannel("A").point(lambda alpha: round(alpha * watermark.opacity)))
+    return logo
+
+def apply_watermark(img: PILImage.Image, watermark) -> PILImage.Image:
+    """Composite the watermark logo onto an upright image, returning a new image in the same kind of mode"""
+    logo = _watermark_logo(watermark, img.width)
+    margin = round(img.width * watermark.margin)
+    layer = PILImage.new("RGBA", img.size, (0, 0, 0, 0))
+    if watermark.position == "tile":
+        for y in range(margin, img.height, logo.height + 2 * margin):
+            for x in range(margin, img.width, logo.width + 2 * margin):
+                layer.paste(logo, (x, y))
+    else:
+        vertical, _, horizontal = watermark.position.partition("-")
+        if vertical == "center":
+            horizontal = "center"
+        x = {"left": margin, "right": img.width - logo.width - margin}.get(horizontal, (img.width - logo.width) // 2)
+        y = {"top": margin, "bottom": img.height - logo.height - margin}.get(vertical, (img.height - logo.height) // 2)
+        layer.paste(logo, (x, y))
+
+    result = PILImage.alpha_composite(img.convert("RGBA"), layer)
+    result.info = img.info
+    return result if _has_alpha(img) else result.convert("RGB")
+
+def watermark_file(source_path: str, dest_path: str, watermark):
+    """Save a watermarked copy of a stored image, encoded in the format of ``dest_path``'s extension.
+
+    Sources may be originals as well as derivatives, so they are rotated
+    upright first. Animations get the watermark on every frame.
+    """
+    formats = {extension: fmt for fmt, extension in EXTENSIONS.items()}
+    formats.update({".jpeg": "JPEG", ".gif": "GIF"})
+    fmt = formats.get(os.path.splitext(dest_path)[1].lower(), "JPEG")
+    with PILImage.open(source_path) as img:
+        if is_animated(img) and fmt in ("GIF", "WEBP"):
+            durations, loop = _frame_timing(img)
+            frames = []
+            for frame in range(img.n_frames):
+                img.seek(frame)
+                frames.append(apply_watermark(img.convert("RGBA"), watermark))
+            _save_animation(frames[0], dest_path, fmt, watermark.quality, durations, loop, frames[1:])
+            return
+        upright = ImageOps.exif_transpose(img)
+        if upright.mode not in ("RGB", "RGBA", "L", "LA"):
+            upright = upright.convert("RGBA" if _has_alpha(upright) else "RGB")
+        _save_variant(apply_watermark(upright, watermark), dest_path, fmt, watermark.quality)
+
+def parse_aspect_ratio(value: str) -> Tuple[int, int]:
+    """Parse an aspect ratio such as "16:9" into its width and height terms"""
+    width, _, height = value.partition(":")
+    width, height = int(width), int(height)
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Invalid aspect ratio: {value}")
+    return width, height
+
+def _saliency(img: PILImage.Image) -> np.ndarray:
+    """Score each pixel of a (small) image by how likely it is to draw the eye.
+
+    Adds up local detail (luminance gradient), colourfulness and skin
+    tones, each relative to the image's average, so flat skies, walls and
+    out-of-focus backgrounds score low and subjects score high.
+    """
+    rgb = np.asarray(img.convert("RGB"), dtype=np.float32) / 255
+    luminance = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    grad_y, grad_x = np.gradient(luminance)
+    detail = np.hypot(grad_x, grad_y)
+    saturation = rgb.max(axis=2) - rgb.min(axis=2)
+    red, green, blue = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    skin = (red > 0.37) & (green > 0.16) & (blue > 0.08) & (red > green) & (red > blue) & (red - green > 0.06) & (saturation > 0.06)
+    return detail / (detail.mean() + 1e-6) + 0.5 * saturation / (saturation.mean() + 1e-6) + skin
+
+def smart_crop_box(
+    img: PILImage.Image,
+    aspect: float,
+    focal: Optional[Tuple[float, float]] = None,
+) -> Tuple[float, float, float, float]:
+    """Choose the largest crop of an (upright) image with the given width/height ratio.
+
+    The crop spans the image's full height or width and slides along the
+    other axis: centred on ``focal`` (x, y as fractions of the image) when
+    given, otherwise to where the summed saliency of the rows or columns it
+    covers is highest, with a slight preference for the centre. Returns
+    (left, top, right, bottom) as fractions of the image size.
+    """
+    width, height = img.size
+    horizontal = width / height > aspect
+    kept = height * aspect / width if horizontal else width / aspect / height
+    if kept >= 0.999:
+        return 0.0, 0.0, 1.0, 1.0
+
+    if focal is not None:
+        centre = focal[0] if horizontal else focal[1]
+        start = centre - kept / 2
+    else:
+        small = img.copy()
+        small.thumbnail((SALIENCY_SIZE, SALIENCY_SIZE))
+        profile = _saliency(small).sum(axis=0 if horizontal else 1)
+        length = len(profile)
+        window = max(1, round(kept * length))
+        scores = np.convolve(profile, np.ones(window), "valid")
+        offsets = np.abs(np.arange(len(scores)) + window / 2 - length / 2) / (length / 2)
+        start = int(np.argmax(scores * (1 - 0.1 * offsets))) / length
+    start = round(min(max(start, 0.0), 1.0 - kept), 4)
+    end = round(start + kept, 4)
+    return (start, 0.0, end, 1.0) if horizontal else (0.0, start, 1.0, end)
+
+def generate_crops(
+    source_path: str,
+    output_dir: str,
+    stem: str,
+    aspect_ratios: List[str],
+    widths: List[int],
+    quality: int = 82,
+    formats: Optional[List[str]] = None,
+    focal: Optional[Tuple[float, float]] = None,
+    watermark=None,
+) -> dict:
+    """Generate art-directed crops of an image, one set per aspect ratio (e.g. "16:9", "4:5").
+
+    Each crop is framed by smart_crop_box and saved at every requested
+    width it is large enough for (or just its own width if it is smaller
+    than all of them), with the same alternate encodings as variants.
+    File names include a digest of the crop box, so re-cropping never
+    overwrites files other records may still point at. With a
+    ``watermark`` every output is watermarked and named like other
+    watermarked copies (``_wm<fingerprint>``). Returns a dict mapping
+    each aspect ratio to its box and variants, smallest first.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    with PILImage.open(source_path) as img:
+        # Every crop keeps the full width or height, so no output needs
+        # more than the largest width along both edges
+        largest = max(widths)
+        img.draft("RGB", (largest, largest))
+        upright = ImageOps.exif_transpose(img)
+
+        fmt = "PNG" if _has_alpha(upright) else "JPEG"
+        ext = ".png" if fmt == "PNG" else ".jpg"
+        if upright.mode not in ("RGB", "RGBA", "L", "LA"):
+            upright = upright.convert("RGBA" if fmt == "PNG" else "RGB")
+
+        crops = {}
+        for aspect_ratio in aspect_ratios:
+            ratio_width, ratio_height = parse_aspect_ratio(aspect_ratio)
+            box = smart_crop_box(upright, ratio_width / ratio_height, focal)
+            current = upright.crop((
+                round(box[0] * upright.width), round(box[1] * upright.height),
+                round(box[2] * upright.width), round(box[3] * upright.height),
+            ))
+            digest = hashlib.sha1(f"{aspect_ratio}:{box}".encode()).hexdigest()[:10]
+            if watermark:
+                digest += f"_wm{watermark.fingerprint}"
+            targets = sorted(w for w in widths if w <= current.width) or [current.width]
+
+            variants = []
+            for width in reversed(targets):
+                resized = current.resize((width, max(1, round(width * ratio_height / ratio_width))), PILImage.LANCZOS)
+                # Smaller widths are resized from the clean crop, not the watermarked one
+                output = apply_watermark(resized, watermark) if watermark else resized
+                path = os.path.join(output_dir, f"{stem}_crop{digest}_{width}{ext}")
+                _save_variant(output, path, fmt, quality)
+                size = os.path.getsize(path)
+                variants.append({
+                    "width": output.width,
+                    "height": output.height,
+                    "path": path,
+                    "size": size,
+                    "formats": _encode_alternates(
+                        output, os.path.join(output_dir, f"{stem}_crop{digest}_{width}"), formats or [], quality, size
+                    ),
+                })
+                current = resized
+            variants.reverse()
+            crops[aspect_ratio] = {"box": list(box), "variants": variants}
+    return crops
@@ -0,0 +1,54 @@
+from typing import List, Tuple
+
+def justified_layout(
+    items: List[Tuple[int, float]],
+    container_width: float,
+    target_row_height: float = 300,
+    spacing: float = 8,
+) -> dict:
+    """Arrange items into justified rows that exactly fill the container width.
+
+    ``items`` is a list of ``(id, aspect_ratio)`` pairs in display order.
+    Items are added to a row until it would be wider than the container at
+    ``target_row_height``, then the row's height is scaled so it fits the
+    width exactly. The last row is left at the target height rather than
+    stretched. Returns the rows (with each item's box) and the total height.
+    """
+    rows = []
+    row: List[Tuple[int, float]] = []
+    aspect_sum = 0.0
+    top = 0.0
+
+    def emit(row_items: List[Tuple[int, float]], height: float, fill: bool):
+        nonlocal top
+        boxes = []
+        left = 0.0
+        for index, (item_id, aspect) in enumerate(row_items):
+            width = aspect * height
+            if fill and index == len(row_items) - 1:
+                # Absorb rounding so the row ends exactly at the container edge
+                width = container_width - left
+            boxes.append({
+                "id": item_id,
+                "x": round(left, 2),
+                "y": round(top, 2),
+                "width": round(width, 2),
+                "height": round(height, 2),
+            })
+            left += width + spacing
+        rows.append({"y": round(top, 2), "height": round(height, 2), "items": boxes})
+        top += height + spacing
+
+    for item_id, aspect in items:
+        row.append((item_id, aspect))
+        aspect_sum += aspect
+        gaps = spacing * (len(row) - 1)
+        if aspect_sum * target_row_height + gaps >= container_width:
+            emit(row, (container_width - gaps) / aspect_sum, fill=True)
+            row, aspect_sum = [], 0.0
+
+    if row:
+        emit(row, target_row_height, fill=False)
+
+    total_height = max(top - spacing, 0.0)
+    return {"rows": rows, "height": round(total_height, 2)}
@@ -0,0 +1,29 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List
+
+class KeyedLocks:
+    """asyncio locks made per key on first use, e.g. so concurrent requests for one file compute it once.
+
+    A key's lock is kept while anyone holds or waits on it and dropped
+    after the last one is done, so every request for a key always queues
+    on the same lock and the map doesn't grow with every key ever used.
+    """
+
+    def __init__(self):
+        # key -> [lock, holders and waiters]
+        self._locks: Dict[str, List] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: str) -> AsyncIterator[None]:
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and self._locks.get(key) is entry:
+                del self._locks[key]
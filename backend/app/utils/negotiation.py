@@ -0,0 +1,64 @@
+import mimetypes
+from typing import Dict, Optional, Tuple
+
+def parse_accept(header: Optional[str]) -> Dict[str, float]:
+    """Parse an Accept header into a map of media range -> quality value"""
+    accepted: Dict[str, float] = {}
+    if not header:
+        return accepted
+    for part in header.split(","):
+        media_range, *params = [p.strip() for p in part.split(";")]
+        if not media_range:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[media_range.lower()] = quality
+    return accepted
+
+def accepts_explicitly(accepted: Dict[str, float], media_type: str) -> bool:
+    """Check whether a client names a media type in its Accept header.
+
+    Wildcards such as image/* are deliberately not enough: older browsers
+    send them without being able to decode WebP or AVIF.
+    """
+    return accepted.get(media_type, 0.0) > 0
+
+def media_type_for(path: str) -> str:
+    """Guess the media type of a stored image file"""
+    if path.endswith(".avif"):
+        return "image/avif"
+    if path.endswith(".webp"):
+        return "image/webp"
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+def choose_encoding(
+    base: Dict,
+    alternates: Dict[str, Dict],
+    accept: Optional[str],
+) -> Tuple[str, str]:
+    """Pick the smallest encoding of an image the client can decode.
+
+    ``base`` is the image in its original format (always acceptable) and
+    ``alternates`` maps format names to alternate encodings; each is a dict
+    with ``path`` and ``size``. Returns the chosen path and media type.
+    """
+    accepted = parse_accept(accept)
+    path, size = base["path"], base.get("size") or float("inf")
+    for fmt, encoding in alternates.items():
+        if accepts_explicitly(accepted, f"image/{fmt}") and encoding["size"] < size:
+            path, size = encoding["path"], encoding["size"]
+    return path, media_type_for(path)
+
+def preferred_format(formats, accept: Optional[str]) -> Optional[str]:
+    """Get the first of the given formats the client explicitly accepts"""
+    accepted = parse_accept(accept)
+    for fmt in formats:
+        if accepts_explicitly(accepted, f"image/{fmt}"):
+            return fmt
+    return None
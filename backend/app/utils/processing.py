@@ -0,0 +1,66 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Callable, Optional
+
+from app.core.config import settings
+
+try:
+    # Unix only; elsewhere workers run without a memory limit
+    import resource
+except ImportError:
+    resource = None
+
+_pool: Optional[Executor] = None
+
+def _limit_worker_memory(max_bytes: int):
+    """Cap a worker's address space, so a decode that runs away fails with
+    MemoryError in that worker instead of exhausting the node's memory"""
+    if resource is None or max_bytes <= 0:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        max_bytes = min(max_bytes, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (max_bytes, hard))
+
+def get_process_pool() -> Optional[Executor]:
+    """Get the shared image processing pool, creating it on first use.
+
+    Returns None when IMAGE_WORKERS is 0, in which case work runs in the
+    default thread pool instead.
+    """
+    global _pool
+    if _pool is None and settings.IMAGE_WORKERS > 0:
+        # Spawn rather than fork so workers never inherit the event loop,
+        # open database connections or locks held by the API process
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_limit_worker_memory,
+            initargs=(settings.IMAGE_WORKER_MAX_MEMORY_BYTES,),
+        )
+    return _pool
+
+async def run_in_process(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run a CPU-bound function off the event loop and await its result"""
+    global _pool
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    try:
+        return await loop.run_in_executor(pool, partial(func, *args, **kwargs))
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); the pool refuses all work
+        # after that, so replace it for the next caller
+        if _pool is pool:
+            _pool = None
+            pool.shutdown(wait=False)
+        raise
+
+def shutdown_process_pool():
+    """Shut down the processing pool, waiting for in-flight jobs to finish"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
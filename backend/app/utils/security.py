@@ -1,5 +1,14 @@
+import hmac
+import time
+import base64
+import hashlib
+from functools import lru_cache
+from urllib.parse import urlencode
+
 import bcrypt
 
+from app.core.config import settings
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash using bcrypt directly."""
     try:
@@ -30,3 +39,28 @@ def get_password_hash(password: str) -> str:
     except Exception as e:
         print(f"Password hashing error: {e}")
         raise
+
+@lru_cache()
+def _file_signing_key() -> bytes:
+    """Key for signed file links, derived from SECRET_KEY so it is never used directly for two purposes"""
+    return hmac.new(settings.SECRET_KEY.encode(), b"signed-file-urls", hashlib.sha256).digest()
+
+def _file_signature(image_id: int, variant: str, key: str, expires: int) -> str:
+    message = f"{image_id}:{variant}:{key}:{expires}".encode()
+    digest = hmac.new(_file_signing_key(), message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+def create_signed_file_url(image_id: int, variant: str, key: str, expires: int) -> str:
+    """Create a link to a stored file that works without logging in until ``expires`` (a Unix time).
+
+    The signature covers the storage key, so the link can be served
+    without looking the image up.
+    """
+    query = urlencode({"key": key, "expires": expires, "sig": _file_signature(image_id, variant, key, expires)})
+    return f"/media/signed/{image_id}/{variant}?{query}"
+
+def verify_file_signature(image_id: int, variant: str, key: str, expires: int, signature: str) -> bool:
+    """Check a signed file link is authentic and has not expired"""
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(_file_signature(image_id, variant, key, expires), signature)
@@ -0,0 +1,412 @@
+import os
+import shutil
+import tempfile
+import mimetypes
+import uuid
+from abc import ABC, abstractmethod
+from typing import Iterator, List, Optional
+
+from app.core.config import settings
+
+try:
+    # Only needed for the S3 driver
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+# Size of the pieces files are read in
+READ_CHUNK_SIZE = 1024 * 1024  # 1MB
+
+# Stored files are named by their content, so they never change once written
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+class StorageWriter(ABC):
+    """A streaming write of a file whose final key is only known once it is complete.
+
+    Chunks are written to a temporary location; ``commit`` publishes them
+    under the final key in one step and ``abort`` throws them away, so
+    readers never see a partial file.
+    """
+
+    @abstractmethod
+    def write(self, chunk: bytes):
+        pass
+
+    @abstractmethod
+    def commit(self, key: str):
+        pass
+
+    @abstractmethod
+    def abort(self):
+        pass
+
+class Storage(ABC):
+    """Where uploaded files and their derivatives are kept.
+
+    Files are addressed by key, the relative path saved on image records
+    (e.g. ``static/images/<hash>.jpg``). Methods block, so async callers
+    should run them in the threadpool.
+    """
+
+    @abstractmethod
+    def writer(self, prefix: str) -> StorageWriter:
+        """Start a streaming write of a file that will be stored under ``prefix``"""
+
+    @abstractmethod
+    def put_file(self, local_path: str, key: str):
+        """Move a file on local disk into storage under ``key``"""
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    @abstractmethod
+    def stat(self, key: str) -> Optional[dict]:
+        """Get a stored file's size and modification time, or None if it does not exist"""
+
+    @abstractmethod
+    def delete(self, key: str) -> bool:
+        pass
+
+    @abstractmethod
+    def list_keys(self, prefix: str, start_after: Optional[str] = None) -> Iterator[str]:
+        """List the keys of every stored file under ``prefix`` in sorted order, optionally resuming after a key"""
+
+    @abstractmethod
+    def read_range(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Stream the bytes of a stored file from ``start`` to ``end`` inclusive (or to the end)"""
+
+    def read_bytes(self, key: str, start: int, length: int) -> bytes:
+        return b"".join(self.read_range(key, start, start + length - 1))
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Get the local path of a stored file, if it is stored on this machine"""
+        return None
+
+    def download(self, key: str) -> str:
+        """Copy a stored file to a new temporary file and return its path; the caller removes it"""
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(key)[1])
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in self.read_range(key):
+                    f.write(chunk)
+        except Exception:
+            os.remove(path)
+            raise
+        return path
+
+    def url(self, key: str, expires_in: Optional[int] = None) -> Optional[str]:
+        """Get a URL clients can fetch a stored file from directly, or None if it must be served by the app"""
+        return None
+
+    @property
+    def is_local(self) -> bool:
+        return False
+
+class LocalFileWriter(StorageWriter):
+    def __init__(self, storage: "LocalStorage", prefix: str):
+        self.storage = storage
+        directory = storage.path(prefix)
+        os.makedirs(directory, exist_ok=True)
+        # Same directory as the destination, so the final rename stays on one filesystem
+        fd, self.tmp_path = tempfile.mkstemp(dir=directory, prefix=".upload-", suffix=".tmp")
+        self.file = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes):
+        self.file.write(chunk)
+
+    def commit(self, key: str):
+        self.file.close()
+        path = self.storage.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # mkstemp creates owner-only files; stored images must be readable by the web server
+        os.chmod(self.tmp_path, 0o644)
+        os.replace(self.tmp_path, path)
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+class LocalStorage(Storage):
+    """Files on the local filesystem, with keys relative to ``root``"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def writer(self, prefix: str) -> StorageWriter:
+        return LocalFileWriter(self, prefix)
+
+    def put_file(self, local_path: str, key: str):
+        if os.path.abspath(local_path) == os.path.abspath(self.path(key)):
+            return
+        writer = LocalFileWriter(self, os.path.dirname(key))
+        writer.file.close()
+        # A rename when both are on one filesystem, otherwise copy-then-delete
+        shutil.move(local_path, writer.tmp_path)
+        writer.commit(key)
+
+    def stat(self, key: str) -> Optional[dict]:
+        try:
+            stat = os.stat(self.path(key))
+        except OSError:
+            return None
+        return {"size": stat.st_size, "created": stat.st_ctime, "modified": stat.st_mtime}
+
+    def delete(self, key: str) -> bool:
+        try:
+            os.remove(self.path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def list_keys(self, prefix: str, start_after: Optional[str] = None) -> Iterator[str]:
+        yield from self._list_directory(self.path(prefix), start_after)
+
+    def _list_directory(self, directory: str, start_after: Optional[str]) -> Iterator[str]:
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        # Sorting directories as "name/" makes the walk yield keys in the
+        # same order as comparing them as strings, like S3 listings
+        entries.sort(key=lambda entry: entry.name + "/" if entry.is_dir(follow_symlinks=False) else entry.name)
+        for entry in entries:
+            key = os.path.relpath(entry.path, self.root).replace(os.sep, "/")
+            if entry.is_dir(follow_symlinks=False):
+                if start_after is None or start_after < key + "/" or start_after.startswith(key + "/"):
+                    yield from self._list_directory(entry.path, start_after)
+            elif entry.is_file() and (start_after is None or key > start_after):
+                yield key
+
+    def read_range(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        with open(self.path(key), "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = f.read(READ_CHUNK_SIZE if remaining is None else min(READ_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def local_path(self, key: str) -> Optional[str]:
+        return self.path(key)
+
+    @property
+    def is_local(self) -> bool:
+        return True
+
+class S3MultipartWriter(StorageWriter):
+    """Streams a file to S3, switching to a multipart upload once it outgrows one part.
+
+    Parts go to a temporary key; small files are written straight to their
+    final key in a single request on commit.
+    """
+
+    def __init__(self, storage: "S3Storage", prefix: str):
+        self.storage = storage
+        self.tmp_key = storage.object_key(f"{prefix.rstrip('/')}/.upload-{uuid.uuid4().hex}.tmp")
+        self.buffer = bytearray()
+        self.upload_id: Optional[str] = None
+        self.parts: List[dict] = []
+
+    def _upload_part(self):
+        client = self.storage.client
+        if self.upload_id is None:
+            self.upload_id = client.create_multipart_upload(Bucket=self.storage.bucket, Key=self.tmp_key)["UploadId"]
+        part_number = len(self.parts) + 1
+        response = client.upload_part(
+            Bucket=self.storage.bucket, Key=self.tmp_key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=bytes(self.buffer),
+        )
+        self.parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+        self.buffer.clear()
+
+    def write(self, chunk: bytes):
+        self.buffer.extend(chunk)
+        if len(self.buffer) >= self.storage.part_size:
+            self._upload_part()
+
+    def commit(self, key: str):
+        storage = self.storage
+        if self.upload_id is None:
+            storage.client.put_object(
+                Bucket=storage.bucket, Key=storage.object_key(key), Body=bytes(self.buffer), **storage.object_args(key)
+            )
+            self.buffer.clear()
+            return
+
+        if self.buffer:
+            self._upload_part()
+        storage.client.complete_multipart_upload(
+            Bucket=storage.bucket, Key=self.tmp_key, UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts},
+        )
+        self.upload_id = None
+        # The key is only known once every byte has been hashed, so the
+        # assembled object is copied into place server-side
+        storage.client.copy(
+            {"Bucket": storage.bucket, "Key": self.tmp_key}, storage.bucket, storage.object_key(key),
+            ExtraArgs={**storage.object_args(key), "MetadataDirective": "REPLACE"},
+            Config=storage.transfer_config,
+        )
+        storage.client.delete_object(Bucket=storage.bucket, Key=self.tmp_key)
+
+    def abort(self):
+        self.buffer.clear()
+        if self.upload_id is not None:
+            try:
+                self.storage.client.abort_multipart_upload(
+                    Bucket=self.storage.bucket, Key=self.tmp_key, UploadId=self.upload_id
+                )
+            except ClientError:
+                pass
+            self.upload_id = None
+
+class S3Storage(Storage):
+    """Files in an S3-compatible object store (AWS S3, MinIO, R2, ...).
+
+    Clients are sent presigned URLs, or ``public_url`` links when the bucket
+    sits behind a CDN, so image bytes never pass through the API.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        access_key_id: Optional[str] = None,
+        secret_access_key: Optional[str] = None,
+        part_size: int = 8 * 1024 * 1024,
+        url_expire_seconds: int = 3600,
+        public_url: Optional[str] = None,
+    ):
+        if boto3 is None:
+            raise RuntimeError("The S3 storage backend requires boto3 (pip install boto3)")
+        if not bucket:
+            raise RuntimeError("S3_BUCKET must be set to use the S3 storage backend")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        # S3 rejects multipart parts under 5MB, except the last
+        self.part_size = max(part_size, 5 * 1024 * 1024)
+        self.url_expire_seconds = url_expire_seconds
+        self.public_url = public_url.rstrip("/") if public_url else None
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            aws_access_key_id=access_key_id or None,
+            aws_secret_access_key=secret_access_key or None,
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=self.part_size, multipart_chunksize=self.part_size
+        )
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    @staticmethod
+    def object_args(key: str) -> dict:
+        return {
+            "ContentType": mimetypes.guess_type(key)[0] or "application/octet-stream",
+            "CacheControl": IMMUTABLE_CACHE_CONTROL,
+        }
+
+    def writer(self, prefix: str) -> StorageWriter:
+        return S3MultipartWriter(self, prefix)
+
+    def put_file(self, local_path: str, key: str):
+        self.client.upload_file(
+            local_path, self.bucket, self.object_key(key),
+            ExtraArgs=self.object_args(key), Config=self.transfer_config,
+        )
+        os.remove(local_path)
+
+    def stat(self, key: str) -> Optional[dict]:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        modified = head["LastModified"].timestamp()
+        return {"size": head["ContentLength"], "created": modified, "modified": modified}
+
+    def delete(self, key: str) -> bool:
+        # Deleting a missing object is not an error in S3
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+        return True
+
+    def list_keys(self, prefix: str, start_after: Optional[str] = None) -> Iterator[str]:
+        strip = len(self.object_key(""))
+        args = {"Bucket": self.bucket, "Prefix": self.object_key(prefix)}
+        if start_after:
+            args["StartAfter"] = self.object_key(start_after)
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(**args):
+            for item in page.get("Contents", []):
+                yield item["Key"][strip:]
+
+    def read_range(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        args = {"Bucket": self.bucket, "Key": self.object_key(key)}
+        if start or end is not None:
+            args["Range"] = f"bytes={start}-{'' if end is None else end}"
+        body = self.client.get_object(**args)["Body"]
+        try:
+            yield from body.iter_chunks(READ_CHUNK_SIZE)
+        finally:
+            body.close()
+
+    def download(self, key: str) -> str:
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(key)[1])
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, self.object_key(key), path, Config=self.transfer_config)
+        except Exception:
+            os.remove(path)
+            raise
+        return path
+
+    def url(self, key: str, expires_in: Optional[int] = None) -> Optional[str]:
+        if self.public_url:
+            return f"{self.public_url}/{self.object_key(key)}"
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self.object_key(key)},
+            ExpiresIn=expires_in or self.url_expire_seconds,
+        )
+
+_storage: Optional[Storage] = None
+
+def get_storage() -> Storage:
+    """Get the process-wide storage backend selected by STORAGE_BACKEND"""
+    global _storage
+    if _storage is None:
+        backend = settings.STORAGE_BACKEND.lower()
+        if backend == "local":
+            _storage = LocalStorage(settings.STORAGE_LOCAL_ROOT)
+        elif backend == "s3":
+            _storage = S3Storage(
+                bucket=settings.S3_BUCKET,
+                prefix=settings.S3_PREFIX,
+                endpoint_url=settings.S3_ENDPOINT_URL,
+                region=settings.S3_REGION,
+                access_key_id=settings.S3_ACCESS_KEY_ID,
+                secret_access_key=settings.S3_SECRET_ACCESS_KEY,
+                part_size=settings.S3_PART_SIZE,
+                url_expire_seconds=settings.S3_URL_EXPIRE_SECONDS,
+                public_url=settings.S3_PUBLIC_URL,
+            )
+        else:
+            raise RuntimeError(f"Unknown STORAGE_BACKEND: {settings.STORAGE_BACKEND}")
+    return _storage
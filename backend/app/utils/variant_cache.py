@@ -0,0 +1,115 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from app.core.config import settings
+
+class VariantCache:
+    """Disk cache of transformed images with least-recently-used eviction.
+
+    Entries are plain files under ``directory``; the cache keeps an in-memory
+    index ordered by last use and deletes the oldest files whenever the total
+    size goes over ``max_bytes``. Hits bump the file's mtime so the order
+    survives restarts, and files written by other worker processes are picked
+    up the first time they are looked up.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Index files already on disk, oldest first"""
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._total += size
+        self._evict()
+
+    def path_for(self, key: str) -> str:
+        """Get the on-disk location for a cache key"""
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached file for a key, marking it as recently used"""
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+            size = os.path.getsize(path)
+        except OSError:
+            with self._lock:
+                if key in self._entries:
+                    self._total -= self._entries.pop(key)
+            return None
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = size
+                self._total += size
+            self._entries.move_to_end(key)
+        return path
+
+    def put(self, key: str, tmp_path: str) -> str:
+        """Move a freshly written file into the cache and enforce the budget"""
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+
+        with self._lock:
+            self._total -= self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._total += size
+            self._evict(keep=key)
+        return path
+
+    def temp_path(self, key: str) -> str:
+        """Get a scratch path on the cache's filesystem for writing an entry"""
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total
+
+    def _evict(self, keep: Optional[str] = None):
+        while self._total > self.max_bytes and self._entries:
+            key, size = next(iter(self._entries.items()))
+            if key == keep:
+                # A single entry larger than the whole budget stays until
+                # something else is added
+                if len(self._entries) == 1:
+                    break
+                self._entries.move_to_end(key)
+                continue
+            self._entries.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(self.path_for(key))
+            except OSError:
+                pass
+
+_cache: Optional[VariantCache] = None
+
+def get_variant_cache() -> VariantCache:
+    """Get the process-wide transform cache"""
+    global _cache
+    if _cache is None:
+        _cache = VariantCache(settings.TRANSFORM_CACHE_DIR, settings.TRANSFORM_CACHE_MAX_BYTES)
+    return _cache
@@ -0,0 +1,55 @@
+"""
+Looping video encodes of animations, through an ffmpeg binary if one is installed.
+
+Browsers play an H.264 MP4 in a muted, looping ``<video>`` with a
+fraction of the bytes of the same animation as a GIF. Nothing here is
+required: without ffmpeg, animations are only served as GIF/WebP.
+"""
+
+import os
+import shutil
+import logging
+import subprocess
+from typing import Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# x264 constant rate factor: visually close to the GIF at a small size
+VIDEO_CRF = 26
+
+# Longest an encode may take before it is given up on
+VIDEO_TIMEOUT_SECONDS = 300
+
+def find_ffmpeg() -> Optional[str]:
+    """Get the path of the ffmpeg binary named by FFMPEG_BINARY, or None if it is not installed or disabled"""
+    if not settings.FFMPEG_BINARY:
+        return None
+    return shutil.which(settings.FFMPEG_BINARY)
+
+def encode_loop_video(source_path: str, dest_path: str, ffmpeg: str) -> Optional[dict]:
+    """Encode an animation as a silent H.264 MP4 that starts playing before it has fully downloaded.
+
+    Returns the video's path and size, or None if ffmpeg could not
+    encode it (e.g. animated WebP, which ffmpeg cannot decode).
+    """
+    command = [
+        ffmpeg, "-hide_banner", "-loglevel", "error", "-y",
+        "-i", source_path,
+        "-an",
+        "-c:v", "libx264", "-crf", str(VIDEO_CRF), "-preset", "medium",
+        # yuv420p (what browsers decode) needs even dimensions
+        "-pix_fmt", "yuv420p", "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2",
+        "-movflags", "+faststart",
+        "-f", "mp4", dest_path,
+    ]
+    try:
+        subprocess.run(command, check=True, capture_output=True, timeout=VIDEO_TIMEOUT_SECONDS)
+    except (OSError, subprocess.SubprocessError) as e:
+        stderr = getattr(e, "stderr", None) or b""
+        logger.warning("Could not encode %s as video: %s %s", source_path, e, stderr.decode(errors="replace").strip())
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        return None
+    return {"path": dest_path, "size": os.path.getsize(dest_path)}
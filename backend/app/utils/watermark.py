@@ -0,0 +1,77 @@
+import os
+import json
+import hashlib
+import threading
+from typing import NamedTuple, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.files import variant_key
+from app.utils.negotiation import media_type_for
+
+WATERMARK_POSITIONS = ("top-left", "top-right", "bottom-left", "bottom-right", "center", "tile")
+
+# Formats watermarked copies are saved in; anything else becomes PNG
+WATERMARK_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".avif", ".mp4")
+
+class Watermark(NamedTuple):
+    """The watermark in effect, with a fingerprint of the logo and every setting that affects the output"""
+    logo_path: str
+    opacity: float
+    position: str
+    scale: float
+    margin: float
+    quality: int
+    fingerprint: str
+
+_watermark: Optional[Watermark] = None
+_logo_mtime: Optional[float] = None
+_lock = threading.Lock()
+
+def get_watermark() -> Optional[Watermark]:
+    """Get the configured watermark, or None when watermarking is off.
+
+    The logo is re-hashed whenever its modification time changes, so
+    replacing the file gives watermarked copies a new fingerprint (and
+    new keys) without a restart.
+    """
+    global _watermark, _logo_mtime
+    logo_path = settings.WATERMARK_IMAGE
+    if not logo_path:
+        return None
+    try:
+        mtime = os.stat(logo_path).st_mtime
+    except OSError as e:
+        raise ValueError(f"WATERMARK_IMAGE cannot be read: {e}")
+    with _lock:
+        if _watermark is None or _watermark.logo_path != logo_path or _logo_mtime != mtime:
+            _watermark = _load_watermark(logo_path)
+            _logo_mtime = mtime
+        return _watermark
+
+def _load_watermark(logo_path: str) -> Watermark:
+    position = settings.WATERMARK_POSITION
+    if position not in WATERMARK_POSITIONS:
+        raise ValueError(f"WATERMARK_POSITION must be one of {', '.join(WATERMARK_POSITIONS)}, not '{position}'")
+    if not 0 < settings.WATERMARK_SCALE <= 1 or not 0 <= settings.WATERMARK_OPACITY <= 1:
+        raise ValueError("WATERMARK_SCALE must be in (0, 1] and WATERMARK_OPACITY in [0, 1]")
+    params = [
+        settings.WATERMARK_OPACITY, position, settings.WATERMARK_SCALE,
+        settings.WATERMARK_MARGIN, settings.VARIANT_QUALITY,
+    ]
+    digest = hashlib.sha256(json.dumps(params).encode())
+    with open(logo_path, "rb") as f:
+        digest.update(f.read())
+    return Watermark(logo_path, *params, fingerprint=digest.hexdigest()[:12])
+
+def watermarked_key(key: str, watermark: Watermark) -> Tuple[str, str]:
+    """Get where the watermarked copy of a stored image goes, and its media type.
+
+    Copies are named after the file they were made from and the
+    watermark's fingerprint, e.g. ``<hash>_1280_wm<fingerprint>.webp``.
+    """
+    stem, extension = os.path.splitext(os.path.basename(key))
+    extension = extension.lower()
+    if extension not in WATERMARK_EXTENSIONS:
+        extension = ".png"
+    key = variant_key(f"{stem}_wm{watermark.fingerprint}{extension}")
+    return key, media_type_for(key)
@@ -0,0 +1,67 @@
+import io
+import time
+import zipfile
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+class ZipEntry(NamedTuple):
+    """A file to add to a streamed archive"""
+    name: str
+    chunks: Iterable[bytes]  # the file's content, read lazily
+    size: Optional[int] = None  # known up front, lets entries over 4GB use ZIP64
+    modified: Optional[float] = None  # Unix time
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, unseekable file that collects what zipfile writes until it is drained.
+
+    Being unseekable makes zipfile write each entry's CRC and sizes in a
+    data descriptor after the content instead of going back to patch the
+    header, which is what lets the archive be streamed.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._offset
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def stream_zip(entries: Iterable[ZipEntry]) -> Iterator[bytes]:
+    """Generate a ZIP archive piece by piece as its entries are read.
+
+    Entries are stored without compression (images are already
+    compressed), so each chunk read is passed straight through and memory
+    use stays flat however large the archive gets. ZIP64 records are added
+    automatically past 4GB or 65,535 entries.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for entry in entries:
+            info = zipfile.ZipInfo(entry.name, date_time=time.localtime(entry.modified or time.time())[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            info.external_attr = 0o644 << 16
+            if entry.size is not None:
+                info.file_size = entry.size
+            force_zip64 = entry.size is None or entry.size >= zipfile.ZIP64_LIMIT
+            with archive.open(info, mode="w", force_zip64=force_zip64) as dest:
+                for chunk in entry.chunks:
+                    dest.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Image engine benchmark for Cheriyan Studio Showcase API
+
+Runs the thumbnail job (resized variants in every modern format, as
+processing does for each upload) over the sample images with each image
+engine, and reports throughput and peak memory. Every engine runs in a
+fresh process, so its peak RSS is its own; "per job" is how far the peak
+rose above the process's idle footprint, which is what bounds how many
+jobs fit side by side (IMAGE_WORKERS).
+
+The sample assets are web-sized; pass --scale to upscale them to camera
+sizes (e.g. --scale 3 turns 1920x1080 into about 5760x3240, 19MP).
+"""
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+import argparse
+import multiprocessing
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from app.core.config import settings
+
+DEFAULT_ASSETS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "assets")
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+def prepare_assets(assets_dir: str, scale: float, work_dir: str) -> list:
+    """List the sample images, upscaled into work_dir if asked to"""
+    from PIL import Image as PILImage
+
+    names = sorted(name for name in os.listdir(assets_dir) if name.lower().endswith((".jpg", ".jpeg", ".png", ".webp")))
+    if scale == 1:
+        return [os.path.join(assets_dir, name) for name in names]
+    files = []
+    for name in names:
+        with PILImage.open(os.path.join(assets_dir, name)) as img:
+            size = (round(img.width * scale), round(img.height * scale))
+            path = os.path.join(work_dir, name)
+            img.convert("RGB").resize(size, PILImage.LANCZOS).save(path, "JPEG", quality=92)
+        files.append(path)
+    return files
+
+def run_engine(engine_name: str, files: list, rounds: int, widths: list, formats: list, quality: int) -> dict:
+    """Run in a fresh process: time the thumbnail job over every file and record the peak RSS"""
+    from PIL import Image as PILImage
+    from app.utils import engines
+
+    if engine_name == "vips" and engines.pyvips is None:
+        return {"engine": engine_name, "skipped": "pyvips or libvips not installed"}
+    engine = engines.create_engine(engine_name)
+
+    output_dir = tempfile.mkdtemp(prefix=f"benchmark-{engine_name}-")
+    try:
+        # Warm up imports and codecs on a tiny image before taking the idle footprint
+        warmup_path = os.path.join(output_dir, "warmup.jpg")
+        PILImage.new("RGB", (64, 64)).save(warmup_path)
+        engine.generate_variants(warmup_path, output_dir, "warmup", [32], quality, formats)
+        idle = peak_rss_mb()
+
+        output_bytes = 0
+        started = time.perf_counter()
+        for round_number in range(rounds):
+            for index, path in enumerate(files):
+                stem = f"r{round_number}_{index}"
+                variants = engine.generate_variants(path, output_dir, stem, widths, quality, formats)
+                if round_number == 0:
+                    for variant in variants:
+                        output_bytes += variant["size"] + sum(encoding["size"] for encoding in variant["formats"].values())
+                for name in os.listdir(output_dir):
+                    os.remove(os.path.join(output_dir, name))
+        elapsed = time.perf_counter() - started
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    jobs = rounds * len(files)
+    peak = peak_rss_mb()
+    return {
+        "engine": engine_name,
+        "jobs": jobs,
+        "seconds": elapsed,
+        "jobs_per_second": jobs / elapsed,
+        "peak_rss_mb": peak,
+        "job_rss_mb": peak - idle,
+        "output_kb": output_bytes / 1024,
+    }
+
+def main():
+    from app.utils.imaging import supported_formats
+
+    parser = argparse.ArgumentParser(description="Compare image engines on the thumbnail job")
+    parser.add_argument("--assets", default=DEFAULT_ASSETS, help="directory of sample images")
+    parser.add_argument("--engines", default="pillow,vips", help="comma-separated engines to compare")
+    parser.add_argument("--rounds", type=int, default=3, help="passes over the sample images")
+    parser.add_argument("--scale", type=float, default=1, help="upscale the samples by this factor first")
+    parser.add_argument("--formats", default=",".join(settings.MODERN_FORMATS), help="alternate encodings to produce")
+    parser.add_argument("--quality", type=int, default=settings.VARIANT_QUALITY)
+    args = parser.parse_args()
+
+    if resource is None:
+        print("❌ Peak RSS is only available on Unix")
+        sys.exit(1)
+
+    widths = settings.VARIANT_WIDTHS
+    formats = supported_formats([fmt.strip() for fmt in args.formats.split(",") if fmt.strip()])
+    work_dir = tempfile.mkdtemp(prefix="benchmark-assets-")
+    try:
+        files = prepare_assets(args.assets, args.scale, work_dir)
+        if not files:
+            print(f"❌ No images in {args.assets}")
+            sys.exit(1)
+        print(f"📊 {len(files)} images x {args.rounds} rounds, widths {widths}, formats {formats or 'none'}")
+
+        context = multiprocessing.get_context("spawn")
+        results = []
+        for engine_name in [name.strip() for name in args.engines.split(",") if name.strip()]:
+            with context.Pool(1, maxtasksperchild=1) as pool:
+                results.append(pool.apply(run_engine, (engine_name, files, args.rounds, widths, formats, args.quality)))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"{'engine':<8} {'jobs':>5} {'seconds':>8} {'jobs/s':>7} {'peak RSS MB':>12} {'per job MB':>11} {'output KB':>10}")
+    for result in results:
+        if "skipped" in result:
+            print(f"{result['engine']:<8} skipped ({result['skipped']})")
+            continue
+        print(
+            f"{result['engine']:<8} {result['jobs']:>5} {result['seconds']:>8.2f} {result['jobs_per_second']:>7.2f} "
+            f"{result['peak_rss_mb']:>12.1f} {result['job_rss_mb']:>11.1f} {result['output_kb']:>10.0f}"
+        )
+
+if __name__ == "__main__":
+    main()
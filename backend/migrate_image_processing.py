@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Database migration script for the image processing pipeline:
+1. Add variants column to images table
+2. Add encodings column to images table
+3. Create upload_sessions table
+4. Add content_hash column to images table
+5. Add placeholder and dominant_color columns to images table
+6. Add width, height and aspect_ratio columns to images table
+7. Add EXIF columns (captured_at, camera, lens, exposure, orientation) to images table
+8. Add perceptual_hash column to images table
+9. Add palette column to images table
+10. Add processing_status column to images table and create jobs table
+11. Add focal point and crop columns to hero_slides table
+12. Add animation column to images table
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, inspect, text
+from app.core.config import settings
+
+IMAGE_COLUMNS = [
+    ("variants", "TEXT"),
+    ("encodings", "TEXT"),
+    ("content_hash", "VARCHAR(64)"),
+    ("placeholder", "TEXT"),
+    ("dominant_color", "VARCHAR(7)"),
+    ("width", "INTEGER"),
+    ("height", "INTEGER"),
+    ("aspect_ratio", "FLOAT"),
+    ("captured_at", "DATETIME"),
+    ("camera_make", "VARCHAR"),
+    ("camera_model", "VARCHAR"),
+    ("lens_model", "VARCHAR"),
+    ("focal_length", "FLOAT"),
+    ("f_number", "FLOAT"),
+    ("exposure_time", "VARCHAR"),
+    ("iso", "INTEGER"),
+    ("orientation", "INTEGER"),
+    ("perceptual_hash", "VARCHAR(16)"),
+    ("palette", "VARCHAR"),
+    ("processing_status", "VARCHAR DEFAULT 'ready'"),
+    ("animation", "TEXT"),
+]
+
+HERO_SLIDE_COLUMNS = [
+    ("focal_x", "FLOAT"),
+    ("focal_y", "FLOAT"),
+    ("crops", "TEXT"),
+    ("crops_key", "VARCHAR(64)"),
+]
+
+def migrate_database():
+    """Add image processing columns to existing tables"""
+    engine = create_engine(
+        settings.DATABASE_URL,
+        connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {}
+    )
+
+    print("Starting image processing migration...")
+
+    existing = {column["name"] for column in inspect(engine).get_columns("images")}
+
+    with engine.begin() as conn:
+        for name, column_type in IMAGE_COLUMNS:
+            if name in existing:
+                print(f"✓ {name} column already exists in images table")
+                continue
+            print(f"Adding {name} column to images table...")
+            conn.execute(text(f"ALTER TABLE images ADD COLUMN {name} {column_type}"))
+            print(f"✓ Added {name} column to images table")
+
+    existing = {column["name"] for column in inspect(engine).get_columns("hero_slides")}
+
+    with engine.begin() as conn:
+        for name, column_type in HERO_SLIDE_COLUMNS:
+            if name in existing:
+                print(f"✓ {name} column already exists in hero_slides table")
+                continue
+            print(f"Adding {name} column to hero_slides table...")
+            conn.execute(text(f"ALTER TABLE hero_slides ADD COLUMN {name} {column_type}"))
+            print(f"✓ Added {name} column to hero_slides table")
+
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_images_content_hash ON images (content_hash)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_images_captured_at ON images (captured_at)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_images_perceptual_hash ON images (perceptual_hash)"))
+
+    from app.models.upload_session import UploadSession
+    from app.models.job import Job
+    for table in (UploadSession.__table__, Job.__table__):
+        table.create(bind=engine, checkfirst=True)
+        print(f"✓ {table.name} table ready")
+
+    print("Image processing migration completed!")
+
+def backfill_variants():
+    """Generate derivatives for images uploaded before the pipeline existed"""
+    import json
+    from sqlalchemy import or_
+    from app.db.base import SessionLocal
+    from app.models.image import Image
+    from app.utils.files import get_relative_path, get_storage_path
+    from app.utils.engines import generate_variants, encode_formats
+    from app.utils.imaging import supported_formats
+
+    formats = supported_formats(settings.MODERN_FORMATS)
+    db = SessionLocal()
+    try:
+        images = db.query(Image).filter(or_(Image.variants.is_(None), Image.encodings.is_(None))).all()
+        print(f"Generating variants for {len(images)} images...")
+        for image in images:
+            source_path = get_storage_path(image.file_path)
+            stem = os.path.splitext(image.filename)[0]
+            try:
+                variants = generate_variants(
+                    source_path,
+                    settings.VARIANT_DIR,
+                    stem,
+                    settings.VARIANT_WIDTHS,
+                    settings.VARIANT_QUALITY,
+                    formats,
+                )
+                encodings = encode_formats(source_path, settings.VARIANT_DIR, stem, formats, settings.VARIANT_QUALITY)
+            except Exception as e:
+                print(f"Warning: Could not generate variants for image {image.id}: {e}")
+                continue
+            for variant in variants:
+                variant["path"] = get_relative_path(variant["path"])
+                for encoding in variant["formats"].values():
+                    encoding["path"] = get_relative_path(encoding["path"])
+            for encoding in encodings.values():
+                encoding["path"] = get_relative_path(encoding["path"])
+            image.variants = json.dumps(variants)
+            image.encodings = json.dumps(encodings)
+            db.commit()
+        print("✓ Variants generated")
+    finally:
+        db.close()
+
+def backfill_content_hashes():
+    """Hash the files of images uploaded before content-addressed storage.
+
+    Existing files keep their names; they are simply counted as references
+    to their content from now on.
+    """
+    import hashlib
+    from app.db.base import SessionLocal
+    from app.models.image import Image
+    from app.utils.files import get_storage_path
+
+    db = SessionLocal()
+    try:
+        images = db.query(Image).filter(Image.content_hash.is_(None)).all()
+        print(f"Hashing {len(images)} images...")
+        for image in images:
+            digest = hashlib.sha256()
+            try:
+                with open(get_storage_path(image.file_path), "rb") as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                        digest.update(chunk)
+            except OSError as e:
+                print(f"Warning: Could not hash image {image.id}: {e}")
+                continue
+            image.content_hash = digest.hexdigest()
+            db.commit()
+        print("✓ Content hashes stored")
+    finally:
+        db.close()
+
+def backfill_placeholders():
+    """Compute inline placeholders for images uploaded before they existed"""
+    from app.db.base import SessionLocal
+    from app.models.image import Image
+    from app.utils.files import get_storage_path
+    from app.utils.imaging import compute_placeholder
+
+    db = SessionLocal()
+    try:
+        images = db.query(Image).filter(Image.placeholder.is_(None)).all()
+        print(f"Computing placeholders for {len(images)} images...")
+        for image in images:
+            try:
+                placeholder = compute_placeholder(get_storage_path(image.file_path), settings.PLACEHOLDER_SIZE)
+            except Exception as e:
+                print(f"Warning: Could not compute placeholder for image {image.id}: {e}")
+                continue
+            image.placeholder = placeholder["placeholder"]
+            image.dominant_color = placeholder["dominant_color"]
+            db.commit()
+        print("✓ Placeholders computed")
+    finally:
+        db.close()
+
+def backfill_dimensions():
+    """Read display dimensions for images uploaded before they were stored"""
+    from app.db.base import SessionLocal
+    from app.models.image import Image
+    from app.utils.files import get_storage_path
+    from app.utils.imaging import read_dimensions
+
+    db = SessionLocal()
+    try:
+        images = db.query(Image).filter(Image.width.is_(None)).all()
+        print(f"Reading dimensions of {len(images)} images...")
+        for image in images:
+            try:
+                dimensions = read_dimensions(get_storage_path(image.file_path))
+            except Exception as e:
+                print(f"Warning: Could not read dimensions of image {image.id}: {e}")
+                continue
+            for column, value in dimensions.items():
+                setattr(image, column, value)
+            db.commit()
+        print("✓ Dimensions stored")
+    finally:
+        db.close()
+
+def backfill_exif():
+    """Extract EXIF capture details for images uploaded before they were stored"""
+    from app.db.base import SessionLocal
+    from app.models.image import Image
+    from app.utils.files import get_storage_path
+    from app.utils.imaging import read_exif
+
+    db = SessionLocal()
+    try:
+        images = db.query(Image).filter(Image.orientation.is_(None)).all()
+        print(f"Reading EXIF of {len(images)} images...")
+        for image in images:
+            try:
+                exif = read_exif(get_storage_path(image.file_path))
+            except Exception as e:
+                print(f"Warning: Could not read EXIF of image {image.id}: {e}")
+                continue
+            for column, value in exif.items():
+                setattr(image, column, value)
+            db.commit()
+        print("✓ EXIF details stored")
+    finally:
+        db.close()
+
+def backfill_perceptual_hashes():
+    """Compute perceptual hashes for images uploaded before near-duplicate detection"""
+    from app.db.base import SessionLocal
+    from app.models.image import Image
+    from app.utils.files import get_storage_path
+    from app.utils.imaging import compute_dhash
+
+    db = SessionLocal()
+    try:
+        images = db.query(Image).filter(Image.perceptual_hash.is_(None)).all()
+        print(f"Hashing the content of {len(images)} images...")
+        for image in images:
+            try:
+                image.perceptual_hash = compute_dhash(get_storage_path(image.file_path))
+            except Exception as e:
+                print(f"Warning: Could not compute perceptual hash of image {image.id}: {e}")
+                continue
+            db.commit()
+        print("✓ Perceptual hashes stored")
+    finally:
+        db.close()
+
+def backfill_palettes():
+    """Extract colour palettes for images uploaded before colour search"""
+    from app.db.base import SessionLocal
+    from app.models.image import Image
+    from app.utils.colors import format_palette
+    from app.utils.files import get_storage_path
+    from app.utils.imaging import compute_palette
+
+    db = SessionLocal()
+    try:
+        images = db.query(Image).filter(Image.palette.is_(None)).all()
+        print(f"Extracting palettes of {len(images)} images...")
+        for image in images:
+            try:
+                palette = compute_palette(get_storage_path(image.file_path), settings.PALETTE_SIZE)
+            except Exception as e:
+                print(f"Warning: Could not extract palette of image {image.id}: {e}")
+                continue
+            image.palette = format_palette(palette)
+            db.commit()
+        print("✓ Palettes stored")
+    finally:
+        db.close()
+
+def backfill_hero_crops():
+    """Queue crop jobs for hero slides without crops, or with crops made under other settings"""
+    from app.db.base import SessionLocal
+    from app.services.hero_slide_service import HeroSlideService
+
+    db = SessionLocal()
+    try:
+        queued = HeroSlideService(db).enqueue_all()
+        print(f"✓ Queued crops for {queued} hero slides (run by the job worker)")
+    finally:
+        db.close()
+
+def backfill_animations():
+    """Queue reprocessing of animated GIF/WebP uploads from before animations were kept, for their animated encodings and poster"""
+    from PIL import Image as PILImage
+    from sqlalchemy import or_
+    from app.db.base import SessionLocal
+    from app.models.image import Image
+    from app.services.image_service import ImageService, PRIORITY_BULK
+    from app.services.job_service import notify_job_workers
+    from app.utils.imaging import is_animated
+    from app.utils.storage import get_storage
+
+    storage = get_storage()
+    db = SessionLocal()
+    try:
+        images = db.query(Image).filter(
+            Image.animation.is_(None),
+            Image.processing_status == "ready",
+            or_(Image.file_path.ilike("%.gif"), Image.file_path.ilike("%.webp")),
+        ).all()
+        checked = {}
+        for image in images:
+            if image.content_hash not in checked:
+                path = storage.local_path(image.file_path) or storage.download(image.file_path)
+                try:
+                    with PILImage.open(path) as img:
+                        checked[image.content_hash] = is_animated(img)
+                except Exception as e:
+                    print(f"Warning: Could not open image {image.id}: {e}")
+                    checked[image.content_hash] = False
+                finally:
+                    if not storage.is_local:
+                        os.remove(path)
+            if checked[image.content_hash]:
+                image.processing_status = "pending"
+                ImageService(db)._enqueue_processing(image, PRIORITY_BULK)
+        db.commit()
+        notify_job_workers()
+        print(f"✓ Queued reprocessing for {sum(checked.values())} animated images (run by the job worker)")
+    finally:
+        db.close()
+
+def backfill_watermarks():
+    """Queue watermarking public images, e.g. after WATERMARK_IMAGE or its settings changed"""
+    from app.db.base import SessionLocal
+    from app.services.image_service import ImageService
+    from app.utils.watermark import get_watermark
+
+    if get_watermark() is None:
+        print("✓ Watermarking is off (WATERMARK_IMAGE is not set)")
+        return
+    db = SessionLocal()
+    try:
+        queued = ImageService(db).enqueue_all_watermarks()
+        print(f"✓ Queued watermarking for {queued} public images (run by the job worker)")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    migrate_database()
+    backfill_dimensions()
+    backfill_exif()
+    backfill_content_hashes()
+    backfill_variants()
+    backfill_placeholders()
+    backfill_perceptual_hashes()
+    backfill_palettes()
+    backfill_hero_crops()
+    backfill_animations()
+    backfill_watermarks()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Storage reconciliation for Cheriyan Studio Showcase API
+
+Checks every image row against storage (missing originals or derivatives,
+originals whose size or SHA-256 changed) and every stored file under
+UPLOAD_DIR/VARIANT_DIR against the images table (orphans left by failed
+uploads or deletions). Orphans are only reported unless --delete is given.
+
+Progress is saved to the --state file after every batch; run the command
+again to resume an interrupted scan, or pass --restart to start over.
+"""
+
+import sys
+import os
+import json
+import logging
+import argparse
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.core.config import settings
+from app.db.base import SessionLocal
+from app.services.reconciliation_service import ReconciliationService
+
+def load_state(path: str):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def save_state(path: str, state: dict):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+def print_report(state: dict):
+    findings = state["findings"]
+    print(f"📊 Checked {state['images_checked']} images and {state['files_checked']} stored files")
+    print(f"   Missing originals:    {findings['missing_files']['count']}")
+    print(f"   Size mismatches:      {findings['size_mismatches']['count']}")
+    print(f"   Hash mismatches:      {findings['hash_mismatches']['count']}")
+    print(f"   Missing derivatives:  {findings['missing_derivatives']['count']}")
+    print(f"   Orphan files:         {findings['orphans']['count']} ({state['orphan_bytes'] / 1024 / 1024:.1f} MB)")
+    if state["removed"]:
+        print(f"🗑️  Removed {state['removed']} orphan files ({state['removed_bytes'] / 1024 / 1024:.1f} MB)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Check stored files against the images table")
+    parser.add_argument("--delete", action="store_true", help="remove orphan files instead of only reporting them")
+    parser.add_argument("--verify-hashes", action="store_true", help="re-hash every original, not just compare sizes")
+    parser.add_argument("--state", default="reconcile_state.json", help="checkpoint file, also holds the full report")
+    parser.add_argument("--restart", action="store_true", help="ignore a saved checkpoint and start over")
+    parser.add_argument("--workers", type=int, default=settings.RECONCILE_WORKERS, help="threads for storage calls")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    state = None if args.restart else load_state(args.state)
+    if state and state["complete"]:
+        state = None
+    if state:
+        print(f"⏩ Resuming from {args.state} ({state['images_checked']} images, {state['files_checked']} files done)")
+
+    db = SessionLocal()
+    try:
+        state = ReconciliationService(db, workers=args.workers).run(
+            state=state,
+            remove_orphans=args.delete,
+            verify_hashes=args.verify_hashes,
+            checkpoint=lambda state: save_state(args.state, state),
+        )
+    except KeyboardInterrupt:
+        print(f"\n⏸️  Interrupted; run again to resume from {args.state}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+    print_report(state)
+    print(f"📄 Full report in {args.state}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Background job worker for Cheriyan Studio Showcase API
+
+Runs queued jobs (image processing, ...) outside the API process. Start as
+many as needed, and set RUN_JOB_WORKER_IN_APP=false on the API so it only
+enqueues. SIGINT/SIGTERM stop claiming new jobs and let running ones finish
+(up to JOB_DRAIN_SECONDS) before exiting.
+"""
+
+import asyncio
+import signal
+import logging
+
+from app.core.config import settings
+from app.services.job_worker import JobWorker
+from app.utils.processing import shutdown_process_pool
+
+async def main():
+    worker = JobWorker()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+    await worker.run()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    print(f"🔧 Starting job worker ({settings.JOB_CONCURRENCY} concurrent jobs)")
+    try:
+        asyncio.run(main())
+    finally:
+        shutdown_process_pool()
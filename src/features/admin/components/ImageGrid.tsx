@@ -70,7 +70,8 @@ export const ImageGrid: React.FC<ImageGridProps> = ({
   };
 
   const getImageUrl = (image: Image) => {
-    return apiService.getImageUrl(image.file_path);
+    // Public images have no file_path while watermarking is on
+    return image.file_path ? apiService.getImageUrl(image.file_path) : apiService.getMediaUrl(image.url ?? '');
   };
 
   return (
@@ -29,7 +29,8 @@ export interface Image {
   title: string;
   description?: string;
   filename: string;
-  file_path: string;
+  file_path: string | null;
+  url?: string | null;
   file_size?: number;
   mime_type?: string;
   category?: string;
@@ -445,6 +446,10 @@ class ApiService {
   getImageUrl(imagePath: string): string {
     return `${this.baseURL}/static/${imagePath.replace('app/static/', '')}`;
   }
+
+  getMediaUrl(mediaPath: string): string {
+    return `${this.baseURL}${mediaPath}`;
+  }
 }
 
 export const apiService = new ApiService();